@@ -0,0 +1,88 @@
+"""
+Queueing N links with N x POST /download vs. one POST /download/batch.
+
+Reports the time to submit them all, the time until every download has
+finished and how many yt-dlp processes were started. FAKE_YTDLP_STARTUP
+(--startup) stands for the interpreter and extractor start-up every yt-dlp
+process pays, which batch groups pay once per BATCH_GROUP_SIZE videos:
+
+    python benchmarks/bench_batch_submit.py --links 100 --startup 0.5
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from harness import BenchServer, call, write_results
+
+FINISHED = ("completed", "failed", "cancelled")
+
+
+def links(count):
+    return [f"https://www.youtube.com/watch?v=fake{n:07d}" for n in range(1, count + 1)]
+
+
+def wait_finished(server, timeout):
+    """Seconds until every job the server knows about has finished."""
+    start = time.perf_counter()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        _, body, _ = call(server.base_url, "GET", "/downloads")
+        if body["downloads"] and all(job["status"] in FINISHED for job in body["downloads"]):
+            return time.perf_counter() - start, body["downloads"]
+        time.sleep(0.05)
+    raise RuntimeError("downloads did not finish in time")
+
+
+def run(mode, args):
+    spawn_log = tempfile.NamedTemporaryFile(prefix="bilal-spawns-", delete=False).name
+    fake_env = {"FAKE_YTDLP_STARTUP": args.startup, "FAKE_YTDLP_STEPS": args.steps,
+                "FAKE_YTDLP_STEP_DELAY": args.step_delay, "FAKE_YTDLP_SPAWN_LOG": spawn_log}
+    urls = links(args.links)
+    try:
+        with BenchServer(fake_env) as server:
+            start = time.perf_counter()
+            if mode == "batch":
+                status, body, _ = call(server.base_url, "POST", "/download/batch",
+                                       {"quality": "best", "items": [{"url": url} for url in urls]})
+                assert status == 200, body
+            else:
+                for url in urls:
+                    status, body, _ = call(server.base_url, "POST", "/download", {"url": url, "quality": "best"})
+                    assert status == 200, body
+            submitted = time.perf_counter() - start
+            finished, views = wait_finished(server, args.timeout)
+        with open(spawn_log, encoding="utf-8") as f:
+            spawns = sum(1 for _ in f)
+    finally:
+        os.unlink(spawn_log)
+    return {
+        "submit_ms": round(submitted * 1000, 3),
+        "total_seconds": round(submitted + finished, 3),
+        "jobs": len(views),
+        "files": sum(job["files_completed"] for job in views),
+        "ytdlp_processes": spawns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=100)
+    parser.add_argument("--startup", type=float, default=0.5, help="seconds of start-up per yt-dlp process")
+    parser.add_argument("--steps", type=int, default=5, help="progress lines per video")
+    parser.add_argument("--step-delay", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    results = {"links": args.links, "startup": args.startup}
+    for mode in ("single", "batch"):
+        results[mode] = run(mode, args)
+    results["submit_speedup"] = round(results["single"]["submit_ms"] / results["batch"]["submit_ms"], 1)
+    results["total_speedup"] = round(results["single"]["total_seconds"] / results["batch"]["total_seconds"], 2)
+    write_results("batch_submit", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
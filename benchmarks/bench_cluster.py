@@ -0,0 +1,83 @@
+"""
+Throughput of a coordinator leasing jobs to 1, 2, 4... local worker
+processes (CLUSTER_ROLE), each a separate server on its own port running
+the fake yt-dlp. Every worker runs at most HOST_LIMITS jobs per site, so
+with one site throughput should grow with the number of workers.
+
+--lose-worker kills one worker after that many seconds; its jobs must be
+requeued on the others once WORKER_LEASE_TIMEOUT has passed:
+
+    python benchmarks/bench_cluster.py --jobs 24 --workers 1 2 4
+    python benchmarks/bench_cluster.py --jobs 24 --workers 3 --lose-worker 2
+"""
+
+import argparse
+import collections
+import contextlib
+import threading
+import time
+
+from harness import BenchServer, call, write_results
+
+FINISHED = ("completed", "failed", "cancelled")
+
+
+def run(workers, args):
+    fake_env = {"FAKE_YTDLP_STEPS": args.steps, "FAKE_YTDLP_STEP_DELAY": args.step_delay,
+                "FAKE_YTDLP_STARTUP": args.startup}
+    with contextlib.ExitStack() as stack:
+        coordinator = stack.enter_context(BenchServer(fake_env, ["--role", "coordinator"]))
+        nodes = [stack.enter_context(BenchServer(fake_env, ["--role", "worker", "--coordinator",
+                                                            coordinator.base_url]))
+                 for _ in range(workers)]
+        deadline = time.time() + 30
+        while len(call(coordinator.base_url, "GET", "/cluster/workers")[1]["workers"]) < workers:
+            if time.time() > deadline:
+                raise RuntimeError("workers did not register")
+            time.sleep(0.1)
+
+        start = time.perf_counter()
+        for n in range(args.jobs):
+            call(coordinator.base_url, "POST", "/download",
+                 {"url": f"https://www.youtube.com/watch?v=fake{n:07d}", "quality": "best"})
+        if args.lose_worker is not None:
+            threading.Timer(args.lose_worker, nodes[0].process.kill).start()
+
+        deadline = time.time() + args.timeout
+        while time.time() < deadline:
+            views = call(coordinator.base_url, "GET", "/downloads")[1]["downloads"]
+            if len(views) == args.jobs and all(view["status"] in FINISHED for view in views):
+                break
+            time.sleep(0.1)
+        else:
+            raise RuntimeError("jobs did not finish in time")
+        elapsed = time.perf_counter() - start
+
+    return {
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "jobs_per_second": round(args.jobs / elapsed, 2),
+        "completed": sum(view["status"] == "completed" for view in views),
+        "jobs_per_worker": sorted(collections.Counter(view["worker"] for view in views).values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=24)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--steps", type=int, default=20, help="progress lines per video")
+    parser.add_argument("--step-delay", type=float, default=0.05)
+    parser.add_argument("--startup", type=float, default=0.2, help="seconds of start-up per yt-dlp process")
+    parser.add_argument("--lose-worker", type=float, default=None, help="kill one worker after this many seconds")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    results = {"jobs": args.jobs, "job_seconds": args.startup + args.steps * args.step_delay,
+               "lose_worker": args.lose_worker, "runs": [run(workers, args) for workers in args.workers]}
+    write_results("cluster", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Direct downloads ("direct": true) of a big file from a local HTTP server
+that honours Range requests and caps each connection at --conn-rate MiB/s,
+the way many CDNs do, against:
+
+  single_stream  one plain GET of the whole file (a browser download)
+  direct         the server's segmented downloader with 1, 4, 8... connections
+  ytdlp          the same URL through the installed yt-dlp (skipped if it is missing)
+
+For each run: seconds to the finished file, MiB/s, and seconds from the
+POST /download to the first request reaching the file server (the start-up
+a job pays before any byte moves). Every downloaded file is checked
+against the original. --drop-every N cuts every Nth response short, to see
+what the segment retries cost.
+
+  resume         a direct download whose server goes away halfway, so the
+                 job fails, then restarted: it must fetch only what is
+                 missing and report progress (segments k/n, bytes) carried
+                 over from the first run
+
+    python benchmarks/bench_direct.py --size 256 --conn-rate 16 --connections 1 4 8
+    python benchmarks/bench_direct.py --size 64 --conn-rate 0 --drop-every 5
+"""
+
+import argparse
+import hashlib
+import http.client
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from harness import BenchServer, call, write_results
+
+MIB = 1024 * 1024
+FINISHED = ("completed", "failed", "cancelled")
+
+
+class MediaServer(ThreadingHTTPServer):
+    """Serves one file at /media/<name> with keep-alive, Range, ETag and a per-connection rate cap."""
+
+    daemon_threads = True
+
+    def __init__(self, path, conn_rate, drop_every):
+        super().__init__(("127.0.0.1", 0), MediaHandler)
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.conn_rate = conn_rate
+        self.drop_every = drop_every
+        self.refuse = False  # answer 503 and cut running responses, as if the server went away
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+            self.requests = 0
+            self.first_request = None
+            self.bytes_sent = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/media/{os.path.basename(self.path)}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # a client that stops reading (yt-dlp after its probe request)
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            count = server.requests
+            if server.first_request is None:
+                server.first_request = time.perf_counter()
+        if self.path != "/media/" + os.path.basename(server.path):
+            self.send_error(404)
+            return
+        if server.refuse:
+            self.send_error(503)
+            return
+        start, end = 0, server.size
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(server.size, int(match.group(2)) + 1) if match.group(2) else server.size
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{server.size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"bench-media"')
+        self.end_headers()
+        if not body:
+            return
+        drop = server.drop_every and count % server.drop_every == 0
+        if drop:
+            end = start + (end - start) // 2
+        with open(server.path, "rb") as f:
+            f.seek(start)
+            sent, began = 0, time.perf_counter()
+            while start + sent < end:
+                if server.refuse:
+                    self.close_connection = True
+                    return
+                chunk = f.read(min(64 * 1024, end - start - sent))
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                with server.lock:
+                    server.bytes_sent += len(chunk)
+                if server.conn_rate:
+                    ahead = sent / server.conn_rate - (time.perf_counter() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        if drop:
+            self.close_connection = True
+
+
+def make_file(path, size):
+    """`size` bytes where every 1 MiB block differs, so a segment written at the wrong offset shows."""
+    block = os.urandom(MIB)
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        for n in range(-(-size // MIB)):
+            data = (n.to_bytes(8, "big") + block[8:])[:size - n * MIB]
+            f.write(data)
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(MIB), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def result(media, seconds, started, path, expected):
+    return {
+        "seconds": round(seconds, 3),
+        "mib_per_second": round(media.size / MIB / seconds, 1) if seconds else None,
+        "first_request_seconds": round(media.first_request - started, 3) if media.first_request else None,
+        "connections": media.connections,
+        "requests": media.requests,
+        "intact": path is not None and os.path.exists(path) and sha256(path) == expected,
+    }
+
+
+def single_stream(media, expected, directory):
+    """One GET of the whole file, written as it arrives."""
+    media.reset()
+    path = os.path.join(directory, "single_stream.mp4")
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection("127.0.0.1", media.server_address[1], timeout=60)
+    connection.request("GET", "/media/" + os.path.basename(media.path))
+    response = connection.getresponse()
+    with open(path, "wb") as f:
+        shutil.copyfileobj(response, f, 256 * 1024)
+    connection.close()
+    return result(media, time.perf_counter() - start, start, path, expected)
+
+
+def server_download(media, expected, extra_args, body, timeout):
+    """Queue the file on a fresh download server and wait for its job to finish."""
+    media.reset()
+    directory = tempfile.mkdtemp(prefix="bilal-bench-direct-")
+    try:
+        with BenchServer(None, ["--download-dir", directory] + extra_args) as server:
+            start = time.perf_counter()
+            job_id = call(server.base_url, "POST", "/download", dict(body, url=media.url))[1]["id"]
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                view = next(v for v in call(server.base_url, "GET", "/downloads")[1]["downloads"] if v["id"] == job_id)
+                if view["status"] in FINISHED:
+                    break
+                time.sleep(0.02)
+            else:
+                raise RuntimeError("download did not finish in time")
+            seconds = time.perf_counter() - start
+        stats = result(media, seconds, start, view["filepath"], expected)
+        stats["status"] = view["status"]
+        if view["error"]:
+            stats["error"] = view["error"]
+        return stats
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def job_view(server, job_id):
+    return next(v for v in call(server.base_url, "GET", "/downloads")[1]["downloads"] if v["id"] == job_id)
+
+
+def wait_view(server, job_id, done, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        view = job_view(server, job_id)
+        if done(view):
+            return view
+        time.sleep(0.02)
+    raise RuntimeError("download did not reach the expected state in time")
+
+
+def resume(media, expected, connections, timeout):
+    """Fail a direct download halfway by refusing requests, restart it, and compare its progress."""
+    media.reset()
+    directory = tempfile.mkdtemp(prefix="bilal-bench-direct-")
+    try:
+        with BenchServer(None, ["--download-dir", directory, "--direct-connections", str(connections),
+                                "--direct-retry-delay", "0.05"]) as server:
+            job_id = call(server.base_url, "POST", "/download", {"url": media.url, "direct": True})[1]["id"]
+            wait_view(server, job_id, lambda v: (v["downloaded_bytes"] or 0) >= media.size // 2, timeout)
+            media.refuse = True
+            failed = wait_view(server, job_id, lambda v: v["status"] in FINISHED, timeout)
+            media.refuse = False
+            first_run_bytes = media.bytes_sent
+            call(server.base_url, "POST", "/restart", {"id": job_id})
+            resumed = wait_view(server, job_id, lambda v: v["status"] in FINISHED or v["fragment_count"], timeout)
+            done = wait_view(server, job_id, lambda v: v["status"] in FINISHED, timeout)
+        return {
+            "status_before_restart": failed["status"],
+            "segments_before_failure": [failed["fragment_index"], failed["fragment_count"]],
+            "segments_at_resume": [resumed["fragment_index"], resumed["fragment_count"]],
+            "bytes_at_resume": resumed["downloaded_bytes"],
+            "segments_at_end": [done["fragment_index"], done["fragment_count"]],
+            "progress_carried_over": (resumed["fragment_count"] == failed["fragment_count"]
+                                      and (resumed["fragment_index"] or 0) >= (failed["fragment_index"] or 0)
+                                      and resumed["downloaded_bytes"] >= failed["downloaded_bytes"]),
+            "refetched_mib": round((media.bytes_sent - first_run_bytes - (media.size - failed["downloaded_bytes"]))
+                                   / MIB, 1),
+            "status": done["status"],
+            "intact": done["filepath"] is not None and os.path.exists(done["filepath"])
+            and sha256(done["filepath"]) == expected,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=256, help="MiB")
+    parser.add_argument("--conn-rate", type=float, default=16, help="MiB/s per connection (0 for no cap)")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 4, 8], help="DIRECT_CONNECTIONS to try")
+    parser.add_argument("--drop-every", type=int, default=0, help="cut every Nth response short")
+    parser.add_argument("--no-ytdlp", action="store_true", help="skip the yt-dlp run")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bilal-bench-media-")
+    try:
+        path = os.path.join(workdir, "bench.mp4")
+        expected = make_file(path, args.size * MIB)
+        results = {"size_mib": args.size, "conn_rate_mib": args.conn_rate, "drop_every": args.drop_every}
+        with MediaServer(path, args.conn_rate * MIB, args.drop_every) as media:
+            results["single_stream"] = single_stream(media, expected, workdir)
+            results["direct"] = [
+                dict(server_download(media, expected, ["--direct-connections", str(n)], {"direct": True},
+                                     args.timeout), connections_per_job=n)
+                for n in args.connections
+            ]
+            if args.conn_rate and not args.drop_every:  # needs time to fail it halfway, and no drops of its own
+                results["resume"] = resume(media, expected, max(args.connections), args.timeout)
+            if not args.no_ytdlp and shutil.which("yt-dlp"):
+                results["ytdlp"] = server_download(media, expected, ["--real-ytdlp"], {"quality": "best"},
+                                                   args.timeout)
+        write_results("direct", results, args.output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Per-item download latency: one yt-dlp subprocess per video vs. the pooled
+in-process engine (DOWNLOAD_ENGINE = "pool").
+
+Uses a real yt-dlp (`pip install yt-dlp`) with a local fake extractor,
+installed as a yt-dlp plugin in a temp dir, whose videos are served by a
+local HTTP server. No network access is needed.
+
+    python benchmarks/bench_engines.py --items 20 --size 1000000
+"""
+
+import argparse
+import http.server
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from harness import summarize_ms, write_results  # noqa: E402
+
+FAKE_EXTRACTOR = '''
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class FakeBenchIE(InfoExtractor):
+    _VALID_URL = r"fakebench://(?P<port>\\d+)/(?P<id>\\w+)"
+
+    def _real_extract(self, url):
+        port, video_id = self._match_valid_url(url).group("port", "id")
+        return {
+            "id": video_id,
+            "title": "Bench " + video_id,
+            "url": "http://127.0.0.1:%s/media.mp4" % port,
+            "ext": "mp4",
+        }
+'''
+
+# These need ffmpeg; dropped from the command when it isn't installed
+FFMPEG_ARGS = ("--embed-thumbnail", "--add-metadata")
+
+
+class Output:
+    """Collects what a run reports, like download_server.JobOutput does."""
+
+    def __init__(self):
+        self.errors = []
+
+    def line(self, line):
+        if line.startswith("ERROR:"):
+            self.errors.append(line.strip())
+
+
+def serve_media(size):
+    body = os.urandom(size)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mp4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def install_plugin(root):
+    plugin_dir = os.path.join(root, "yt_dlp_plugins", "extractor")
+    os.makedirs(plugin_dir)
+    with open(os.path.join(plugin_dir, "fakebench.py"), "w", encoding="utf-8") as f:
+        f.write(FAKE_EXTRACTOR)
+    # yt-dlp subprocesses find the plugin through PYTHONPATH; pool workers are
+    # spawned with this process's sys.path
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))
+    sys.path.insert(0, root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--size", type=int, default=1000000, help="bytes per fake video")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bilal-engines-")
+    install_plugin(root)
+    import download_server
+
+    download_server.DOWNLOAD_DIR = os.path.join(root, "downloads")
+    download_server.download_archive.directory = None  # every run should really download
+    prefix = [sys.executable, "-m", "yt_dlp"]
+    download_server.toolchain.use("yt-dlp", prefix)
+    ffmpeg = shutil.which("ffmpeg") is not None
+    media = serve_media(args.size)
+
+    def command(n):
+        url = f"fakebench://{media.server_port}/item{n}"
+        cmd = download_server.build_download_command(prefix, url, "other", False, "")
+        return cmd if ffmpeg else [a for a in cmd if a not in FFMPEG_ARGS]
+
+    results = {"items": args.items, "size": args.size, "ffmpeg": ffmpeg}
+    try:
+        times, errors = [], 0
+        for n in range(args.items):
+            start = time.perf_counter()
+            process = download_server.start_ytdlp_process(command(n))
+            output = Output()
+            for line in process.stdout:
+                output.line(line)
+            errors += process.wait() != 0
+            times.append(time.perf_counter() - start)
+        results["subprocess"] = dict(summarize_ms(times), failed=errors)
+
+        start = time.perf_counter()
+        pool = download_server.YtdlpPool(workers=1).start()
+        results["pool_startup_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        times, errors = [], 0
+        for n in range(args.items, 2 * args.items):
+            start = time.perf_counter()
+            output = Output()
+            returncode = pool.run(f"bench{n}", download_server._pool_download,
+                                  download_server.ytdlp_args(command(n)), output)
+            errors += returncode != 0
+            times.append(time.perf_counter() - start)
+        results["pool"] = dict(summarize_ms(times), failed=errors)
+    finally:
+        media.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    write_results("engines", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Request rate and bytes on the wire of dashboard tabs polling the JSON API
+(GET /downloads, /status and /ping), for clients that use more and more of
+what the server offers:
+
+  close     a new connection per request, full bodies (what an HTTP/1.0 server gave every client)
+  keepalive one persistent connection per tab
+  etag      + If-None-Match, so an unchanged job list comes back as 304
+  gzip      + Accept-Encoding: gzip
+
+The server holds --finished jobs, and --active downloads that keep
+reporting progress (0 for an idle queue). "rate" polls as fast as it can
+for --seconds; "traffic" polls every --interval seconds like a dashboard:
+
+    python benchmarks/bench_http.py --tabs 8 --finished 200 --active 2
+"""
+
+import argparse
+import gzip
+import socket
+import threading
+import time
+
+from harness import BenchServer, call, summarize_ms, write_results
+
+MODES = {
+    "close": {"keep_alive": False, "etag": False, "gzip": False},
+    "keepalive": {"keep_alive": True, "etag": False, "gzip": False},
+    "etag": {"keep_alive": True, "etag": True, "gzip": False},
+    "gzip": {"keep_alive": True, "etag": True, "gzip": True},
+}
+PATHS = ("/downloads", "/status", "/ping")
+
+
+class WireClient:
+    """Minimal HTTP client that counts the bytes it sends and receives, and the connections it opens."""
+
+    def __init__(self, port, keep_alive, etag, gzip):
+        self.port = port
+        self.keep_alive = keep_alive
+        self.etag = etag
+        self.gzip = gzip
+        self.sock = None
+        self.buffer = b""
+        self.etags = {}
+        self.sent = self.received = self.connections = 0
+        self.statuses = {}
+
+    def get(self, path):
+        if self.sock is None:
+            self.sock = socket.create_connection(("127.0.0.1", self.port))
+            self.connections += 1
+        lines = [f"GET {path} HTTP/1.1", "Host: 127.0.0.1",
+                 "Connection: " + ("keep-alive" if self.keep_alive else "close")]
+        if self.gzip:
+            lines.append("Accept-Encoding: gzip, deflate")
+        if self.etag and path in self.etags:
+            lines.append(f"If-None-Match: {self.etags[path]}")
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode()
+        self.sock.sendall(request)
+        self.sent += len(request)
+
+        head = self._read_until(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if status == 304 or status < 200:
+            body = b""
+        elif "content-length" in headers:
+            body = self._read_exactly(int(headers["content-length"]))
+        else:
+            body = self._read_to_end()
+        if headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+        if "etag" in headers:
+            self.etags[path] = headers["etag"]
+        if not self.keep_alive or headers.get("connection", "").lower() == "close" or self.sock is None:
+            self.close()
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        return status, body
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.buffer = b""
+
+    def _recv(self):
+        data = self.sock.recv(65536)
+        self.received += len(data)
+        return data
+
+    def _read_until(self, marker):
+        while marker not in self.buffer:
+            data = self._recv()
+            if not data:
+                raise ConnectionError("connection closed mid-response")
+            self.buffer += data
+        head, _, self.buffer = self.buffer.partition(marker)
+        return head
+
+    def _read_exactly(self, size):
+        while len(self.buffer) < size:
+            data = self._recv()
+            if not data:
+                raise ConnectionError("connection closed mid-body")
+            self.buffer += data
+        body, self.buffer = self.buffer[:size], self.buffer[size:]
+        return body
+
+    def _read_to_end(self):
+        while True:
+            data = self._recv()
+            if not data:
+                break
+            self.buffer += data
+        body, self.buffer = self.buffer, b""
+        self.close()
+        return body
+
+
+def poll(port, mode, tabs, seconds, interval):
+    """Every tab polls PATHS in turn (a round every `interval` seconds, 0 for flat out)."""
+    clients = [WireClient(port, **MODES[mode]) for _ in range(tabs)]
+    latencies = [[] for _ in range(tabs)]
+    deadline = time.perf_counter() + seconds
+
+    def tab(i):
+        client = clients[i]
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            for path in PATHS:
+                start = time.perf_counter()
+                client.get(path)
+                latencies[i].append(time.perf_counter() - start)
+            if interval:
+                time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+        client.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=tab, args=(i,)) for i in range(tabs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    requests = sum(len(tab_latencies) for tab_latencies in latencies)
+    received = sum(client.received for client in clients)
+    sent = sum(client.sent for client in clients)
+    statuses = {}
+    for client in clients:
+        for status, count in client.statuses.items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+    return {
+        "requests": requests,
+        "requests_per_second": round(requests / elapsed, 1),
+        "connections": sum(client.connections for client in clients),
+        "statuses": statuses,
+        "received_bytes": received,
+        "sent_bytes": sent,
+        "wire_bytes_per_request": round((received + sent) / requests),
+        "latency": summarize_ms([value for tab_latencies in latencies for value in tab_latencies]),
+    }
+
+
+def fill_jobs(server, finished, active):
+    """Queue `finished` quick downloads and wait for them, then start `active` that keep going."""
+    for n in range(finished):
+        call(server.base_url, "POST", "/download", {"url": f"https://www.youtube.com/watch?v=done{n:07d}"})
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        views = call(server.base_url, "GET", "/downloads")[1]["downloads"]
+        if all(view["status"] in ("completed", "failed") for view in views):
+            break
+        time.sleep(0.2)
+    else:
+        raise RuntimeError("jobs did not finish in time")
+    for n in range(active):
+        call(server.base_url, "POST", "/download", {"url": f"https://www.youtube.com/watch?v=live{n:07d}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tabs", type=int, default=8)
+    parser.add_argument("--finished", type=int, default=200, help="finished jobs in the list")
+    parser.add_argument("--active", type=int, default=2, help="downloads reporting progress while polling")
+    parser.add_argument("--seconds", type=float, default=5, help="length of each run")
+    parser.add_argument("--interval", type=float, default=1.0, help="traffic: seconds between a tab's polls")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    # The "live…" videos report progress every 0.2 s until the server stops
+    fake_env = {"FAKE_YTDLP_STEPS": 1, "FAKE_YTDLP_STEP_DELAY": 0, "FAKE_YTDLP_ENDLESS": "live"}
+    results = {"tabs": args.tabs, "finished": args.finished, "active": args.active, "interval": args.interval}
+    with BenchServer(fake_env, ["--max-concurrent", str(max(4, args.active + 2))]) as server:
+        fill_jobs(server, args.finished, args.active)
+        time.sleep(1)
+        for mode in args.modes:
+            results[mode] = {
+                "rate": poll(server.port, mode, args.tabs, args.seconds, 0),
+                "traffic": poll(server.port, mode, args.tabs, args.seconds, args.interval),
+            }
+    write_results("http", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
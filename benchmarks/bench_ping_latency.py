@@ -0,0 +1,75 @@
+"""
+/ping latency while N /playlist-info enumerations are in flight.
+
+Each playlist-info call runs the fake yt-dlp, which takes
+FAKE_YTDLP_PLAYLIST_SIZE x --entry-delay seconds to list the playlist.
+Compare the default threaded server with --single-threaded (the old
+HTTPServer front end):
+
+    python benchmarks/bench_ping_latency.py --playlist-calls 8
+    python benchmarks/bench_ping_latency.py --playlist-calls 8 --single-threaded
+"""
+
+import argparse
+import threading
+import time
+
+from harness import BenchServer, call, summarize_ms, write_results
+
+POPUP_PING_TIMEOUT = 1.5  # popup.js gives /ping this long before reporting the server down
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--playlist-calls", type=int, default=8, help="concurrent /playlist-info clients")
+    parser.add_argument("--playlist-size", type=int, default=100)
+    parser.add_argument("--entry-delay", type=float, default=0.01, help="seconds per playlist entry")
+    parser.add_argument("--pings", type=int, default=200)
+    parser.add_argument("--ping-interval", type=float, default=0.01)
+    parser.add_argument("--single-threaded", action="store_true")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    fake_env = {"FAKE_YTDLP_PLAYLIST_SIZE": args.playlist_size, "FAKE_YTDLP_ENTRY_DELAY": args.entry_delay}
+    extra = ["--single-threaded"] if args.single_threaded else []
+    stop = threading.Event()
+    playlist_times = []
+    latencies = []
+    timeouts = 0
+
+    with BenchServer(fake_env, extra) as server:
+        def enumerate_playlists():
+            while not stop.is_set():
+                _, _, elapsed = call(server.base_url, "POST", "/playlist-info",
+                                     {"url": "https://www.youtube.com/playlist?list=PLfake"}, timeout=120)
+                playlist_times.append(elapsed)
+
+        clients = [threading.Thread(target=enumerate_playlists, daemon=True) for _ in range(args.playlist_calls)]
+        for client in clients:
+            client.start()
+        time.sleep(0.2)  # let the enumerations get going
+
+        for _ in range(args.pings):
+            try:
+                _, _, elapsed = call(server.base_url, "GET", "/ping", timeout=POPUP_PING_TIMEOUT)
+                latencies.append(elapsed)
+            except OSError:
+                timeouts += 1
+            time.sleep(args.ping_interval)
+        stop.set()
+        for client in clients:
+            client.join(timeout=120)
+
+    write_results("ping_latency", {
+        "server": "single-threaded" if args.single_threaded else "threaded",
+        "playlist_calls": args.playlist_calls,
+        "playlist_size": args.playlist_size,
+        "entry_delay": args.entry_delay,
+        "ping": summarize_ms(latencies),
+        "ping_timeouts": timeouts,
+        "playlist_info": summarize_ms(playlist_times),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
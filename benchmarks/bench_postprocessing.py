@@ -0,0 +1,170 @@
+"""
+Wall time of a mixed audio/video batch with post-processing inside the
+download slot vs. in the separate post-processing stage
+(SEPARATE_POSTPROCESSING).
+
+Needs yt-dlp (`pip install yt-dlp`) and ffmpeg/ffprobe in PATH. Synthetic
+media is generated with ffmpeg and served by a local HTTP server that
+throttles each connection, through a fake extractor installed as a yt-dlp
+plugin; no network access is needed. Audio jobs are transcoded to mp3
+(CPU bound), video jobs get the thumbnail and metadata embedded.
+
+    python benchmarks/bench_postprocessing.py --jobs 8 --duration 120
+"""
+
+import argparse
+import http.server
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from harness import write_results  # noqa: E402
+
+FAKE_EXTRACTOR = '''
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class FakeMediaIE(InfoExtractor):
+    _VALID_URL = r"fakemedia://(?P<port>\\d+)/(?P<id>\\w+)"
+
+    def _real_extract(self, url):
+        port, video_id = self._match_valid_url(url).group("port", "id")
+        base = "http://127.0.0.1:%s/" % port
+        return {
+            "id": video_id,
+            "title": "Media " + video_id,
+            "thumbnail": base + "thumb.jpg",
+            "formats": [
+                {"format_id": "v", "url": base + "video.mp4", "ext": "mp4",
+                 "vcodec": "avc1", "acodec": "none", "height": 360},
+                {"format_id": "a", "url": base + "audio.m4a", "ext": "m4a",
+                 "vcodec": "none", "acodec": "mp4a"},
+            ],
+        }
+'''
+
+
+def make_media(directory, duration):
+    """Generate a video-only mp4, an audio-only m4a and a thumbnail with ffmpeg."""
+    ffmpeg = ["ffmpeg", "-loglevel", "error", "-y"]
+    subprocess.run(ffmpeg + ["-f", "lavfi", "-i", "testsrc=size=640x360:rate=25", "-t", str(duration),
+                             "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+                             os.path.join(directory, "video.mp4")], check=True)
+    subprocess.run(ffmpeg + ["-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100", "-t", str(duration),
+                             "-c:a", "aac", "-b:a", "128k", os.path.join(directory, "audio.m4a")], check=True)
+    subprocess.run(ffmpeg + ["-f", "lavfi", "-i", "testsrc=size=320x180", "-frames:v", "1",
+                             os.path.join(directory, "thumb.jpg")], check=True)
+
+
+def serve_media(directory, rate):
+    """Serve the media files, each connection throttled to `rate` bytes/s."""
+    chunk = 64 * 1024
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = os.path.join(directory, os.path.basename(self.path))
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+            with open(path, "rb") as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            for offset in range(0, len(body), chunk):
+                self.wfile.write(body[offset:offset + chunk])
+                time.sleep(chunk / rate)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def install_plugin(root):
+    plugin_dir = os.path.join(root, "yt_dlp_plugins", "extractor")
+    os.makedirs(plugin_dir)
+    with open(os.path.join(plugin_dir, "fakemedia.py"), "w", encoding="utf-8") as f:
+        f.write(FAKE_EXTRACTOR)
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))
+
+
+def run_batch(download_server, port, jobs, separate, concurrency):
+    """Queue `jobs` downloads (alternating audio/best) and return the seconds until all are finished."""
+    ds = download_server
+    ds.SEPARATE_POSTPROCESSING = separate
+    ds.postprocessing = ds.PostProcessingQueue()
+    ds.postprocessing.start()
+    if separate:
+        ds.postprocessing.ready.wait()  # pool warm-up is not part of the measurement
+    ds.scheduler = ds.DownloadScheduler(ds.run_download_job, max_concurrent=concurrency,
+                                        default_host_limit=concurrency)
+    ds.scheduler.start()
+    batch = []
+    start = time.perf_counter()
+    for n in range(jobs):
+        quality = "audio" if n % 2 == 0 else "best"
+        url = f"fakemedia://{port}/{'sep' if separate else 'inline'}{n}"
+        job = ds.DownloadJob(url, quality, False, "", ds.build_download_command(ds.get_ytdlp_cmd(), url, quality,
+                                                                                  False, ""))
+        ds.jobs.add(job)
+        ds.scheduler.submit(job)
+        batch.append(job)
+    while any(job.status not in ds.FINISHED_STATUSES for job in batch):
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    failed = sum(job.status != "completed" for job in batch)
+    return elapsed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--duration", type=int, default=120, help="seconds of synthetic media per file")
+    parser.add_argument("--rate", type=int, default=2 * 1024 * 1024, help="bytes/s per download connection")
+    parser.add_argument("--concurrency", type=int, default=2, help="MAX_CONCURRENT_DOWNLOADS for the run")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+        sys.exit("ffmpeg and ffprobe are needed in PATH")
+    root = tempfile.mkdtemp(prefix="bilal-postprocess-")
+    media_dir = os.path.join(root, "media")
+    os.makedirs(media_dir)
+    make_media(media_dir, args.duration)
+    install_plugin(root)
+    import download_server
+
+    download_server.toolchain.use("yt-dlp", [sys.executable, "-m", "yt_dlp"])
+    download_server.download_archive.directory = None
+    download_server.metadata_cache.path = None
+    download_server.jobs.start()
+    media = serve_media(media_dir, args.rate)
+
+    results = {"jobs": args.jobs, "duration": args.duration, "rate": args.rate,
+               "concurrency": args.concurrency, "postprocess_workers": download_server.POSTPROCESS_WORKERS,
+               "media_bytes": sum(os.path.getsize(os.path.join(media_dir, f)) for f in os.listdir(media_dir))}
+    try:
+        for name, separate in (("inline", False), ("separate", True)):
+            download_server.DOWNLOAD_DIR = os.path.join(root, name)
+            elapsed, failed = run_batch(download_server, media.server_port, args.jobs, separate, args.concurrency)
+            results[name] = {"seconds": round(elapsed, 3), "failed": failed}
+        results["speedup"] = round(results["inline"]["seconds"] / results["separate"]["seconds"], 2)
+    finally:
+        media.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    write_results("postprocessing", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+The server's hot paths against the fake yt-dlp, in one run with one JSON
+result, so runs can be compared with compare.py (no network needed):
+
+  throughput     jobs/s, POST /download latency, queue wait and time to finish
+  playlist_info  /playlist-info first page, full NDJSON listing and cached reply vs. playlist size
+  parse          cost per line of yt-dlp output in JobOutput (in-process), by kind of line
+  retry          wall time of a playlist with every Nth video failing on a network error,
+                 vs. the same playlist without failures
+  batch_retry    a /download/batch of Vimeo and TikTok videos with every Nth failing on a network
+                 error once: every video must end up saved, retried by its own URL
+  memory         server RSS per active job, and RSS of each yt-dlp (fake) process
+
+    python benchmarks/bench_suite.py --output before.json
+    python benchmarks/bench_suite.py --only parse retry --output after.json
+    python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.request
+
+from harness import BenchServer, call, child_pids, rss_bytes, summarize_ms, write_results
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+PLAYLIST_URL = "https://www.youtube.com/playlist?list=PLfakebench"
+FINISHED = ("completed", "failed", "cancelled")
+
+
+def video_url(n):
+    return f"https://www.youtube.com/watch?v=fake{n:07d}"
+
+
+def wait_jobs(server, done, timeout=300):
+    """Poll /downloads until done(views) is true; returns the views."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        views = call(server.base_url, "GET", "/downloads")[1]["downloads"]
+        if done(views):
+            return views
+        time.sleep(0.05)
+    raise RuntimeError("jobs did not reach the expected state in time")
+
+
+def all_finished(count):
+    return lambda views: len(views) >= count and all(view["status"] in FINISHED for view in views)
+
+
+def bench_throughput(args):
+    fake_env = {"FAKE_YTDLP_STEPS": args.steps, "FAKE_YTDLP_STEP_DELAY": args.step_delay}
+    with BenchServer(fake_env, ["--max-concurrent", str(args.concurrency)]) as server:
+        latencies = []
+        start = time.perf_counter()
+        for n in range(args.jobs):
+            _, _, elapsed = call(server.base_url, "POST", "/download", {"url": video_url(n), "quality": "best"})
+            latencies.append(elapsed)
+        views = wait_jobs(server, all_finished(args.jobs))
+        elapsed = time.perf_counter() - start
+    return {
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 3),
+        "jobs_per_second": round(args.jobs / elapsed, 2),
+        "failed": sum(view["status"] != "completed" for view in views),
+        "post_download": summarize_ms(latencies),
+        "queue_wait": summarize_ms([view["started"] - view["created"] for view in views]),
+        "submit_to_finish": summarize_ms([view["finished"] - view["created"] for view in views]),
+    }
+
+
+def stream_listing(base_url, body):
+    """POST /playlist-info with stream=true. Returns (seconds to first entry, seconds to the end, entries)."""
+    request = urllib.request.Request(base_url + "/playlist-info", data=json.dumps(dict(body, stream=True)).encode(),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    start = time.perf_counter()
+    first = None
+    entries = 0
+    with urllib.request.urlopen(request, timeout=300) as response:
+        for line in response:
+            record = json.loads(line)
+            if "id" in record:
+                entries += 1
+                if first is None:
+                    first = time.perf_counter() - start
+    return first, time.perf_counter() - start, entries
+
+
+def bench_playlist_info(args):
+    results = []
+    for size in args.playlist_sizes:
+        fake_env = {"FAKE_YTDLP_PLAYLIST_SIZE": size, "FAKE_YTDLP_ENTRY_DELAY": args.entry_delay}
+        with BenchServer(fake_env) as server:
+            _, _, first_page = call(server.base_url, "POST", "/playlist-info", {"url": PLAYLIST_URL, "limit": 50})
+            first, full, entries = stream_listing(server.base_url, {"url": PLAYLIST_URL, "refresh": True})
+            _, _, cached = call(server.base_url, "POST", "/playlist-info", {"url": PLAYLIST_URL, "limit": 50})
+        results.append({
+            "size": size,
+            "entries": entries,
+            "first_page_ms": round(first_page * 1000, 3),
+            "stream_first_entry_ms": round(first * 1000, 3) if first is not None else None,
+            "stream_full_ms": round(full * 1000, 3),
+            "cached_first_page_ms": round(cached * 1000, 3),
+        })
+    return results
+
+
+def bench_parse(args):
+    import download_server as ds
+    import fake_ytdlp
+
+    ds.SEPARATE_POSTPROCESSING = False
+    ds.download_archive.directory = None
+    ds.staging.directory = None
+    ds.metadata_cache.path = None
+    ds.LOG_DIR = tempfile.mkdtemp(prefix="bilal-bench-logs-")
+    ds.CONSOLE_LOG_LEVEL = "CRITICAL"  # job logs are written as in the server; the console stays quiet
+    listener = ds.setup_logging()
+    job = ds.DownloadJob(PLAYLIST_URL, "best", True, "", None)
+    ds.jobs.add(job)
+    cmd = ds.get_progress_args()
+    progress_template = cmd[cmd.index("--progress-template") + 1].split(":", 1)[1]
+    prints = dict(value.split(":", 1) for value in cmd[cmd.index("--print"):] if ":" in value)
+    info = {"id": "fake0000001", "title": "Fake video 1", "playlist_index": 1, "n_entries": args.lines,
+            "playlist_title": "Fake playlist", "extractor_key": "Youtube", "filepath": "/tmp/Fake video 1.mp4"}
+    size = 100 * 1024 * 1024
+
+    def progress_line(n):
+        progress = {"status": "downloading", "downloaded_bytes": n * 1024, "total_bytes": size,
+                    "speed": 5 * 1024 * 1024, "eta": 20, "fragment_index": n % 100, "fragment_count": 100}
+        return fake_ytdlp.render(progress_template, info, progress)
+
+    kinds = {
+        "progress": [progress_line(n) for n in range(args.lines)],
+        "item": [fake_ytdlp.render(prints["before_dl"], dict(info, playlist_index=n % 500 + 1))
+                 for n in range(args.lines)],
+        "file": [fake_ytdlp.render(prints["after_move"], info)] * args.lines,
+        "other": ["[youtube] fake0000001: Downloading webpage"] * args.lines,
+        "network_error": ["ERROR: [youtube] fake0000001: Unable to download webpage: <urlopen error timed out>"]
+                         * args.lines,
+    }
+    results = {}
+    for kind, lines in kinds.items():
+        output = ds.JobOutput(job, {}, set())
+        start = time.perf_counter()
+        for line in lines:
+            output.line(line)
+        results[kind] = {"lines": len(lines), "us_per_line": round((time.perf_counter() - start) / len(lines) * 1e6, 2)}
+    listener.stop()
+    shutil.rmtree(ds.LOG_DIR, ignore_errors=True)
+    return results
+
+
+def run_playlist(args, fail_every):
+    fake_env = {"FAKE_YTDLP_PLAYLIST_SIZE": args.retry_playlist, "FAKE_YTDLP_FAIL_EVERY": fail_every,
+                "FAKE_YTDLP_STEPS": args.steps, "FAKE_YTDLP_STEP_DELAY": args.step_delay}
+    with BenchServer(fake_env, ["--retry-delay", str(args.retry_delay)]) as server:
+        start = time.perf_counter()
+        call(server.base_url, "POST", "/download", {"url": PLAYLIST_URL, "playlist": True, "quality": "best"})
+        view = wait_jobs(server, all_finished(1))[0]
+        return time.perf_counter() - start, view
+
+
+def bench_retry(args):
+    clean, _ = run_playlist(args, 0)
+    seconds, view = run_playlist(args, args.fail_every)
+    return {
+        "playlist_size": args.retry_playlist,
+        "failed_first_time": args.retry_playlist // args.fail_every,
+        "retry_delay": args.retry_delay,
+        "status": view["status"],
+        "files_completed": view["files_completed"],
+        "seconds": round(seconds, 3),
+        "seconds_without_failures": round(clean, 3),
+        "retry_overhead_seconds": round(seconds - clean, 3),
+    }
+
+
+def bench_batch_retry(args):
+    count = args.retry_playlist
+    urls = [f"https://vimeo.com/{10000000 + n}" for n in range(1, count + 1)]
+    urls += [f"https://www.tiktok.com/@bench/video/{7234567890123450000 + n}" for n in range(1, count + 1)]
+    state_dir = tempfile.mkdtemp(prefix="bilal-bench-fake-state-")
+    fake_env = {"FAKE_YTDLP_FAIL_EVERY": args.fail_every, "FAKE_YTDLP_STATE_DIR": state_dir,
+                "FAKE_YTDLP_STEPS": args.steps, "FAKE_YTDLP_STEP_DELAY": args.step_delay}
+    try:
+        with BenchServer(fake_env, ["--retry-delay", str(args.retry_delay)]) as server:
+            start = time.perf_counter()
+            body = {"items": [{"url": url} for url in urls]}
+            jobs = call(server.base_url, "POST", "/download/batch", body)[1]["jobs"]
+            views = wait_jobs(server, all_finished(len(jobs)))
+            seconds = time.perf_counter() - start
+        failed_first_time = len(os.listdir(state_dir))
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+    return {
+        "videos": len(urls),
+        "jobs": len(jobs),
+        "failed_first_time": failed_first_time,
+        "statuses": sorted(view["status"] for view in views),
+        "files_completed": sum(view["files_completed"] for view in views),
+        "all_saved": sum(view["files_completed"] for view in views) == len(urls),
+        "seconds": round(seconds, 3),
+    }
+
+
+def bench_memory(args):
+    count = args.memory_jobs
+    fake_env = {"FAKE_YTDLP_STEPS": 100000, "FAKE_YTDLP_STEP_DELAY": 0.05}  # runs until cancelled
+    with BenchServer(fake_env, ["--max-concurrent", str(count)]) as server:
+        time.sleep(1)
+        idle = rss_bytes(server.process.pid)
+        ids = [call(server.base_url, "POST", "/download", {"url": video_url(n)})[1]["id"] for n in range(count)]
+        wait_jobs(server, lambda views: sum(view["downloaded_bytes"] is not None for view in views) >= count)
+        time.sleep(1)
+        busy = rss_bytes(server.process.pid)
+        children = [rss for rss in map(rss_bytes, child_pids(server.process.pid, "fake_ytdlp")) if rss]
+        for job_id in ids:
+            call(server.base_url, "POST", "/cancel", {"id": job_id})
+    if idle is None or busy is None:
+        return {"error": "needs /proc (Linux)"}
+    return {
+        "active_jobs": count,
+        "server_idle_rss": idle,
+        "server_busy_rss": busy,
+        "server_bytes_per_job": (busy - idle) // count,
+        "ytdlp_processes": len(children),
+        "ytdlp_rss_per_process": sum(children) // len(children) if children else None,
+    }
+
+
+SCENARIOS = {
+    "throughput": bench_throughput,
+    "playlist_info": bench_playlist_info,
+    "parse": bench_parse,
+    "retry": bench_retry,
+    "batch_retry": bench_batch_retry,
+    "memory": bench_memory,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=list(SCENARIOS), help="run only these scenarios")
+    parser.add_argument("--jobs", type=int, default=40, help="throughput: single-video jobs")
+    parser.add_argument("--concurrency", type=int, default=8, help="throughput: jobs running at once")
+    parser.add_argument("--steps", type=int, default=10, help="progress lines per fake video")
+    parser.add_argument("--step-delay", type=float, default=0.02)
+    parser.add_argument("--playlist-sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--entry-delay", type=float, default=0.0, help="playlist_info: seconds per listed entry")
+    parser.add_argument("--lines", type=int, default=20000, help="parse: lines per kind")
+    parser.add_argument("--retry-playlist", type=int, default=30,
+                        help="retry: playlist size; batch_retry: videos per site")
+    parser.add_argument("--fail-every", type=int, default=5)
+    parser.add_argument("--retry-delay", type=float, default=0.5, help="retry: FAILED_ITEM_RETRY_DELAY")
+    parser.add_argument("--memory-jobs", type=int, default=8)
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or SCENARIOS:
+        print(f"[suite] {name}...", file=sys.stderr)
+        results[name] = SCENARIOS[name](args)
+    write_results("suite", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
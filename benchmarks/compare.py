@@ -0,0 +1,72 @@
+"""
+Compare two benchmark result files written with --output and flag
+regressions beyond a threshold:
+
+    python benchmarks/compare.py before.json after.json --threshold 10
+
+Numbers are matched by their path in the results. Times, latencies and
+sizes (…_ms, …seconds, …_us…, …rss…, …bytes…) are better when lower;
+rates (…per_second, speedup) when higher; anything else is only shown.
+Exits with status 1 if something regressed.
+"""
+
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("_ms", "seconds", "us_per", "rss", "bytes")
+HIGHER_IS_BETTER = ("per_second", "speedup")
+
+
+def flatten(value, prefix=""):
+    """{"a.b.0.c": number} for every number in nested dicts and lists."""
+    if isinstance(value, bool):
+        return {}
+    if isinstance(value, (int, float)):
+        return {prefix: value}
+    items = value.items() if isinstance(value, dict) else enumerate(value) if isinstance(value, list) else ()
+    flat = {}
+    for key, item in items:
+        flat.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+    return flat
+
+
+def direction(path):
+    name = path.rsplit(".", 1)[-1]
+    if any(marker in name for marker in HIGHER_IS_BETTER):
+        return 1
+    if any(marker in name for marker in LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="percent change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.before, encoding="utf-8") as f:
+        before = flatten(json.load(f)["results"])
+    with open(args.after, encoding="utf-8") as f:
+        after = flatten(json.load(f)["results"])
+
+    regressions = 0
+    for path in sorted(set(before) & set(after)):
+        old, new = before[path], after[path]
+        change = (new - old) / old * 100 if old else 0.0
+        better = direction(path)
+        mark = ""
+        if better and abs(change) >= args.threshold:
+            mark = "improved" if change * better > 0 else "REGRESSED"
+            regressions += mark == "REGRESSED"
+        print(f"{path:60} {old:>14.6g} {new:>14.6g} {change:+8.1f}%  {mark}")
+    for path in sorted(set(before) ^ set(after)):
+        print(f"{path:60} only in {'before' if path in before else 'after'}")
+    print(f"\n{regressions} regression(s) beyond {args.threshold:g}%")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Stand-in for the yt-dlp executable, used by the benchmarks.
+
+Understands just enough of the command line built by download_server.py
+(--flat-playlist --dump-json, --yes-playlist/--playlist-items,
+--progress-template, --print) to emit realistic output at controlled
+rates. Behaviour is set with environment variables:
+
+  FAKE_YTDLP_STARTUP       seconds to sleep before doing anything (interpreter + extractor startup)
+  FAKE_YTDLP_PLAYLIST_SIZE entries printed for --flat-playlist
+  FAKE_YTDLP_ENTRY_DELAY   seconds between playlist entries
+  FAKE_YTDLP_STEPS         progress lines per downloaded video
+  FAKE_YTDLP_STEP_DELAY    seconds between progress lines
+  FAKE_YTDLP_FILE_SIZE     reported size of each video in bytes
+  FAKE_YTDLP_WRITE_FILES   1 to create each video's file (sparse, via a .part file) at its -o path
+  FAKE_YTDLP_ENDLESS       videos whose id contains this text report progress every 0.2 s until killed
+  FAKE_YTDLP_SPAWN_LOG     file that gets one line appended per started process
+  FAKE_YTDLP_FAIL_EVERY    in a playlist download, every Nth video fails with a network error
+                           (retries, which pass --playlist-items, succeed); in a run of several URLs
+                           (a /download/batch group), every video whose number is a multiple of N
+                           fails the first time, which FAKE_YTDLP_STATE_DIR has to be set to remember
+  FAKE_YTDLP_ERROR_KIND    text of that error, as matched by NETWORK_ERROR_PATTERN (default "timed out")
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+
+def env(name, default, cast=float):
+    return cast(os.environ.get(name, default))
+
+
+def option_values(args, name):
+    return [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == name]
+
+
+def render(template, info, progress=None):
+    """Evaluate the subset of yt-dlp's output template syntax the server uses."""
+    def field(match):
+        source = progress if match.group(1) == "progress" else info
+        value = (source or {}).get(match.group(2))
+        return "NA" if value is None else str(value)
+
+    def subset(match):
+        return json.dumps({k: info[k] for k in match.group(1).split(",") if info.get(k) is not None})
+
+    template = re.sub(r"%\((progress|info)\.(\w+)\)s", field, template)
+    template = re.sub(r"%\(\.\{([\w,]+)\}\)j", subset, template)
+    return re.sub(r"%\((\w+)\)s", lambda m: str(info.get(m.group(1), "NA")), template)
+
+
+def output_path(args, info):
+    """Where the video is saved: the -o template filled in."""
+    templates = option_values(args, "-o")
+    if not templates:
+        return os.path.join(os.getcwd(), f"{info['title']}.mp4")
+    template = re.sub(r"%\((\w+)\)03d", lambda m: f"{int(info.get(m.group(1)) or 0):03d}", templates[-1])
+    return render(template, dict(info, ext="mp4"))
+
+
+def video_id(n):
+    return f"fake{n:07d}"
+
+
+def dump_playlist(size, delay):
+    for n in range(1, size + 1):
+        print(json.dumps({
+            "id": video_id(n),
+            "title": f"Fake video {n}",
+            "url": f"https://www.youtube.com/watch?v={video_id(n)}",
+            "duration": 60 + n % 600,
+            "playlist_title": "Fake playlist",
+            "playlist_index": n,
+        }), flush=True)
+        if delay:
+            time.sleep(delay)
+
+
+def playlist_indexes(args, size):
+    """Indexes selected by --playlist-items ("1,3,5-7"), else the whole playlist."""
+    selection = option_values(args, "--playlist-items")
+    if not selection:
+        return list(range(1, size + 1))
+    indexes = []
+    for part in selection[0].split(","):
+        start, _, end = part.partition("-")
+        indexes += range(int(start), int(end or start) + 1)
+    return indexes
+
+
+def videos(args):
+    """Info dicts of the videos this command downloads."""
+    file_size = env("FAKE_YTDLP_FILE_SIZE", 10 * 1024 * 1024, int)
+    if "--yes-playlist" in args:
+        size = env("FAKE_YTDLP_PLAYLIST_SIZE", 50, int)
+        infos = [{
+            "id": video_id(n),
+            "title": f"Fake video {n}",
+            "playlist_index": n,
+            "n_entries": size,
+            "playlist_title": "Fake playlist",
+        } for n in playlist_indexes(args, size)]
+    else:
+        # the URLs are the trailing positional arguments; a /download/batch run has several
+        infos = []
+        urls = [arg for arg in args if re.match(r"https?://", arg)]
+        for url in urls or [""]:
+            match = re.search(r"v=([\w-]{11})", url) or re.search(r"/(\d+)/?$", url)
+            video = match.group(1) if match else "fakevideo01"
+            infos.append({"id": video, "title": f"Fake video {video}", "original_url": url or None,
+                          "webpage_url": url or None, "extractor_key": extractor_key(url)})
+    for info in infos:
+        info.setdefault("extractor_key", "Youtube")
+        info.update(filesize_approx=file_size, filepath=output_path(args, info))
+    return infos
+
+
+def extractor_key(url):
+    """YouTube unless the URL is on one of the other sites the benchmarks use (with numeric ids)."""
+    for host, key in (("vimeo.com", "Vimeo"), ("tiktok.com", "TikTok")):
+        if host in url:
+            return key
+    return "Youtube"
+
+
+EXTRACTOR_NAMES = {"Youtube": "youtube", "Vimeo": "vimeo", "TikTok": "TikTok"}  # as yt-dlp's errors write them
+
+
+def fails_first_time(info, fail_every):
+    """Whether this batch video fails now: a multiple of fail_every, not failed before (FAKE_YTDLP_STATE_DIR)."""
+    state_dir = os.environ.get("FAKE_YTDLP_STATE_DIR")
+    number = int(re.sub(r"\D", "", info["id"]) or 0)
+    if not state_dir or number % fail_every:
+        return False
+    marker = os.path.join(state_dir, f"failed-{info['id']}")
+    if os.path.exists(marker):
+        return False
+    open(marker, "w").close()
+    return True
+
+
+def download(args, info):
+    steps = env("FAKE_YTDLP_STEPS", 10, int)
+    step_delay = env("FAKE_YTDLP_STEP_DELAY", 0.05)
+    size = env("FAKE_YTDLP_FILE_SIZE", 10 * 1024 * 1024, int)
+    templates = [t.split(":", 1)[1] for t in option_values(args, "--progress-template")]
+    prints = dict(p.split(":", 1) for p in option_values(args, "--print"))
+    endless = os.environ.get("FAKE_YTDLP_ENDLESS")
+    if endless and endless in info["id"]:
+        steps, step_delay = 10 ** 9, 0.2
+
+    if "before_dl" in prints:
+        print(render(prints["before_dl"], info), flush=True)
+    for step in range(steps + 1):
+        progress = {
+            "status": "downloading" if step < steps else "finished",
+            "downloaded_bytes": size * step // steps,
+            "total_bytes": size,
+            "speed": size / max(steps * step_delay, 0.001),
+            "eta": int((steps - step) * step_delay),
+        }
+        if templates:
+            print(render(templates[0], info, progress), flush=True)
+        else:
+            print(f"[download] {100.0 * step / steps:5.1f}% of {size / 1048576:.2f}MiB", flush=True)
+        if step < steps and step_delay:
+            time.sleep(step_delay)
+    if os.environ.get("FAKE_YTDLP_WRITE_FILES") == "1":
+        os.makedirs(os.path.dirname(info["filepath"]), exist_ok=True)
+        with open(info["filepath"] + ".part", "wb") as f:
+            f.truncate(size)
+        os.replace(info["filepath"] + ".part", info["filepath"])
+    if "after_move" in prints:
+        print(render(prints["after_move"], info), flush=True)
+
+
+def main():
+    args = sys.argv[1:]
+    if "--version" in args:
+        print("2099.01.01")
+        return 0
+    spawn_log = os.environ.get("FAKE_YTDLP_SPAWN_LOG")
+    if spawn_log:
+        with open(spawn_log, "a", encoding="utf-8") as f:
+            f.write(f"{os.getpid()}\n")
+    startup = env("FAKE_YTDLP_STARTUP", 0)
+    if startup:
+        time.sleep(startup)
+    if "--flat-playlist" in args:
+        dump_playlist(env("FAKE_YTDLP_PLAYLIST_SIZE", 50, int), env("FAKE_YTDLP_ENTRY_DELAY", 0))
+        return 0
+    fail_every = env("FAKE_YTDLP_FAIL_EVERY", 0, int)
+    if "--playlist-items" in args:
+        fail_every = 0
+    infos = videos(args)
+    errors = 0
+    for n, info in enumerate(infos, 1):
+        if "--yes-playlist" in args:
+            fail = fail_every and n % fail_every == 0
+        else:
+            fail = fail_every and len(infos) > 1 and fails_first_time(info, fail_every)
+        if fail:
+            kind = os.environ.get("FAKE_YTDLP_ERROR_KIND", "timed out")
+            extractor = EXTRACTOR_NAMES[info["extractor_key"]]
+            print(f"ERROR: [{extractor}] {info['id']}: Unable to download webpage: <urlopen error {kind}>", flush=True)
+            errors += 1
+            continue
+        download(args, info)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Shared helpers for the benchmarks: start a server against the fake
+yt-dlp on a free port, time HTTP calls and write results as JSON.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class BenchServer:
+    """download_server.py running in a subprocess, stopped on exit from the with-block."""
+
+    def __init__(self, fake_env=None, extra_args=(), port=None):
+        self.port = port or free_port()
+        self.env = dict(os.environ, **{k: str(v) for k, v in (fake_env or {}).items()})
+        self.args = list(extra_args)
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "serve.py"), "--port", str(self.port)] + self.args,
+            env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                call(self.base_url, "GET", "/ping", timeout=1)
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.__exit__(None, None, None)
+        raise RuntimeError("benchmark server did not start")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def call(base_url, method, path, body=None, timeout=30):
+    """Send one request and return (status, parsed JSON body, seconds taken)."""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        payload = e.read()
+        status = e.code
+    elapsed = time.perf_counter() - start
+    return status, json.loads(payload) if payload else None, elapsed
+
+
+def rss_bytes(pid):
+    """Resident memory of a process from /proc (Linux only; None elsewhere or once it has exited)."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def child_pids(pid, command=None):
+    """Direct children of a process (whose command line contains `command`), from /proc (Linux only)."""
+    children = []
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="ascii", errors="replace") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            if ppid == pid and command is not None:
+                with open(f"/proc/{entry}/cmdline", "rb") as f:
+                    ppid = pid if command.encode() in f.read() else None
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize_ms(values):
+    """p50/p99/max of a list of durations in seconds, reported in milliseconds."""
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 99) * 1000, 3) if values else None,
+        "max_ms": round(max(values) * 1000, 3) if values else None,
+    }
+
+
+def write_results(name, results, output=None):
+    """Print results and optionally save them as JSON for run-to-run comparison."""
+    record = {"benchmark": name, "timestamp": time.time(), "python": sys.version.split()[0], "results": results}
+    text = json.dumps(record, indent=2)
+    print(text)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return record
@@ -0,0 +1,72 @@
+"""
+Run download_server.py with the fake yt-dlp (or the installed one) on a chosen port.
+
+Started as a subprocess by harness.BenchServer; the fake's behaviour is
+taken from the FAKE_YTDLP_* environment variables (see fake_ytdlp.py).
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from http.server import HTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import download_server  # noqa: E402
+
+FAKE_YTDLP = os.path.join(BENCH_DIR, "fake_ytdlp.py")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--download-dir", default=None)
+    parser.add_argument("--single-threaded", action="store_true",
+                        help="serve with the old one-request-at-a-time HTTPServer (baseline)")
+    parser.add_argument("--role", choices=("coordinator", "worker"), default=None)
+    parser.add_argument("--coordinator", default=None)
+    parser.add_argument("--max-concurrent", type=int, default=None,
+                        help="raise the global, per-site and connection caps to run this many jobs at once")
+    parser.add_argument("--retry-delay", type=float, default=None, help="FAILED_ITEM_RETRY_DELAY for the run")
+    parser.add_argument("--direct-connections", type=int, default=None, help="DIRECT_CONNECTIONS for the run")
+    parser.add_argument("--direct-retry-delay", type=float, default=None, help="DIRECT_RETRY_DELAY for the run")
+    parser.add_argument("--real-ytdlp", action="store_true", help="run the installed yt-dlp instead of the fake")
+    args = parser.parse_args()
+
+    download_server.PORT = args.port
+    download_server.DOWNLOAD_DIR = args.download_dir or tempfile.mkdtemp(prefix="bilal-bench-")
+    # state the server keeps under ~/.bilal_downloader goes to a folder of the run's own
+    state_dir = tempfile.mkdtemp(prefix="bilal-bench-state-")
+    download_server.STAGING_DIR = os.path.join(state_dir, "staging")
+    download_server.LOG_DIR = os.path.join(state_dir, "logs")
+    download_server.TOOLCHAIN_CACHE_FILE = os.path.join(state_dir, "toolchain.json")
+    download_server.toolchain.cache_file = download_server.TOOLCHAIN_CACHE_FILE  # read when the module loaded
+    download_server.CLUSTER_ROLE = args.role
+    download_server.COORDINATOR_URL = args.coordinator
+    if not args.real_ytdlp:
+        download_server.toolchain.use("yt-dlp", [sys.executable, FAKE_YTDLP])
+    # keep runs independent of each other
+    download_server.metadata_cache.path = None
+    download_server.JOB_JOURNAL_FILE = None
+    download_server.download_archive.directory = None
+    # there is no network to probe: the fake's network errors must not take the server offline
+    download_server.check_network = lambda *args, **kwargs: True
+    if args.max_concurrent:
+        download_server.scheduler = download_server.DownloadScheduler(
+            download_server.run_download_job, max_concurrent=args.max_concurrent, host_limits={},
+            default_host_limit=args.max_concurrent, max_connections=args.max_concurrent * 8)
+    if args.direct_connections:
+        download_server.DIRECT_CONNECTIONS = args.direct_connections
+    if args.direct_retry_delay is not None:
+        download_server.DIRECT_RETRY_DELAY = args.direct_retry_delay
+    if args.retry_delay is not None:
+        download_server.FAILED_ITEM_RETRY_DELAY = args.retry_delay
+    if args.single_threaded:
+        download_server.DownloadServer = HTTPServer
+    download_server.main([])
+
+
+if __name__ == "__main__":
+    main()
@@ -8,120 +8,74 @@ const statActive = document.getElementById('statActive');
 const statPending = document.getElementById('statPending');
 const statDone = document.getElementById('statDone');
 
-// Keep track of the last interval handle
-let intervalId = null;
+// Jobs by id, kept in sync from the server's /events stream
+const downloads = new Map();
+// Rendered card and the view it was last rendered from, by job id
+const cards = new Map();
+let renderScheduled = false;
+
+function applySnapshot(list) {
+  downloads.clear();
+  list.forEach(d => downloads.set(d.id, d));
+  scheduleRender();
+}
 
-async function fetchDownloads() {
-  try {
-    const res = await fetch(`${SERVER_URL}/downloads`, {
-      method: 'GET',
-      headers: { 'Accept': 'application/json' },
-      signal: AbortSignal.timeout(3000)
-    });
-    
-    if (!res.ok) throw new Error('Server returned ' + res.status);
-    
-    serverAlert.style.display = 'none';
-    const data = await res.json();
-    renderDownloads(data.downloads || []);
-  } catch (error) {
-    serverAlert.style.display = 'block';
-  }
+function applyJobs(list) {
+  list.forEach(d => downloads.set(d.id, d));
+  scheduleRender();
 }
 
-function renderDownloads(downloads) {
-  if (downloads.length === 0) {
-    emptyState.style.display = 'block';
-    grid.innerHTML = '';
-    
-    statActive.textContent = `Active: 0`;
-    statPending.textContent = `Pending: 0`;
-    statDone.textContent = `Completed: 0`;
-    return;
-  }
+function removeJobs(ids) {
+  ids.forEach(id => downloads.delete(id));
+  scheduleRender();
+}
 
-  emptyState.style.display = 'none';
-  grid.innerHTML = '';
+// Coalesce bursts of events into one render per frame
+function scheduleRender() {
+  if (renderScheduled) return;
+  renderScheduled = true;
+  requestAnimationFrame(() => {
+    renderScheduled = false;
+    renderDownloads([...downloads.values()].sort((a, b) => b.created - a.created));
+  });
+}
 
+function renderDownloads(list) {
   let activeCount = 0;
   let pendingCount = 0;
   let doneCount = 0;
 
-  downloads.forEach(d => {
+  emptyState.style.display = list.length === 0 ? 'block' : 'none';
+
+  // Drop cards for jobs the server no longer reports
+  const ids = new Set(list.map(d => d.id));
+  for (const [id, entry] of cards) {
+    if (!ids.has(id)) {
+      entry.card.remove();
+      cards.delete(id);
+    }
+  }
+
+  list.forEach((d, index) => {
     // Stats tracking
-    if (d.status === 'downloading' || d.status === 'retrying') activeCount++;
+    if (d.status === 'downloading' || d.status === 'processing' || d.status === 'retrying') activeCount++;
     else if (d.status === 'pending') pendingCount++;
     else if (d.status === 'completed') doneCount++;
 
-    const card = document.createElement('div');
-    card.className = 'download-card';
-
-    // Parse Progress String
-    // Example: "[download]  24.5% of ~1.23GiB at  4.56MiB/s ETA 00:27"
-    let progressTxt = d.progress || 'Starting...';
-    if (d.status === 'completed') progressTxt = '100% Downloaded';
-    else if (d.status === 'pending') progressTxt = 'Waiting in Queue...';
-    else if (d.status === 'cancelled') progressTxt = 'Cancelled by user';
-    else if (d.status === 'retrying') progressTxt = 'Network error... Waiting to retry';
-
-    const cleanProgress = progressTxt.replace('[download]', '').trim();
-
-    // Determine status badge class
-    let badgeClass = 's-pending';
-    if (d.status === 'downloading') badgeClass = 's-downloading';
-    else if (d.status === 'completed') badgeClass = 's-completed';
-    else if (d.status === 'error') badgeClass = 's-error';
-    else if (d.status === 'cancelled') badgeClass = 's-cancelled';
-    else if (d.status === 'retrying') badgeClass = 's-retrying';
-
-    // Tags
-    let tagHTML = '';
-    if (d.quality) {
-      if (d.quality === 'audio') tagHTML += `<span class="tag tag-quality">AUDIO</span>`;
-      else tagHTML += `<span class="tag tag-quality">${d.quality.toUpperCase()}</span>`;
+    let entry = cards.get(d.id);
+    if (!entry) {
+      entry = { card: document.createElement('div'), view: null };
+      entry.card.className = 'download-card';
+      cards.set(d.id, entry);
     }
-    if (d.is_playlist) {
-      tagHTML += `<span class="tag tag-playlist">PLAYLIST</span>`;
+    // Only rebuild cards whose job actually changed
+    if (entry.view !== d) {
+      fillCard(entry.card, d);
+      entry.view = d;
     }
-
-    card.innerHTML = `
-      <div class="info-section">
-        <div class="title-row">
-          <div class="dp-title" title="${d.title}">${d.title}</div>
-          ${tagHTML}
-        </div>
-        <div class="meta-row">
-          <span>Added: ${d.date}</span>
-        </div>
-        <div class="progress-text">${cleanProgress}</div>
-        ${d.error ? `<div class="err-text">Error: ${d.error}</div>` : ''}
-      </div>
-      
-      <div class="status-badge ${badgeClass}">${d.status}</div>
-    `;
-
-    // Only show cancel button if pending or downloading
-    if (d.status === 'downloading' || d.status === 'pending' || d.status === 'retrying') {
-      const btn = document.createElement('button');
-      btn.className = 'action-btn';
-      btn.textContent = 'Cancel';
-      btn.onclick = () => cancelDownload(d.id);
-      card.appendChild(btn);
+    if (grid.children[index] !== entry.card) {
+      grid.insertBefore(entry.card, grid.children[index] || null);
     }
-
-    // Show restart button if error, cancelled or interrupted
-    if (d.status === 'error' || d.status === 'cancelled' || d.status === 'interrupted') {
-      const btn = document.createElement('button');
-      btn.className = 'action-btn';
-      btn.style.borderColor = 'rgba(34, 197, 94, 0.4)';
-      btn.style.color = '#86efac';
-      btn.style.background = 'rgba(34, 197, 94, 0.1)';
-      btn.textContent = 'Restart';
-      btn.onclick = () => restartDownload(d.id);
-      card.appendChild(btn);
-    }
-
-    grid.appendChild(card);
   });
 
   // Update Stats
@@ -130,6 +84,75 @@ function renderDownloads(downloads) {
   statDone.textContent = `Completed: ${doneCount}`;
 }
 
+function fillCard(card, d) {
+  // Progress text is formatted by the server from yt-dlp's progress fields,
+  // e.g. "[3/20] 24.5% of 1.23GiB at 4.56MiB/s ETA 00:27"
+  let progressTxt = d.progress || 'Starting...';
+  if (d.status === 'completed') progressTxt = '100% Downloaded';
+  else if (d.status === 'pending') progressTxt = 'Waiting in Queue...';
+  else if (d.status === 'cancelled') progressTxt = 'Cancelled by user';
+  else if (d.status === 'retrying') progressTxt = 'Network error... Waiting to retry';
+  else if (d.status === 'processing') progressTxt = 'Converting / embedding...';
+
+  const cleanProgress = progressTxt.replace('[download]', '').trim();
+
+  // Determine status badge class
+  let badgeClass = 's-pending';
+  if (d.status === 'downloading' || d.status === 'processing') badgeClass = 's-downloading';
+  else if (d.status === 'completed') badgeClass = 's-completed';
+  else if (d.status === 'error' || d.status === 'failed') badgeClass = 's-error';
+  else if (d.status === 'cancelled') badgeClass = 's-cancelled';
+  else if (d.status === 'retrying') badgeClass = 's-retrying';
+
+  // Tags
+  let tagHTML = '';
+  if (d.quality) {
+    if (d.quality === 'audio') tagHTML += `<span class="tag tag-quality">AUDIO</span>`;
+    else tagHTML += `<span class="tag tag-quality">${d.quality.toUpperCase()}</span>`;
+  }
+  if (d.is_playlist) {
+    tagHTML += `<span class="tag tag-playlist">PLAYLIST</span>`;
+  }
+
+  card.innerHTML = `
+    <div class="info-section">
+      <div class="title-row">
+        <div class="dp-title" title="${d.title}">${d.title}</div>
+        ${tagHTML}
+      </div>
+      <div class="meta-row">
+        <span>Added: ${d.date}</span>
+        ${d.worker ? `<span>Worker: ${d.worker}</span>` : ''}
+      </div>
+      <div class="progress-text">${cleanProgress}</div>
+      ${d.error ? `<div class="err-text">Error: ${d.error}</div>` : ''}
+    </div>
+
+    <div class="status-badge ${badgeClass}">${d.status}</div>
+  `;
+
+  // Only show cancel button if the job is still running or queued
+  if (['downloading', 'processing', 'pending', 'retrying'].includes(d.status)) {
+    const btn = document.createElement('button');
+    btn.className = 'action-btn';
+    btn.textContent = 'Cancel';
+    btn.onclick = () => cancelDownload(d.id);
+    card.appendChild(btn);
+  }
+
+  // Show restart button if failed, cancelled or interrupted
+  if (d.status === 'error' || d.status === 'failed' || d.status === 'cancelled' || d.status === 'interrupted') {
+    const btn = document.createElement('button');
+    btn.className = 'action-btn';
+    btn.style.borderColor = 'rgba(34, 197, 94, 0.4)';
+    btn.style.color = '#86efac';
+    btn.style.background = 'rgba(34, 197, 94, 0.1)';
+    btn.textContent = 'Restart';
+    btn.onclick = () => restartDownload(d.id);
+    card.appendChild(btn);
+  }
+}
+
 async function cancelDownload(id) {
   try {
     const res = await fetch(`${SERVER_URL}/cancel`, {
@@ -142,8 +165,6 @@ async function cancelDownload(id) {
     if (!data.success) {
       alert(data.error || 'Failed to cancel');
     }
-    // Immediately fetch to reflect change
-    fetchDownloads();
   } catch (error) {
     alert('Error connecting to server to cancel download.');
   }
@@ -161,17 +182,25 @@ async function restartDownload(id) {
     if (!data.success) {
       alert(data.error || 'Failed to restart');
     }
-    fetchDownloads();
   } catch (error) {
     alert('Error connecting to server to restart download.');
   }
 }
 
-// Start polling every second
-function startPolling() {
-  fetchDownloads();
-  intervalId = setInterval(fetchDownloads, 1000);
+// Subscribe to job events; EventSource reconnects on its own and resumes
+// from the last event id, the server resends a snapshot if it fell too far behind
+function startEvents() {
+  const source = new EventSource(`${SERVER_URL}/events`);
+
+  source.onopen = () => { serverAlert.style.display = 'none'; };
+  source.onerror = () => { serverAlert.style.display = 'block'; };
+
+  source.addEventListener('snapshot', e => applySnapshot(JSON.parse(e.data).downloads || []));
+  source.addEventListener('added', e => applyJobs(JSON.parse(e.data).jobs));
+  source.addEventListener('updated', e => applyJobs(JSON.parse(e.data).jobs));
+  source.addEventListener('progress', e => applyJobs(JSON.parse(e.data).jobs));
+  source.addEventListener('removed', e => removeJobs(JSON.parse(e.data).ids));
 }
 
 // Run
-startPolling();
+startEvents();
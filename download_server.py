@@ -7,500 +7,4648 @@ Uses yt-dlp to download YouTube videos and other supported sites.
 import sys
 sys.dont_write_bytecode = True  # Prevent __pycache__ creation (causes Chrome extension errors)
 
+import argparse
+import bisect
+import collections
+import errno
+import gzip
+import http.client
+import itertools
+import importlib.util
+import hmac
+import ipaddress
 import json
+import logging
+import logging.handlers
+import mimetypes
+import multiprocessing
 import os
+import queue
+import random
 import subprocess
 import threading
 import re
+import shutil
+import signal
 import socket
+import sqlite3
 import time
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import unquote
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlencode, urljoin, urlparse, urlsplit
+from urllib.request import Request, urlopen
 
 # Download directory
 DOWNLOAD_DIR = os.path.join(os.path.expanduser("~"), "Downloads")
 PORT = 9876
+HOST = "127.0.0.1"  # Interface to listen on; "0.0.0.0" for a coordinator that workers on other machines reach
 NOT_FOUND = "not found"
 YTDLP_INSTALL_CMD = "pip install yt-dlp"
 
 
 def find_ytdlp():
     """Search for yt-dlp in all possible paths"""
-    import shutil
+    # 1: In the same directory
+    local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "yt-dlp.exe")
+    if os.path.exists(local):
+        return [local]
+
+    # 2: In system PATH
+    path = shutil.which("yt-dlp")
+    if path:
+        return [path]
+
+    # 3: In various Python Scripts directories
+    scripts_dirs = [
+        os.path.join(sys.prefix, "Scripts"),
+        os.path.join(sys.base_prefix, "Scripts"),
+        os.path.join(os.path.expanduser("~"), "AppData", "Local", "Programs", "Python", "Scripts"),
+        os.path.join(os.path.expanduser("~"), "AppData", "Roaming", "Python", "Scripts"),
+        os.path.join(os.path.expanduser("~"), "AppData", "Local", "Packages"),  # MS Store Python
+    ]
+    # Add all Python* Scripts directories
+    local_programs = os.path.join(os.path.expanduser("~"), "AppData", "Local", "Programs", "Python")
+    if os.path.isdir(local_programs):
+        for d in os.listdir(local_programs):
+            scripts_dirs.append(os.path.join(local_programs, d, "Scripts"))
+    roaming_python = os.path.join(os.path.expanduser("~"), "AppData", "Roaming", "Python")
+    if os.path.isdir(roaming_python):
+        for d in os.listdir(roaming_python):
+            scripts_dirs.append(os.path.join(roaming_python, d, "Scripts"))
+
+    for scripts_dir in scripts_dirs:
+        candidate = os.path.join(scripts_dir, "yt-dlp.exe")
+        if os.path.exists(candidate):
+            return [candidate]
+
+    # 4: Fallback — python -m yt_dlp (its version is probed later, in the background)
+    if importlib.util.find_spec("yt_dlp") is not None:
+        return [sys.executable, "-m", "yt_dlp"]
+
+    return None
+
+
+def find_executable(name):
+    """Find a helper program next to this script (Windows builds) or in PATH. Returns its command."""
+    local = os.path.join(os.path.dirname(os.path.abspath(__file__)), name + ".exe")
+    if os.path.exists(local):
+        return [local]
+    path = shutil.which(name)
+    return [path] if path else None
+
+
+TOOL_FINDERS = {
+    "yt-dlp": find_ytdlp,
+    "ffmpeg": lambda: find_executable("ffmpeg"),  # merging formats and all post-processing
+    "ffprobe": lambda: find_executable("ffprobe"),
+    "node": lambda: find_executable("node"),  # JavaScript runtime for YouTube's player challenges
+    "aria2c": lambda: find_executable("aria2c"),  # multi-connection downloads (DOWNLOAD_PROFILES)
+}
+TOOL_VERSION_FLAGS = {"ffmpeg": "-version", "ffprobe": "-version"}  # others take --version
+TOOL_MISSING_HINTS = {
+    "yt-dlp": f"Install it with: {YTDLP_INSTALL_CMD}",
+    "ffmpeg": "no merging, mp3 conversion or thumbnail embedding",
+    "ffprobe": "no mp3 conversion or thumbnail embedding",
+    "node": "YouTube downloads may be missing formats",
+}
+
+
+def tool_stamp_file(command):
+    """The file whose mtime changes when the tool is updated: the executable, or the module for `python -m`."""
+    if command[1:2] == ["-m"]:
+        spec = importlib.util.find_spec(command[2])
+        if spec is not None and spec.origin:
+            return spec.origin
+    return command[0]
+
+
+def probe_version(command, flag):
+    """Run `<command> --version` (or `flag`) and return the version it reports, or None."""
+    kwargs = {"creationflags": subprocess.CREATE_NO_WINDOW} if sys.platform == "win32" else {}
+    try:
+        result = subprocess.run(command + [flag], capture_output=True, text=True, timeout=TOOL_PROBE_TIMEOUT,
+                                **kwargs)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    first_line = (result.stdout or result.stderr).strip().split("\n")[0]
+    if result.returncode != 0 or not first_line:
+        return None
+    match = re.search(r"\d+(\.\d+)+", first_line)
+    return match.group(0) if match else first_line
+
+
+class Toolchain:
+    """yt-dlp and the programs it relies on, located once and probed in the background.
+
+    start() looks every tool up concurrently, so the server binds its port
+    without waiting on the disk or on `--version` runs. Versions are cached
+    in TOOLCHAIN_CACHE_FILE and reused while the tool's mtime is unchanged.
+    A tool is looked up again at most every TOOL_RESCAN_INTERVAL seconds:
+    a missing one so installing it needs no restart (requests fail fast
+    meanwhile), a found one to notice it was updated or removed.
+    """
+
+    def __init__(self, finders=TOOL_FINDERS):
+        self.finders = finders
+        self.cache_file = None
+        self._started = False
+        self._commands = {}
+        self._versions = {}
+        self._mtimes = {}
+        self._checked = {}  # tool -> time.monotonic() of its last lookup
+        self._pinned = set()  # tools set with use(), never looked up
+        self._ready = {name: threading.Event() for name in finders}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Locate and probe every tool, each in its own thread."""
+        self.cache_file = TOOLCHAIN_CACHE_FILE
+        self._cache = self._load_cache()
+        self._started = True
+        for name in self.finders:
+            target = self._probe if name in self._pinned else self._resolve
+            threading.Thread(target=target, args=(name,), name=f"probe-{name}", daemon=True).start()
+
+    def command(self, name):
+        """The tool's command as a list, or None if it is not installed."""
+        ready = self._ready[name]
+        if not ready.is_set():
+            if self._started:
+                ready.wait()
+            else:
+                self._locate(name)  # not started (benchmarks, imports): look it up on first use
+        if self._started and time.monotonic() - self._checked.get(name, 0) >= TOOL_RESCAN_INTERVAL:
+            self._recheck(name)
+        return self._commands.get(name)
+
+    def path(self, name):
+        command = self.command(name)
+        return command[0] if command else None
+
+    def use(self, name, command):
+        """Use this command for a tool instead of looking it up (benchmarks, tests)."""
+        with self._lock:
+            self._commands[name] = command
+            self._checked[name] = float("inf")
+            self._pinned.add(name)
+        self._ready[name].set()
+
+    def status(self):
+        """Paths, versions and what they make possible, without waiting on a probe."""
+        tools = {}
+        for name in self.finders:
+            command = self._commands.get(name)
+            tools[name] = {
+                "found": bool(command) if self._ready[name].is_set() else None,
+                "path": " ".join(command) if command else None,
+                "version": self._versions.get(name),
+            }
+        ffmpeg = tools["ffmpeg"]["found"] and tools["ffprobe"]["found"]
+        tools["capabilities"] = {
+            "merge_formats": bool(tools["ffmpeg"]["found"]),
+            "postprocessing": bool(ffmpeg),  # mp3 extraction, thumbnail and metadata embedding
+            "js_runtime": bool(tools["node"]["found"]),
+            "aria2c": bool(tools["aria2c"]["found"]),
+        }
+        return tools
+
+    def _locate(self, name):
+        command = self.finders[name]()
+        try:
+            mtime = os.path.getmtime(tool_stamp_file(command)) if command else None
+        except OSError:
+            mtime = None
+        with self._lock:
+            changed = command != self._commands.get(name) or mtime != self._mtimes.get(name)
+            self._commands[name] = command
+            self._mtimes[name] = mtime
+            self._checked[name] = time.monotonic()
+        self._ready[name].set()
+        return changed
+
+    def _resolve(self, name):
+        self._locate(name)
+        self._probe(name)
+
+    def _recheck(self, name):
+        with self._lock:
+            if time.monotonic() - self._checked.get(name, 0) < TOOL_RESCAN_INTERVAL:
+                return  # another thread is on it
+            self._checked[name] = time.monotonic()
+            command = self._commands.get(name)
+            mtime = self._mtimes.get(name)
+        if command is not None:
+            try:
+                if os.path.getmtime(tool_stamp_file(command)) == mtime:
+                    return
+            except OSError:
+                pass
+        if self._locate(name):
+            threading.Thread(target=self._probe, args=(name,), name=f"probe-{name}", daemon=True).start()
+
+    def _probe(self, name):
+        command = self._commands.get(name)
+        version = None
+        if command is not None:
+            cached = self._cache.get(name) or {}
+            if cached.get("command") == command and cached.get("mtime") == self._mtimes.get(name):
+                version = cached.get("version")
+            else:
+                version = probe_version(command, TOOL_VERSION_FLAGS.get(name, "--version"))
+                with self._lock:
+                    self._cache[name] = {"command": command, "mtime": self._mtimes.get(name), "version": version}
+                self._save_cache()
+        self._versions[name] = version
+        if command is not None:
+            print(f"[Toolchain] {name}: ✅ {version or 'unknown version'} ({' '.join(command)})")
+        elif name in TOOL_MISSING_HINTS:
+            print(f"[Toolchain] {name}: {'❌' if name == 'yt-dlp' else '⚠️'} {NOT_FOUND} - {TOOL_MISSING_HINTS[name]}")
+
+    def _load_cache(self):
+        if not self.cache_file:
+            return {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self):
+        if not self.cache_file:
+            return
+        with self._lock:
+            data = json.dumps(self._cache)
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp = self.cache_file + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            print(f"[Toolchain] ⚠️ Could not save {self.cache_file}: {e}")
+
+
+toolchain = Toolchain()
+
+
+def get_ytdlp_cmd():
+    """The yt-dlp command, or None if it is not installed."""
+    return toolchain.command("yt-dlp")
+
+
+def job_ytdlp_cmd():
+    """The yt-dlp command new jobs are built with, or None if it is not installed.
+
+    A coordinator never runs yt-dlp: its workers build their own commands
+    from the lease, so it does without one.
+    """
+    if CLUSTER_ROLE == "coordinator":
+        return get_ytdlp_cmd() or ["yt-dlp"]
+    return get_ytdlp_cmd()
+
+
+def has_ffmpeg():
+    """Whether yt-dlp can merge formats and run its post-processors (they need ffmpeg and ffprobe)."""
+    return toolchain.command("ffmpeg") is not None and toolchain.command("ffprobe") is not None
+
+MAX_NETWORK_WAIT = 300  # Max seconds to wait for network (5 min)
+NETWORK_CHECK_INTERVAL = 10  # Seconds between connectivity checks while offline
+FAILED_ITEM_RETRY_DELAY = 15  # Base delay before retrying a failed item (doubles per attempt)
+MAX_RETRY_DELAY = 120  # Upper bound for the retry backoff
+MAX_RETRY_ROUNDS = 3  # Max retry attempts per failed playlist item
+MAX_PARALLEL_RETRIES = 3  # Failed items of one job queued or running at the same time
+
+MAX_CONCURRENT_DOWNLOADS = 4  # Global cap on simultaneous yt-dlp processes
+DEFAULT_HOST_LIMIT = 2  # Per-site cap for hosts not listed in HOST_LIMITS
+HOST_LIMITS = {
+    "youtube.com": 2,
+    "tiktok.com": 3,
+    "instagram.com": 2,
+}
+# Hosts that share a rate limit with another site (CDNs, short links)
+HOST_ALIASES = {
+    "youtu.be": "youtube.com",
+    "googlevideo.com": "youtube.com",
+    "tiktokcdn.com": "tiktok.com",
+    "tiktokcdn-us.com": "tiktok.com",
+    "cdninstagram.com": "instagram.com",
+}
+PRIORITY_LEVELS = {"high": 0, "normal": 1, "low": 2}
+BATCH_GROUP_SIZE = 25  # Max videos of a /download/batch request downloaded by one yt-dlp run
+MAX_BATCH_ITEMS = 1000  # Max entries accepted in one /download/batch request
+MAX_CONNECTIONS = 24  # Global cap on connections: each job counts its fragments/aria2c connections
+# Direct downloads: media URLs the extension captured, fetched without yt-dlp ("direct": true)
+DIRECT_CONNECTIONS = 4  # Keep-alive connections per direct download, each fetching one segment at a time
+DIRECT_SEGMENT_SIZE = 8 * 1024 * 1024  # Bytes per Range request
+DIRECT_RETRIES = 5  # Attempts per segment before a direct download fails
+DIRECT_RETRY_DELAY = 1  # Seconds before a failed segment is retried (doubles per attempt)
+DIRECT_TIMEOUT = 30  # Seconds a direct download's connection may stall
+DIRECT_STATE_INTERVAL = 2  # Seconds between saves of what a direct download still has to fetch
+DIRECT_BUFFER_SIZE = 256 * 1024  # Bytes read from the socket and written to the file at a time
+DIRECT_USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                     "Chrome/124.0 Safari/537.36")  # Sent unless the request's "headers" name another
+# Download profiles: concurrent fragments (-N), aria2c connections (used when aria2c is installed)
+# and HTTP chunk size. A /download request may name one with "profile"; otherwise
+# HOST_PROFILES, then QUALITY_PROFILES pick it.
+DOWNLOAD_PROFILES = {
+    "fast": {"fragments": 8, "aria2c_connections": 8, "chunk_size": "10M"},
+    "standard": {"fragments": 4, "aria2c_connections": 4, "chunk_size": "10M"},
+    "light": {"fragments": 1, "aria2c_connections": 0, "chunk_size": None},
+}
+QUALITY_PROFILES = {"best": "fast", "720": "standard", "480": "standard", "360": "light", "audio": "light"}
+HOST_PROFILES = {
+    "tiktok.com": "light",  # short clips, not worth extra connections
+    "instagram.com": "light",
+}
+DEFAULT_PROFILE = "standard"
+SEPARATE_POSTPROCESSING = True  # Convert/embed in POSTPROCESS_WORKERS after the download slot is freed
+POSTPROCESS_WORKERS = os.cpu_count() or 2  # Simultaneous post-processing runs (CPU bound)
+BANDWIDTH_LIMIT = None  # Total bytes/s shared by all downloads (e.g. 5 * 1024 * 1024); None for unlimited
+BANDWIDTH_SCHEDULE = []  # [(start_hour, end_hour, bytes/s or None)] overriding BANDWIDTH_LIMIT, e.g. [(9, 18, 2 * 1024 * 1024)]
+MIN_RUN_RATE = 64 * 1024  # Floor for one download's share of the budget
+BANDWIDTH_CHECK_INTERVAL = 60  # Seconds between checks of BANDWIDTH_SCHEDULE
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+MAX_FINISHED_JOBS = 200  # Finished jobs kept for the dashboard
+PROGRESS_EVENT_INTERVAL = 0.5  # Seconds between coalesced progress events
+EVENT_HISTORY = 1000  # Job events kept for /events and /downloads?since= clients
+EVENT_KEEPALIVE = 15  # Seconds between SSE keep-alive comments
+MAX_LONG_POLL = 60  # Upper bound for /downloads?timeout=
+HTTP_KEEPALIVE_TIMEOUT = 15  # Seconds an idle keep-alive connection stays open
+GZIP_MIN_SIZE = 1024  # Responses at least this big are gzipped for clients that accept it
+GZIP_LEVEL = 5  # 1 (fastest) to 9 (smallest)
+RESPONSE_CACHE_SIZE = 16  # Encoded bodies kept by ETag, so tabs polling the same version share one encoding
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)  # /metrics buckets for stage and queue times (s)
+HTTP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 30)  # /metrics buckets for HTTP handlers (s)
+SPEED_BUCKETS = tuple(2 ** n * 1024 for n in range(6, 17, 2))  # /metrics buckets for per-file speed, 64 KiB/s to 64 MiB/s
+MAX_PLAYLIST_INFO_PROCESSES = 4  # Simultaneous yt-dlp --flat-playlist enumerations
+PLAYLIST_PAGE_SIZE = 200  # Default /playlist-info page size
+PLAYLIST_MAX_PAGE_SIZE = 5000
+PLAYLIST_FIRST_PAGE_TIMEOUT = 25  # Seconds /playlist-info waits for a full first page
+PLAYLIST_IDLE_TIMEOUT = 60  # Kill an enumeration when yt-dlp prints nothing for this long
+PLAYLIST_RETENTION = 300  # Seconds a finished enumeration stays available for paging
+
+# "subprocess" runs yt-dlp as a new process per download; "pool" keeps warm
+# worker processes with yt-dlp imported (needs `pip install yt-dlp` in this Python)
+DOWNLOAD_ENGINE = "subprocess"
+YTDLP_POOL_WORKERS = MAX_CONCURRENT_DOWNLOADS + MAX_PLAYLIST_INFO_PROCESSES
+YTDLP_POOL_INSTANCES = 4  # Configured YoutubeDL objects kept per worker
+YTDLP_POOL_PROGRESS_INTERVAL = 0.2  # Seconds between progress events from a worker
+
+# Playlist/video metadata cache, keyed by canonical URL
+STATE_DIR = os.path.join(os.path.expanduser("~"), ".bilal_downloader")
+METADATA_CACHE_TTL = 1800  # Seconds before a cached playlist listing is considered stale
+METADATA_CACHE_SIZE = 256  # Max cached playlists/videos (least recently used are evicted)
+METADATA_CACHE_FILE = os.path.join(STATE_DIR, "metadata_cache.json")  # None to keep the cache in memory only
+METADATA_CACHE_SAVE_DELAY = 5  # Seconds to batch cache changes before writing the file
+DOWNLOAD_ARCHIVE_DIR = os.path.join(STATE_DIR, "archive")  # One yt-dlp --download-archive file per quality; None to disable
+STAGING_DIR = os.path.join(STATE_DIR, "staging")  # In-flight files, one folder per job, moved into DOWNLOAD_DIR when done; None to write in place
+MIN_FREE_SPACE = 1024 ** 3  # Bytes kept free on the staging and download disks; queued jobs wait below this
+DISK_CHECK_INTERVAL = 10  # Seconds between free-space checks while queued jobs wait for disk space
+JOB_JOURNAL_FILE = os.path.join(STATE_DIR, "jobs.db")  # None to forget jobs on restart
+JOURNAL_FLUSH_INTERVAL = 1  # Seconds to batch job changes into one journal transaction
+TOOLCHAIN_CACHE_FILE = os.path.join(STATE_DIR, "toolchain.json")  # Probed tool versions; None to probe on every start
+TOOL_RESCAN_INTERVAL = 30  # Seconds before a tool is looked up again (installed, updated or removed)
+TOOL_PROBE_TIMEOUT = 10  # Seconds to wait for a tool's --version
+LOG_DIR = os.path.join(STATE_DIR, "logs")  # One JSON-lines log of yt-dlp output per job; None for console only
+LOG_LEVEL = "INFO"  # Job logs: "DEBUG" keeps every progress line, "INFO" one per LOG_PROGRESS_INTERVAL
+CONSOLE_LOG_LEVEL = "INFO"  # "WARNING" to only show yt-dlp warnings and errors in the console
+LOG_PROGRESS_INTERVAL = 10  # Seconds between progress lines kept at INFO
+LOG_MAX_BYTES = 1024 * 1024  # Rotate a job's log at this size
+LOG_BACKUP_COUNT = 2  # Rotated logs kept per job
+LOG_QUEUE_SIZE = 10000  # Records waiting for the log writer thread; more are dropped instead of blocking yt-dlp's reader
+LOG_MAX_TAIL = 5000  # Upper bound for /downloads/<id>/log?tail=
+# Cluster mode: one coordinator takes the requests and leases jobs to worker instances
+CLUSTER_ROLE = None  # None runs every job here; "coordinator" or "worker"
+COORDINATOR_URL = None  # Worker: the coordinator's base URL, e.g. "http://10.0.0.2:9876"
+WORKER_URL = None  # Worker: URL the coordinator reaches this instance at (default http://<host>:<PORT>, see main())
+CLUSTER_TOKEN = None  # Shared secret remote clients and workers send as X-Cluster-Token; required off loopback
+WORKER_HEARTBEAT_INTERVAL = 2  # Seconds between worker heartbeats (they carry the leased jobs' progress)
+WORKER_LEASE_TIMEOUT = 15  # A worker silent this long is dropped and its jobs are requeued
+LEASE_POLL_TIMEOUT = 10  # Seconds a worker's lease request waits for a job
+TRACKING_PARAMS = ("si", "feature", "pp", "fbclid", "igshid", "gclid")
+
+# Machine-readable yt-dlp output (see get_progress_args)
+PROGRESS_PREFIX = "[bilal-progress]"
+ITEM_PREFIX = "[bilal-item]"
+FILE_PREFIX = "[bilal-file]"
+PROGRESS_FIELDS = (
+    "status", "downloaded_bytes", "total_bytes", "total_bytes_estimate",
+    "speed", "eta", "fragment_index", "fragment_count",
+)
+
+NETWORK_ERROR_PATTERN = re.compile(  # group 1: the video id of "ERROR: [extractor] <id>: ...", if any
+    r'ERROR:\s*(?:\[[^\]]+\]\s*([^\s:]+):)?.*?(getaddrinfo failed|Network is unreachable|Connection refused|timed out|Connection reset|URLError)',
+    re.IGNORECASE
+)
+NETWORK_ERROR_KINDS = {  # NETWORK_ERROR_PATTERN match -> retry reason reported by /metrics
+    "getaddrinfo failed": "dns",
+    "network is unreachable": "unreachable",
+    "connection refused": "refused",
+    "timed out": "timeout",
+    "connection reset": "reset",
+    "urlerror": "url_error",
+}
+
+
+def get_quality_args(quality):
+    """Build yt-dlp quality selection arguments (single-file formats only when there is no ffmpeg to merge)."""
+    if quality == "audio":
+        spec = "bestaudio"
+    elif quality == "best":
+        spec = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+    elif quality in ("720", "480", "360"):
+        spec = f"bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/best[height<={quality}][ext=mp4]/best"
+    else:
+        spec = "best[ext=mp4]/best"
+    if toolchain.command("ffmpeg") is None:
+        spec = "/".join(choice for choice in spec.split("/") if "+" not in choice)
+    return ["-f", spec]
+
+
+def get_output_args(is_playlist, playlist_items, directory=None):
+    """Build yt-dlp output path and playlist mode arguments (paths under `directory`, default DOWNLOAD_DIR)."""
+    directory = directory or DOWNLOAD_DIR
+    if is_playlist:
+        args = [
+            "-o", os.path.join(directory, "%(playlist_title)s", "%(playlist_index)03d - %(title)s.%(ext)s"),
+            "--yes-playlist",
+        ]
+        if playlist_items:
+            args += ["--playlist-items", playlist_items]
+        return args
+    return [
+        "-o", os.path.join(directory, "%(title)s.%(ext)s"),
+        "--no-playlist",
+    ]
+
+
+def get_postprocess_args(quality):
+    """Post-processing (the CPU-heavy part): audio extraction, thumbnail and metadata embedding."""
+    if not has_ffmpeg():
+        return []
+    args = ["-x", "--audio-format", "mp3"] if quality == "audio" else []
+    return args + ["--embed-thumbnail", "--add-metadata"]
+
+
+def get_download_postprocess_args(quality):
+    """Post-processing arguments for the download run itself.
+
+    With SEPARATE_POSTPROCESSING the download run only keeps what the
+    post-processing stage needs (info JSON and thumbnail next to the file).
+    Merging video and audio stays in the download run: it is a stream copy.
+    """
+    if SEPARATE_POSTPROCESSING:
+        return ["--write-info-json", "--write-thumbnail"] if get_postprocess_args(quality) else []
+    return get_postprocess_args(quality)
+
+
+def get_common_ytdlp_args():
+    """Build common yt-dlp arguments used for both regular and retry downloads."""
+    return [
+        "--no-check-certificates",
+        "--merge-output-format", "mp4",
+        *get_toolchain_args(),
+        "--retries", "10",
+        "--fragment-retries", "10",
+        "--retry-sleep", "exp=1:2:60",
+        "--continue",  # resume .part files left by an interrupted run
+    ]
+
+
+def get_toolchain_args():
+    """Point yt-dlp at the node and ffmpeg the toolchain found (leaving yt-dlp's defaults when missing)."""
+    args = ["--js-runtimes", "node"] if toolchain.command("node") else []
+    ffmpeg = toolchain.path("ffmpeg")
+    if ffmpeg:
+        args += ["--ffmpeg-location", os.path.dirname(ffmpeg)]
+    return args
+
+
+def get_progress_args():
+    """Make yt-dlp report progress, items and final files as machine-readable lines.
+
+    --print implies --quiet, so the human-oriented "[download]" chatter is gone
+    and only these lines plus warnings/errors reach stdout.
+    """
+    progress_template = PROGRESS_PREFIX + "|".join(
+        [f"%(progress.{name})s" for name in PROGRESS_FIELDS] + ["%(info.playlist_index)s", "%(info.id)s"]
+    )
+    return [
+        "--newline",
+        "--progress",
+        "--progress-template", "download:" + progress_template,
+        "--print", "before_dl:" + ITEM_PREFIX
+        + "%(.{id,title,playlist_index,n_entries,playlist_title,filesize,filesize_approx,webpage_url,original_url})j",
+        "--print", "after_move:" + FILE_PREFIX + "%(.{id,filepath,extractor_key})j",
+    ]
+
+
+def _parse_number(value, cast):
+    if value in ("NA", "None", ""):
+        return None
+    try:
+        return cast(float(value))
+    except ValueError:
+        return None
+
+
+def parse_progress_line(line):
+    """Parse a PROGRESS_PREFIX line into typed fields, or return None for any other line."""
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+    values = line[len(PROGRESS_PREFIX):].rstrip("\n").split("|")
+    if len(values) != len(PROGRESS_FIELDS) + 2:
+        return None
+    status, downloaded, total, estimate, speed, eta, frag_index, frag_count, playlist_index, video_id = values
+    return {
+        "status": status,
+        "downloaded_bytes": _parse_number(downloaded, int),
+        "total_bytes": _parse_number(total, int) or _parse_number(estimate, int),
+        "speed": _parse_number(speed, float),
+        "eta": _parse_number(eta, int),
+        "fragment_index": _parse_number(frag_index, int),
+        "fragment_count": _parse_number(frag_count, int),
+        "playlist_index": _parse_number(playlist_index, int),
+        "video_id": None if video_id == "NA" else video_id,
+    }
+
+
+def parse_event_line(line, prefix):
+    """Parse an ITEM_PREFIX/FILE_PREFIX JSON line, or return None for any other line."""
+    if not line.startswith(prefix):
+        return None
+    try:
+        return json.loads(line[len(prefix):])
+    except ValueError:
+        return None
+
+
+def format_bytes(num):
+    """Human-readable size in the same units yt-dlp prints (KiB, MiB, GiB)."""
+    if num < 1024:
+        return f"{num:.0f}B"
+    for unit in ("KiB", "MiB", "GiB"):
+        num /= 1024
+        if num < 1024 or unit == "GiB":
+            return f"{num:.2f}{unit}"
+
+
+def format_progress(job):
+    """One-line progress text for the dashboard, built from the parsed fields."""
+    parts = []
+    if job.playlist_index and job.playlist_count:
+        parts.append(f"[{job.playlist_index}/{job.playlist_count}]")
+    if job.downloaded_bytes is not None and job.total_bytes:
+        parts.append(f"{100.0 * job.downloaded_bytes / job.total_bytes:.1f}% of {format_bytes(job.total_bytes)}")
+    elif job.downloaded_bytes is not None:
+        parts.append(format_bytes(job.downloaded_bytes))
+    if job.speed:
+        parts.append(f"at {format_bytes(job.speed)}/s")
+    if job.eta is not None:
+        parts.append(f"ETA {job.eta // 60:02d}:{job.eta % 60:02d}")
+    if job.fragment_index and job.fragment_count:
+        parts.append(f"(frag {job.fragment_index}/{job.fragment_count})")
+    return " ".join(parts)
+
+
+# ----- Metrics (GET /metrics, Prometheus text format) -----
+
+class Counter:
+    """A value that only goes up, one per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, plus their count and sum."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((label_values, list(counts)) for label_values, counts in self._series.items())
+        for label_values, counts in series:
+            labels = dict(zip(self.labels, label_values))
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                yield self.name + "_bucket", dict(labels, le=str(bound)), total
+            yield self.name + "_count", labels, total
+            yield self.name + "_sum", labels, counts[-1]
+
+
+class Gauge:
+    """A current value, read by `collect()` (returning {label values: value}) at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, collect, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.labels = labels
+
+    def samples(self):
+        for label_values, value in sorted(self.collect().items()):
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+def format_sample(name, labels, value):
+    """One line of the Prometheus text format."""
+    if labels:
+        escaped = (str(val).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for val in labels.values())
+        name += "{" + ",".join(f'{key}="{val}"' for key, val in zip(labels, escaped)) + "}"
+    return f"{name} {value}"
+
+
+def _job_status_counts():
+    counts = dict.fromkeys(("pending", "downloading", "processing", "retrying") + FINISHED_STATUSES, 0)
+    for view in jobs.snapshot()[1]:
+        counts[view["status"]] = counts.get(view["status"], 0) + 1
+    return {(status,): count for status, count in counts.items()}
+
+
+def _current_speed():
+    return {(): float(sum(view["speed"] or 0 for view in jobs.snapshot()[1] if view["status"] == "downloading"))}
+
+
+def _queue_counts():
+    counts = dict(scheduler.counts(), postprocessing=postprocessing.counts()["files"])
+    return {(state,): value for state, value in counts.items()}
+
+
+class Metrics:
+    """Counters and histograms behind GET /metrics.
+
+    Recording is a dict update under the metric's own lock, and the
+    stdout-reading loop records at most one value per progress line;
+    nothing is formatted until a scrape. Gauges are read from the job
+    snapshot and the scheduler when /metrics is requested.
+    """
+
+    def __init__(self):
+        self.jobs_finished = Counter("bilal_jobs_finished_total", "Jobs that reached a final status", ("status",))
+        self.downloaded_bytes = Counter("bilal_downloaded_bytes_total", "Bytes downloaded by yt-dlp")
+        self.download_speed = Histogram("bilal_download_speed_bytes",
+                                        "Average transfer speed of each downloaded file (bytes/s)", SPEED_BUCKETS)
+        self.queue_wait = Histogram("bilal_queue_wait_seconds",
+                                    "Time a due job or retry waited in the queue for a download slot", STAGE_BUCKETS)
+        self.stage = Histogram("bilal_stage_seconds", "Time spent per stage of a yt-dlp run: startup, extraction, "
+                               "transfer, merge or postprocess", STAGE_BUCKETS, ("stage",))
+        self.retries = Counter("bilal_retries_total", "Playlist items queued for another attempt, by what failed them",
+                               ("reason",))
+        self.http = Histogram("bilal_http_request_seconds", "Time to handle an HTTP request", HTTP_BUCKETS,
+                              ("method", "path"))
+        self.log_dropped = Counter("bilal_log_records_dropped_total", "yt-dlp log lines dropped because the log "
+                                   "writer fell behind")
+        self._metrics = [
+            Gauge("bilal_jobs", "Listed jobs by status", _job_status_counts, ("status",)),
+            self.jobs_finished,
+            Gauge("bilal_queue", "Queued and running downloads, their connections and files waiting for "
+                  "post-processing", _queue_counts, ("state",)),
+            self.queue_wait,
+            self.downloaded_bytes,
+            Gauge("bilal_download_speed_current_bytes", "Sum of the running downloads' speeds (bytes/s)",
+                  _current_speed),
+            self.download_speed,
+            self.stage,
+            self.retries,
+            self.http,
+            self.log_dropped,
+        ]
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(format_sample(*sample) for sample in metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# ----- Logging of yt-dlp output -----
+# Reader threads only put records on a queue; one listener thread writes
+# them to the console and to each job's log file.
+
+ytdlp_log = logging.getLogger("bilal.ytdlp")
+ytdlp_log.propagate = False
+
+
+def log_ytdlp(job, level, message, kind="output"):
+    ytdlp_log.log(level, message, extra={"job_id": job.id, "kind": kind})
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for the listener; when the queue is full they are dropped, the caller never waits."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_dropped.inc()
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "kind": getattr(record, "kind", "output"),
+            "message": record.getMessage(),
+        }, ensure_ascii=False)
+
+
+class JobLogHandler(logging.Handler):
+    """Writes each job's records to LOG_DIR/<job id>.log, rotated at LOG_MAX_BYTES.
+
+    Only the most recently used files are kept open.
+    """
+
+    def __init__(self, directory, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT, max_open=32):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_open = max_open
+        self._files = collections.OrderedDict()  # job id -> RotatingFileHandler, least recently used first
+
+    def path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.log")
+
+    def emit(self, record):
+        job_id = getattr(record, "job_id", None)
+        if job_id is None:
+            return
+        handler = self._files.get(job_id)
+        if handler is None:
+            os.makedirs(self.directory, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.path(job_id), maxBytes=self.max_bytes, backupCount=self.backup_count, encoding="utf-8")
+            handler.setFormatter(self.formatter)
+            self._files[job_id] = handler
+            while len(self._files) > self.max_open:
+                self._files.popitem(last=False)[1].close()
+        else:
+            self._files.move_to_end(job_id)
+        handler.emit(record)
+
+    def _paths(self, job_id):
+        """The job's log files, newest first."""
+        path = self.path(job_id)
+        return [path] + [f"{path}.{n}" for n in range(1, self.backup_count + 1)]
+
+    def tail(self, job_id, count):
+        """The job's last `count` log lines, oldest first, reading its files backwards."""
+        lines = []
+        with self.lock:
+            for path in self._paths(job_id):
+                if len(lines) >= count:
+                    break
+                try:
+                    lines[:0] = tail_lines(path, count - len(lines))
+                except FileNotFoundError:
+                    break
+        return lines
+
+    def forget(self, job_ids):
+        """Delete the logs of jobs that are no longer listed."""
+        with self.lock:
+            for job_id in job_ids:
+                handler = self._files.pop(job_id, None)
+                if handler is not None:
+                    handler.close()
+                for path in self._paths(job_id):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
+def tail_lines(path, count, block_size=64 * 1024):
+    """The last `count` lines of a file, without reading more of it than needed."""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        data = b""
+        while end > 0 and data.count(b"\n") <= count:
+            start = max(0, end - block_size)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+    return [line.decode("utf-8", "replace") for line in data.splitlines()[-count:]] if count > 0 else []
+
+
+job_logs = None  # JobLogHandler, set by setup_logging() unless LOG_DIR is None
+
+
+def setup_logging():
+    """Route yt-dlp output through a queue to the console and the per-job logs. Returns the listener."""
+    global job_logs
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(CONSOLE_LOG_LEVEL)
+    console.setFormatter(logging.Formatter("  [yt-dlp] %(message)s"))
+    console.addFilter(lambda record: getattr(record, "kind", None) != "progress")
+    handlers = [console]
+    levels = [console.level]
+    if LOG_DIR:
+        job_logs = JobLogHandler(LOG_DIR)
+        job_logs.setLevel(LOG_LEVEL)
+        job_logs.setFormatter(JsonLineFormatter())
+        handlers.append(job_logs)
+        levels.append(job_logs.level)
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    ytdlp_log.addHandler(queue_handler)
+    ytdlp_log.setLevel(min(levels))  # so progress lines are not even queued unless a handler keeps them
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def apply_item(job, item):
+    """A new video is about to download: record its title, index and id."""
+    fields = {"playlist_index": item.get("playlist_index"), "playlist_count": item.get("n_entries"),
+              "current_title": item.get("title"), "downloaded_bytes": None, "total_bytes": None}
+    if len(job.urls) > 1:
+        # A /download/batch group: count the videos of the run like playlist items
+        fields["playlist_index"] = min((job.playlist_index or 0) + 1, len(job.urls))
+        fields["playlist_count"] = len(job.urls)
+    if job.title == job.url:
+        fields["title"] = item.get("playlist_title") or item.get("title") or job.url
+    if item.get("id") and item.get("playlist_index"):
+        job.playlist_entries[item["playlist_index"]] = item["id"]
+    if item.get("id"):
+        # The URL a retry asks for: the one the batch passed in, else the video's own page
+        url = item.get("original_url")
+        job.video_urls[item["id"]] = url if url in job.urls else item.get("webpage_url") or url
+    if not job.is_playlist and len(job.urls) == 1 and item.get("title"):
+        metadata_cache.put(canonical_url(job.url, playlist=False), {"id": item.get("id"), "title": item["title"]})
+    jobs.update(job, **fields)
+
+
+def apply_saved_file(job, done, saved_ids=None):
+    """A video has been saved in the job's folder: publish it (after post-processing, if that runs separately)."""
+    if saved_ids is not None and done.get("id"):
+        saved_ids.add(done["id"])
+    if done.get("id") and done.get("extractor_key"):
+        download_archive.add(job.quality, done["extractor_key"], done["id"])
+    filepath = done.get("filepath")
+    if SEPARATE_POSTPROCESSING and filepath and job.direct is None and get_postprocess_args(job.quality):
+        postprocessing.submit(job, filepath)
+    else:
+        filepath = staging.publish(job, filepath)
+    if jobs.journal is not None:
+        jobs.journal.record_file(job, done.get("id"), filepath)
+    log_ytdlp(job, logging.INFO, f"✅ Saved: {filepath}")
+    jobs.update(job, filepath=filepath, files_completed=job.files_completed + 1)
+
+
+def handle_ytdlp_line(job, line, failed_ids=None, current_id=None):
+    """Log a human-readable line of yt-dlp output. Returns True if the line was a network error.
+
+    Videos that hit a network error are recorded in `failed_ids` (video id ->
+    kind of error, see NETWORK_ERROR_KINDS). An error that names no video
+    is put on `current_id`, the video being downloaded, if any.
+    """
+    line = line.strip()
+    if not line:
+        return False
+    if line.startswith("ERROR:"):
+        log_ytdlp(job, logging.ERROR, line)
+    else:
+        log_ytdlp(job, logging.WARNING if line.startswith("WARNING:") else logging.INFO, line)
+        return False
+    match = NETWORK_ERROR_PATTERN.search(line)
+    video_id = match and (match.group(1) or current_id)
+    if video_id and failed_ids is not None and video_id not in failed_ids:
+        failed_ids[video_id] = NETWORK_ERROR_KINDS.get(match.group(2).lower(), "network")
+    return match is not None
+
+
+class JobOutput:
+    """Routes one yt-dlp run's output to its job, whichever engine produced it.
+
+    It also times the run's stages for /metrics: start-up (until yt-dlp
+    first logs anything), extraction (until a video is about to download),
+    transfer (until its last stream finished) and what happens after that
+    until the file reaches its final path. The subprocess engine's yt-dlp is
+    quiet until the first video is extracted, so there start-up is counted
+    in that first extraction.
+    """
+
+    def __init__(self, job, failed_ids=None, saved_ids=None, owner=None):
+        self.job = job
+        self.owner = owner or job  # the job or RetryItem whose run this is
+        self.failed_ids = failed_ids
+        self.saved_ids = saved_ids
+        self.network_error = False
+        self._current_id = None  # video between its ITEM_PREFIX and FILE_PREFIX lines
+        self._started = False
+        self._mark = time.monotonic()  # start of the current stage
+        self._streaming = False  # the current stream reported progress before finishing
+        self._transferred = None  # when the current video's last stream finished
+        self._file_bytes = 0
+        self._stream_bytes = 0
+        self._progress_logged = 0
+
+    def line(self, line):
+        progress = parse_progress_line(line)
+        if progress is not None:
+            self.progress(progress)
+            return
+        item = parse_event_line(line, ITEM_PREFIX)
+        if item is not None:
+            self.item(item)
+            return
+        done = parse_event_line(line, FILE_PREFIX)
+        if done is not None:
+            self.saved(done)
+            return
+        if not self._started:
+            self._started = True
+            now = time.monotonic()
+            metrics.stage.observe(now - self._mark, "startup")
+            self._mark = now
+        if handle_ytdlp_line(self.job, line, self.failed_ids, self._current_id):
+            self.network_error = True
+
+    def progress(self, progress):
+        downloaded = progress["downloaded_bytes"] or 0
+        if progress["status"] == "downloading":
+            self._streaming = True
+        if self._streaming:
+            if downloaded < self._stream_bytes:
+                self._stream_bytes = 0
+            if downloaded > self._stream_bytes:
+                metrics.downloaded_bytes.inc(amount=downloaded - self._stream_bytes)
+            self._stream_bytes = downloaded
+        if progress["status"] == "finished":
+            if self._streaming:
+                self._transferred = time.monotonic()
+                self._file_bytes += downloaded
+            self._streaming = False
+            self._stream_bytes = 0
+        jobs.update_progress(self.job, progress)
+        if ytdlp_log.isEnabledFor(logging.DEBUG):
+            log_ytdlp(self.job, logging.DEBUG, self.job.progress, "progress")
+        elif ytdlp_log.isEnabledFor(logging.INFO):
+            now = time.monotonic()
+            if progress["status"] == "finished" or now - self._progress_logged >= LOG_PROGRESS_INTERVAL:
+                self._progress_logged = now
+                log_ytdlp(self.job, logging.INFO, self.job.progress, "progress")
+
+    def item(self, item):
+        self._started = True
+        now = time.monotonic()
+        metrics.stage.observe(now - self._mark, "extraction")
+        self._mark = now
+        self._current_id = item.get("id")
+        apply_item(self.job, item)
+        error = disk_space.reserve(self.owner.id, item.get("filesize") or item.get("filesize_approx"))
+        if error is not None:
+            log_ytdlp(self.job, logging.ERROR, f"❌ {error}")
+            jobs.update(self.job, error=error)
+            stop_runs(self.owner)
+
+    def saved(self, done):
+        now = time.monotonic()
+        if self._transferred is not None:
+            transfer = self._transferred - self._mark
+            metrics.stage.observe(transfer, "transfer")
+            if transfer > 0:
+                metrics.download_speed.observe(self._file_bytes / transfer)
+            metrics.stage.observe(now - self._transferred, "merge" if SEPARATE_POSTPROCESSING else "postprocess")
+        self._mark = now
+        self._transferred = None
+        self._file_bytes = 0
+        self._current_id = None
+        apply_saved_file(self.job, done, self.saved_ids)
+
+
+def select_profile(quality, url, requested=None):
+    """Name of the download profile for a request: explicit, per host, per quality, then default."""
+    if requested:
+        return requested
+    return HOST_PROFILES.get(host_key(url)) or QUALITY_PROFILES.get(quality) or DEFAULT_PROFILE
+
+
+def get_profile_args(profile):
+    """yt-dlp arguments for a download profile's fragment and connection settings."""
+    settings = DOWNLOAD_PROFILES[profile]
+    args = ["-N", str(settings["fragments"])]
+    if settings.get("chunk_size"):
+        args += ["--http-chunk-size", settings["chunk_size"]]
+    connections = settings.get("aria2c_connections")
+    aria2c = toolchain.path("aria2c")
+    if connections and aria2c:
+        # Only plain HTTP(S) downloads go to aria2c; DASH/HLS keep the native fragment downloader
+        args += [
+            "--downloader", f"http:{aria2c}",
+            "--downloader-args", f"aria2c:-x{connections} -s{connections} -k1M --console-log-level=warn",
+        ]
+    return args
+
+
+def profile_connections(profile):
+    """How many connections a download with this profile opens at most."""
+    settings = DOWNLOAD_PROFILES[profile]
+    aria2c = settings.get("aria2c_connections") if toolchain.path("aria2c") else 0
+    return max(settings["fragments"], aria2c or 1)
+
+
+def get_archive_args(quality):
+    """Make yt-dlp skip (and record) videos already downloaded in this quality."""
+    path = download_archive.path(quality)
+    return ["--download-archive", path] if path else []
+
+
+def build_download_command(ytdlp_cmd, url, quality, is_playlist, playlist_items, use_archive=True, profile=None,
+                           directory=None):
+    """Build full yt-dlp command for a download request.
+
+    `url` may also be a list of video URLs that one yt-dlp run downloads in
+    turn (a group of a /download/batch request). Files are written under
+    `directory` (the job's staging folder), default DOWNLOAD_DIR.
+    """
+    urls = [url] if isinstance(url, str) else list(url)
+    cmd = list(ytdlp_cmd)
+    cmd += get_quality_args(quality)
+    cmd += get_download_postprocess_args(quality)
+    cmd += get_output_args(is_playlist, playlist_items, directory)
+    cmd += get_common_ytdlp_args()
+    cmd += get_profile_args(profile or select_profile(quality, urls[0]))
+    if use_archive:
+        cmd += get_archive_args(quality)
+    cmd += get_progress_args()
+    cmd += urls
+    return cmd
+
+
+def build_job_command(ytdlp_cmd, job):
+    """The download command for a job, from its stored arguments (None for a direct download)."""
+    if job.direct is not None:
+        return None
+    urls = job.urls if len(job.urls) > 1 else job.url
+    return build_download_command(ytdlp_cmd, urls, job.quality, job.is_playlist, job.playlist_items,
+                                  job.use_archive, job.profile, staging.job_dir(job))
+
+
+def build_retry_command(ytdlp_cmd, vid_urls, quality, profile=None, directory=None):
+    """Build yt-dlp command for retrying playlist items by their video URLs.
+
+    Only used when the items' playlist indexes are unknown; otherwise the
+    original playlist URL is retried with --playlist-items.
+    """
+    retry_cmd = list(ytdlp_cmd)
+    retry_cmd += get_quality_args(quality)
+    retry_cmd += get_download_postprocess_args(quality)
+    directory = directory or DOWNLOAD_DIR
+    retry_cmd += [
+        "-o", os.path.join(directory, "%(playlist_title)s", "%(playlist_index)03d - %(title)s.%(ext)s"),
+        "--no-playlist",
+    ]
+    retry_cmd += get_common_ytdlp_args()
+    retry_cmd += get_profile_args(profile or select_profile(quality, vid_urls[0]))
+    retry_cmd += get_archive_args(quality)
+    retry_cmd += get_progress_args()
+    retry_cmd += vid_urls
+    return retry_cmd
+
+
+def build_postprocess_command(ytdlp_cmd, job, filepath):
+    """yt-dlp command that only runs the post-processors over a file the download stage saved.
+
+    --load-info-json (kept last, the pool engine splits it off) replays the
+    extraction offline with the same format and output options, so yt-dlp
+    finds the media file and thumbnail already on disk and downloads nothing.
+    """
+    cmd = list(ytdlp_cmd)
+    cmd += get_quality_args(job.quality)
+    cmd += get_output_args(job.is_playlist, "", staging.job_dir(job))
+    cmd += ["--merge-output-format", "mp4", "--no-progress"]
+    cmd += get_postprocess_args(job.quality)
+    cmd += ["--print", "after_move:" + FILE_PREFIX + "%(.{id,filepath})j"]
+    cmd += ["--load-info-json", info_json_path(filepath)]
+    return cmd
+
+
+def info_json_path(filepath):
+    """Where --write-info-json put the info JSON of a downloaded file."""
+    return os.path.splitext(filepath)[0] + ".info.json"
+
+
+def start_ytdlp_process(cmd):
+    """Launch yt-dlp with merged stdout/stderr in its own process group so it can be killed as a tree."""
+    kwargs = {}
+    if sys.platform == "win32":
+        kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    return subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        **kwargs
+    )
+
+
+def kill_process_tree(process):
+    """Kill a yt-dlp process together with the ffmpeg/node children it spawned."""
+    if process is None or process.poll() is not None:
+        return
+    try:
+        if sys.platform == "win32":
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                capture_output=True, creationflags=subprocess.CREATE_NO_WINDOW
+            )
+        else:
+            os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+    except (OSError, subprocess.SubprocessError):
+        process.kill()
+
+
+def ytdlp_args(cmd):
+    """The arguments of a command built from get_ytdlp_cmd(), without the executable part."""
+    prefix = get_ytdlp_cmd() or []
+    if cmd[:len(prefix)] != prefix:
+        return None
+    return cmd[len(prefix):]
+
+
+def run_ytdlp(job, cmd, failed_ids=None, owner=None, saved_ids=None):
+    """Run one yt-dlp command for a job on the configured engine.
+
+    `owner` is what holds the process and run id while it runs: the job
+    itself, or one of its RetryItems when several run in parallel.
+    Returns (returncode, saw_network_error).
+    """
+    owner = owner or job
+    output = JobOutput(job, failed_ids, saved_ids, owner)
+    args = ytdlp_args(cmd) if ytdlp_pool is not None else None
+    rate = bandwidth.acquire(owner.id, job.rate_limit, pinned=args is None)
+    try:
+        if args is not None:
+            returncode = ytdlp_pool.run(owner.id, _pool_download, args, output)
+            return returncode, output.network_error
+        if rate:
+            cmd = with_rate_limit(cmd, rate)
+        return run_ytdlp_process(job, cmd, owner, output)
+    finally:
+        bandwidth.release(owner.id)
+        disk_space.release(owner.id)
+
+
+def with_rate_limit(cmd, rate):
+    """The command with --limit-rate inserted right after the yt-dlp executable part."""
+    args = ytdlp_args(cmd)
+    split = len(cmd) - len(args) if args is not None else 1
+    return cmd[:split] + ["--limit-rate", str(rate)] + cmd[split:]
+
+
+def run_ytdlp_process(job, cmd, owner, output):
+    process = start_ytdlp_process(cmd)
+    set_process(owner, process)
+    if job.cancel_event.is_set():
+        kill_process_tree(process)
+    for line in process.stdout:
+        output.line(line)
+    process.wait()
+    set_process(owner, None)
+    return process.returncode, output.network_error
+
+
+def set_process(owner, process):
+    if isinstance(owner, DownloadJob):
+        jobs.update(owner, process=process)
+    else:
+        owner.process = process
+
+
+def stop_runs(owner):
+    """Kill whatever yt-dlp run `owner` (a job or a RetryItem) has going on either engine."""
+    kill_process_tree(owner.process)
+    if ytdlp_pool is not None:
+        ytdlp_pool.cancel(owner.id)
+
+
+# ----- In-process engine (DOWNLOAD_ENGINE = "pool") -----
+# The functions below run inside the pool's worker processes.
+
+_pool_state = {}
+
+
+def _pool_init(events, cancelled, rate_limits):
+    """Worker start-up: import yt-dlp once and remember the channels back to the server."""
+    import yt_dlp  # noqa: F401 - the point is to pay the import here, not per download
+    _pool_state.update(events=events, cancelled=cancelled, rate_limits=rate_limits, run_id=None, ydl=None,
+                       instances=collections.OrderedDict())
+
+
+def _pool_emit(kind, payload):
+    _pool_state["events"].put((_pool_state["run_id"], kind, payload))
+
+
+def _pool_apply_rate_limit():
+    """Pick up this run's current bandwidth share; yt-dlp's downloaders read params["ratelimit"] live."""
+    ydl = _pool_state["ydl"]
+    if ydl is not None:
+        ydl.params["ratelimit"] = _pool_state["rate_limits"].get(_pool_state["run_id"])
+
+
+def _pool_check_cancelled():
+    from yt_dlp.utils import DownloadCancelled
+    if _pool_state["cancelled"].get(_pool_state["run_id"]):
+        raise DownloadCancelled("Cancelled by user")
+
+
+class _PoolLogger:
+    """yt-dlp logger that forwards messages to the server as output lines."""
+
+    def debug(self, msg):
+        if not msg.startswith("[debug] "):
+            _pool_emit("line", msg)
+
+    def info(self, msg):
+        _pool_emit("line", msg)
+
+    def warning(self, msg):
+        _pool_emit("line", "WARNING: " + msg)
+
+    def error(self, msg):
+        _pool_emit("line", msg)
+
+
+def _pool_progress_hook(d):
+    """Send typed progress (same fields as parse_progress_line) at most every YTDLP_POOL_PROGRESS_INTERVAL."""
+    now = time.time()
+    if d.get("status") == "downloading" and now - _pool_state.get("last_progress", 0) < YTDLP_POOL_PROGRESS_INTERVAL:
+        return
+    _pool_state["last_progress"] = now
+    info = d.get("info_dict") or {}
+    _pool_emit("progress", {
+        "status": d.get("status"),
+        "downloaded_bytes": d.get("downloaded_bytes"),
+        "total_bytes": d.get("total_bytes") or d.get("total_bytes_estimate"),
+        "speed": d.get("speed"),
+        "eta": int(d["eta"]) if d.get("eta") is not None else None,
+        "fragment_index": d.get("fragment_index"),
+        "fragment_count": d.get("fragment_count"),
+        "playlist_index": info.get("playlist_index"),
+        "video_id": info.get("id"),
+    })
+    _pool_check_cancelled()
+    _pool_apply_rate_limit()
+
+
+def _pool_reporter(kind, fields):
+    """A yt-dlp post-processor that reports selected info fields instead of changing anything."""
+    from yt_dlp.postprocessor import PostProcessor
+
+    class Reporter(PostProcessor):
+        def run(self, info):
+            _pool_emit(kind, {name: info.get(name) for name in fields if info.get(name) is not None})
+            return [], info
+
+    return Reporter()
+
+
+def _pool_youtubedl(options):
+    """A configured YoutubeDL for these command-line options, reused across runs in this worker."""
+    import yt_dlp
+    key = tuple(options)
+    instances = _pool_state["instances"]
+    if key in instances:
+        instances.move_to_end(key)
+        return instances[key]
+    ydl_opts = yt_dlp.parse_options(list(options)).ydl_opts
+    ydl_opts.update(logger=_PoolLogger(), noprogress=True, forceprint={}, progress_hooks=[_pool_progress_hook])
+    ydl = yt_dlp.YoutubeDL(ydl_opts)
+    ydl.add_post_processor(
+        _pool_reporter("item", ("id", "title", "playlist_index", "n_entries", "playlist_title")), when="before_dl")
+    ydl.add_post_processor(_pool_reporter("saved", ("id", "filepath", "extractor_key")), when="after_move")
+    instances[key] = ydl
+    while len(instances) > YTDLP_POOL_INSTANCES:
+        instances.popitem(last=False)
+    return ydl
+
+
+def _pool_download(run_id, args):
+    """Download the URLs at the end of `args` with a warm YoutubeDL. Returns yt-dlp's exit code."""
+    import yt_dlp
+    from yt_dlp.utils import DownloadCancelled
+    _pool_state["run_id"] = run_id
+    returncode = 1
+    try:
+        urls = yt_dlp.parse_options(list(args)).urls
+        ydl = _pool_state["ydl"] = _pool_youtubedl(args[:-len(urls)])
+        _pool_apply_rate_limit()
+        ydl._download_retcode = 0
+        returncode = ydl.download(urls)
+    except DownloadCancelled:
+        returncode = 1
+    except Exception as e:
+        _pool_emit("line", f"ERROR: {e}")
+    _pool_emit("done", returncode)
+    return returncode
+
+
+def _pool_postprocess(run_id, args):
+    """Run only the post-processors over a downloaded file by replaying its info JSON (the last argument)."""
+    _pool_state["run_id"] = run_id
+    returncode = 1
+    try:
+        ydl = _pool_state["ydl"] = _pool_youtubedl(args[:-2])
+        ydl._download_retcode = 0
+        returncode = ydl.download_with_info_file(args[-1])
+    except Exception as e:
+        _pool_emit("line", f"ERROR: {e}")
+    _pool_emit("done", returncode)
+    return returncode
+
+
+def _pool_list_playlist(run_id, args):
+    """List a playlist's entries as --dump-json lines, streaming them as they are extracted."""
+    from yt_dlp.utils import DownloadCancelled
+    _pool_state["run_id"] = run_id
+    returncode = 0
+    try:
+        ydl = _pool_youtubedl(args[:-1])
+        info = ydl.extract_info(args[-1], download=False, process=False)
+        playlist_title = info.get("title", "")
+        for entry in info.get("entries") or []:
+            _pool_check_cancelled()
+            entry = dict(entry, playlist_title=playlist_title)
+            _pool_emit("line", json.dumps(ydl.sanitize_info(entry), ensure_ascii=False))
+    except DownloadCancelled:
+        returncode = 1
+    except Exception as e:
+        _pool_emit("line", f"ERROR: {e}")
+        returncode = 1
+    _pool_emit("done", returncode)
+    return returncode
+
+
+class YtdlpPool:
+    """In-process yt-dlp engine: worker processes that import yt-dlp once and keep YoutubeDL instances warm.
+
+    Runs happen in separate processes for isolation (a crashing extractor
+    can't take the server down), and report back over one queue that a
+    dispatcher thread routes to each run's output object.
+    """
+
+    def __init__(self, workers=YTDLP_POOL_WORKERS):
+        self.workers = workers
+        self._runs = {}
+        self._executor = None
+
+    def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        self._manager = ctx.Manager()
+        self._cancelled = self._manager.dict()
+        self._rate_limits = self._manager.dict()
+        self._events = ctx.Queue()
+        self._executor = ProcessPoolExecutor(
+            self.workers, mp_context=ctx, initializer=_pool_init, initargs=(self._events, self._cancelled, self._rate_limits)
+        )
+        threading.Thread(target=self._dispatch, name="ytdlp-pool-events", daemon=True).start()
+        # Spawn and initialize every worker now, not on the first download
+        for future in [self._executor.submit(time.sleep, 0) for _ in range(self.workers)]:
+            future.result()
+        return self
+
+    def run(self, run_id, task, args, output, started=None):
+        """Run `task(run_id, args)` in a worker, feeding its events to `output`. Returns the exit code.
+
+        `started()` is called once the run is registered, from when cancel() reaches it.
+        """
+        done = threading.Event()
+        self._runs[run_id] = (output, done)
+        self._cancelled.pop(run_id, None)
+        if started is not None:
+            started()
+        try:
+            returncode = self._executor.submit(task, run_id, list(args)).result()
+            done.wait(5)  # let the dispatcher catch up with the run's last events
+        except Exception as e:
+            output.line(f"ERROR: yt-dlp worker failed: {e}")
+            returncode = 1
+        finally:
+            self._runs.pop(run_id, None)
+            self._cancelled.pop(run_id, None)
+        return returncode
+
+    def cancel(self, run_id):
+        if run_id in self._runs:
+            self._cancelled[run_id] = True
+
+    def set_rate_limit(self, run_id, rate):
+        """Change a run's bandwidth share while it downloads (None to lift it)."""
+        if rate:
+            self._rate_limits[run_id] = rate
+        else:
+            self._rate_limits.pop(run_id, None)
+
+    def _dispatch(self):
+        while True:
+            run_id, kind, payload = self._events.get()
+            run = self._runs.get(run_id)
+            if run is None:
+                continue
+            output, done = run
+            if kind == "done":
+                done.set()
+                continue
+            handler = getattr(output, kind, None)
+            if handler is not None:
+                try:
+                    handler(payload)
+                except Exception as e:
+                    print(f"[Engine] ⚠️ Could not apply {kind} event: {e}")
+
+
+ytdlp_pool = None  # set by start_engine() when DOWNLOAD_ENGINE is "pool"
+
+
+def start_engine():
+    """Start the in-process yt-dlp pool if configured and available.
+
+    The workers warm up in the background so startup doesn't wait for them;
+    runs that start meanwhile use the subprocess engine.
+    """
+    if DOWNLOAD_ENGINE != "pool":
+        return
+    if importlib.util.find_spec("yt_dlp") is None:
+        print("  Engine: ⚠️ yt_dlp module not importable, using subprocess engine")
+        return
+    threading.Thread(target=_start_pool, name="ytdlp-pool-start", daemon=True).start()
+
+
+def _start_pool():
+    global ytdlp_pool
+    ytdlp_pool = YtdlpPool().start()
+
+
+# ----- Direct downloads (media URLs captured by the extension, fetched without yt-dlp) -----
+
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+
+
+class DirectDownloadError(Exception):
+    """A response a direct download can't use. `retryable` for server-side trouble (5xx, 429)."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def direct_filename(requested, url, content_type=None, disposition=None):
+    """File name for a direct download: the requested one, else the server's, else the URL's last path part."""
+    name = requested
+    if not name and disposition:
+        match = re.search(r"filename\*=(?:UTF-8'')?\"?([^\";]+)|filename=\"?([^\";]+)", disposition, re.IGNORECASE)
+        if match:
+            name = unquote(match.group(1) or match.group(2))
+    if not name:
+        name = unquote(urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1])
+    name = re.sub(r'[<>:"/\\|?*\x00-\x1f]', "_", name).strip(" .")[:200] or "video"
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if not os.path.splitext(name)[1] and media_type.startswith(("video/", "audio/", "image/")):
+        name += mimetypes.guess_extension(media_type) or ""
+    return name
+
+
+def free_filename(name):
+    """`name`, or "name (2).ext", "name (3).ext"... if DOWNLOAD_DIR already has a file by that name."""
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while os.path.exists(os.path.join(DOWNLOAD_DIR, candidate)):
+        n += 1
+        candidate = f"{base} ({n}){ext}"
+    return candidate
+
+
+class DirectDownload:
+    """Fetches a job's URL with HTTP Range requests over several keep-alive connections.
+
+    The first request follows redirects and asks for the first segment,
+    which tells whether the server honours Range and how big the file is.
+    The file is then preallocated, cut into DIRECT_SEGMENT_SIZE segments,
+    and the job's connections (DIRECT_CONNECTIONS) take segments in turn,
+    each worker reusing its own connection and writing at the segment's
+    offset. A segment that fails is retried from the byte it stopped at, on
+    a new connection. What is still missing is saved next to the .part file
+    every DIRECT_STATE_INTERVAL seconds, so a restarted job (or server)
+    fetches only that, unless the file changed on the server meanwhile.
+    Servers that ignore Range get one plain stream, started over on errors.
+    """
+
+    def __init__(self, job, output, rate=None):
+        self.job = job
+        self.output = output  # JobOutput that progress and the saved file are reported through
+        self.rate = rate  # bytes/s for all connections together, or None
+        self.url = job.url  # after redirects
+        self.headers = dict({"User-Agent": DIRECT_USER_AGENT, "Accept-Encoding": "identity"},
+                            **job.direct.get("headers", {}))
+        self.folder = staging.job_dir(job)
+        self.state_path = os.path.join(self.folder, f".{job.id}.direct.json")
+        self.filename = None
+        self.size = None  # None while unknown (a plain stream without Content-Length)
+        self.validator = None  # ETag or Last-Modified, to tell whether a resumed file changed
+        self.ranged = False
+        self.segment_count = 0
+        self.downloaded = 0
+        self.error = None
+        self._segments = collections.deque()  # (start, end, attempt) waiting for a worker
+        self._active = {}  # worker -> [next byte, end] of the segment it is fetching
+        self._done_segments = 0
+        self._connections = {}  # worker -> (scheme, netloc, HTTPConnection), kept open between segments
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._running = 0  # worker threads still going
+        self._idle = threading.Event()  # set by the last worker to exit
+        self._throttle_start = None
+        self._throttled = 0
+
+    @property
+    def part_path(self):
+        return os.path.join(self.folder, self.filename + ".part")
+
+    def run(self):
+        """Download into the job's folder and report the saved file. Returns True on success."""
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            first = self._probe(self._load_state())
+            error = disk_space.reserve(self.job.id, self.size - self.downloaded if self.size else None)
+            if error is not None:
+                raise DirectDownloadError(error)
+            self._fetch(first)
+            if not self._stopped():
+                self._finish()
+                return True
+        except (OSError, http.client.HTTPException, DirectDownloadError) as e:
+            self.error = self.error or str(e)
+        finally:
+            self._close_connections()
+        self._save_state()
+        return False
+
+    def _probe(self, state):
+        """Send the first request and plan the segments. Returns (segment, response) for the first worker, or None."""
+        remaining = state["remaining"] if state else []
+        start = remaining[0][0] if remaining else 0
+        end = min(start + DIRECT_SEGMENT_SIZE, remaining[0][1]) if remaining else DIRECT_SEGMENT_SIZE
+        for attempt in range(DIRECT_RETRIES):
+            try:
+                response = self._open(start, end)
+                break
+            except (OSError, http.client.HTTPException, DirectDownloadError) as e:
+                self._drop_connection(0)
+                if (isinstance(e, DirectDownloadError) and not e.retryable) or attempt + 1 >= DIRECT_RETRIES:
+                    raise
+                log_ytdlp(self.job, logging.WARNING, f"⚠️ {e}, retrying")
+                if self.job.cancel_event.wait(DIRECT_RETRY_DELAY * 2 ** attempt):
+                    raise DirectDownloadError("Cancelled")
+
+        self.validator = response.getheader("ETag") or response.getheader("Last-Modified")
+        received = None
+        if response.status == 206:
+            match = CONTENT_RANGE_PATTERN.fullmatch(response.getheader("Content-Range") or "")
+            if match is None or match.group(3) == "*" or int(match.group(1)) != start:
+                raise DirectDownloadError(f"Unusable Content-Range: {response.getheader('Content-Range')}")
+            self.ranged = True
+            self.size = int(match.group(3))
+            received = (start, int(match.group(2)) + 1)
+        else:
+            length = response.getheader("Content-Length")
+            self.size = int(length) if length and length.isdigit() else None
+
+        resume = (state is not None and self.ranged and state["size"] == self.size
+                  and state["validator"] == self.validator)
+        if state is not None:
+            self.filename = state["filename"]
+        else:
+            self.filename = free_filename(direct_filename(
+                self.job.direct.get("filename"), self.url, response.getheader("Content-Type"),
+                response.getheader("Content-Disposition")))
+        if resume:
+            ranges = [(a, b) for a, b in remaining]
+        elif state is not None:
+            log_ytdlp(self.job, logging.INFO, "The file changed on the server, starting over")
+        if not resume:
+            ranges = [(0, self.size)] if self.size else []
+        self._preallocate(resume)
+
+        if self.ranged:
+            for range_start, range_end in ranges:
+                for offset in range(range_start, range_end, DIRECT_SEGMENT_SIZE):
+                    self._segments.append((offset, min(offset + DIRECT_SEGMENT_SIZE, range_end), 0))
+            if resume and "done_segments" in state:  # the counts the earlier run had, whatever the pieces left
+                self._done_segments = state["done_segments"]
+                self.segment_count = self._done_segments + len(self._segments)
+            else:
+                self.segment_count = -(-self.size // DIRECT_SEGMENT_SIZE)
+                self._done_segments = self.segment_count - len(self._segments)
+            self.downloaded = self.size - sum(b - a for a, b in ranges)
+        else:
+            self._segments.append((0, self.size, 0))  # one stream; its size may be unknown (None)
+        fields = {"current_title": self.filename, "total_bytes": self.size, "downloaded_bytes": self.downloaded}
+        if self.job.title == self.job.url:
+            fields["title"] = self.filename
+        jobs.update(self.job, **fields)
+        mode = f"{len(self._segments)} segment(s) over {self.job.connections} connection(s)" if self.ranged \
+            else "one stream (no Range support)"
+        size = format_bytes(self.size) if self.size else "unknown size"
+        log_ytdlp(self.job, logging.INFO, f"⬇️ Direct download of {self.filename} ({size}): {mode}"
+                  + (f", resuming at {format_bytes(self.downloaded)}" if self.downloaded else ""))
+
+        if not self.ranged or (self._segments and self._segments[0][:2] == received):
+            return self._take(0), response
+        response.close()  # not the segment to fetch first (the file changed, or nothing is missing)
+        self._drop_connection(0)
+        return None
+
+    def _open(self, start, end):
+        """GET bytes start..end-1 on worker 0's connection, following redirects. Returns the response."""
+        for _ in range(MAX_REDIRECTS):
+            response = self._request(0, start, end)
+            if response.status not in REDIRECT_STATUSES:
+                break
+            location = response.getheader("Location")
+            response.read()
+            if not location:
+                raise DirectDownloadError(f"HTTP {response.status} without a Location")
+            self.url = urljoin(self.url, location)
+        else:
+            raise DirectDownloadError("Too many redirects")
+        if response.status not in (200, 206):
+            raise DirectDownloadError(f"HTTP {response.status} {response.reason}",
+                                      retryable=response.status >= 500 or response.status == 429)
+        return response
+
+    def _request(self, worker, start=None, end=None):
+        """Send a GET (for bytes start..end-1, if given) on the worker's connection. Returns the response."""
+        parts = urlsplit(self.url)
+        held = self._connections.get(worker)
+        if held is None or held[:2] != (parts.scheme, parts.netloc):
+            self._drop_connection(worker)
+            if self._stopped():
+                raise DirectDownloadError("Stopped")
+            connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            held = (parts.scheme, parts.netloc, connection_class(parts.hostname, parts.port, timeout=DIRECT_TIMEOUT))
+            with self._lock:
+                self._connections[worker] = held
+        headers = dict(self.headers)
+        if start is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        held[2].request("GET", path, headers=headers)
+        return held[2].getresponse()
+
+    def _preallocate(self, resume):
+        """Create the .part file at its full size up front (kept as it is when resuming)."""
+        with open(self.part_path, "r+b" if resume else "w+b") as f:
+            if resume or not self.size:
+                return
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, self.size)
+                    return
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        raise
+            f.truncate(self.size)  # filesystems without fallocate
+
+    def _fetch(self, first):
+        """Run the workers and report their progress until they are done, failed or cancelled."""
+        workers = max(1, min(self.job.connections if self.ranged else 1, len(self._segments) + (first is not None)))
+        self._running = workers
+        threads = []
+        for worker in range(workers):
+            segment, response = first if worker == 0 and first is not None else (None, None)
+            thread = threading.Thread(target=self._worker, args=(worker, segment, response),
+                                      name=f"direct-{self.job.id}-{worker + 1}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        samples = collections.deque([(time.monotonic(), self.downloaded)], maxlen=6)
+        saved = time.monotonic()
+        while not self._idle.wait(PROGRESS_EVENT_INTERVAL):
+            if self.job.cancel_event.is_set():
+                self._stop.set()
+                self._close_connections()  # unblocks workers waiting on a socket
+                break
+            now = time.monotonic()
+            samples.append((now, self.downloaded))
+            self._report("downloading", (samples[-1][1] - samples[0][1]) / (now - samples[0][0]))
+            if now - saved >= DIRECT_STATE_INTERVAL:
+                saved = now
+                self._save_state()
+        for thread in threads:
+            thread.join()
+        if self.error is None and not self._stopped() and (self._segments or self._active):
+            self.error = "Download incomplete"
+        if self.error is not None:
+            raise DirectDownloadError(self.error)
+
+    def _worker(self, worker, segment=None, response=None):
+        """Fetch segments over one keep-alive connection until none are left, retrying failed ones."""
+        try:
+            self._fetch_segments(worker, segment, response)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if not self._running:
+                    self._idle.set()
+
+    def _fetch_segments(self, worker, segment, response):
+        buffer = memoryview(bytearray(DIRECT_BUFFER_SIZE))
+        with open(self.part_path, "r+b", buffering=0) as f:
+            while not self._stopped():
+                if segment is None:
+                    segment = self._take(worker)
+                    if segment is None:
+                        return
+                start, end, attempt = segment
+                try:
+                    if response is None:
+                        response = self._request(worker, start if self.ranged else None, end if self.ranged else None)
+                        self._check(response, start, end)
+                    self._receive(worker, response, f, buffer, start, end)
+                except (OSError, http.client.HTTPException, DirectDownloadError) as e:
+                    self._drop_connection(worker)
+                    if self._stopped():
+                        return
+                    if attempt + 1 >= DIRECT_RETRIES:
+                        self._fail(f"{e} (bytes {start}-{'' if end is None else end - 1}, "
+                                   f"{DIRECT_RETRIES} attempts)")
+                        return
+                    log_ytdlp(self.job, logging.WARNING, f"⚠️ Segment at byte {start}: {e}, retrying")
+                    if self._stop.wait(DIRECT_RETRY_DELAY * 2 ** attempt):
+                        return
+                    segment, response = (self._retry_from(worker), end, attempt + 1), None
+                    continue
+                response = None
+                if self._stopped():
+                    return
+                with self._lock:
+                    del self._active[worker]
+                    self._done_segments += 1
+                segment = None
+
+    def _take(self, worker):
+        with self._lock:
+            if not self._segments:
+                return None
+            segment = self._segments.popleft()
+            self._active[worker] = [segment[0], segment[1]]
+            return segment
+
+    def _check(self, response, start, end):
+        """Make sure a segment's response holds exactly the bytes asked for."""
+        if not self.ranged:
+            if response.status != 200:
+                raise DirectDownloadError(f"HTTP {response.status} {response.reason}")
+            return
+        if response.status != 206:
+            raise DirectDownloadError(f"HTTP {response.status} {response.reason}")
+        match = CONTENT_RANGE_PATTERN.fullmatch(response.getheader("Content-Range") or "")
+        if match is None or (int(match.group(1)), int(match.group(2)) + 1) != (start, end):
+            raise DirectDownloadError(f"Asked for bytes {start}-{end - 1}, got {response.getheader('Content-Range')}")
+
+    def _receive(self, worker, response, f, buffer, start, end):
+        """Write a response body at its offset, keeping the worker's entry in _active at the next byte."""
+        f.seek(start)
+        position = start
+        while end is None or position < end:
+            if self._stopped():
+                return
+            count = response.readinto(buffer if end is None else buffer[:min(len(buffer), end - position)])
+            if not count:
+                if end is None:
+                    break
+                raise DirectDownloadError(f"Connection closed at byte {position}")
+            f.write(buffer[:count])
+            position += count
+            with self._lock:
+                self._active[worker][0] = position
+                self.downloaded += count
+            if self.rate:
+                self._throttle(count)
+        if end is None:
+            self.size = position
+
+    def _retry_from(self, worker):
+        """Where a failed segment continues: where it stopped, or at 0 for a server without Range."""
+        with self._lock:
+            position = self._active[worker][0]
+            if not self.ranged:
+                self.downloaded -= position
+                position = self._active[worker][0] = 0
+        return position
+
+    def _throttle(self, count):
+        """Sleep as needed to keep all the workers together at `rate`."""
+        with self._lock:
+            if self._throttle_start is None:
+                self._throttle_start = time.monotonic()
+            self._throttled += count
+            ahead = self._throttled / self.rate - (time.monotonic() - self._throttle_start)
+        if ahead > 0:
+            self._stop.wait(ahead)
+
+    def _fail(self, message):
+        with self._lock:
+            if self.error is None:
+                self.error = message
+        self._stop.set()
+
+    def _stopped(self):
+        return self._stop.is_set() or self.job.cancel_event.is_set()
+
+    def _drop_connection(self, worker):
+        with self._lock:
+            held = self._connections.pop(worker, None)
+        if held is not None:
+            held[2].close()
+
+    def _close_connections(self):
+        with self._lock:
+            held, self._connections = list(self._connections.values()), {}
+        for _, _, connection in held:
+            if connection.sock is not None:
+                try:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            connection.close()
+
+    def _report(self, status, speed):
+        left = self.size - self.downloaded if self.size else None
+        self.output.progress({
+            "status": status, "downloaded_bytes": self.downloaded, "total_bytes": self.size, "speed": speed,
+            "eta": int(left / speed) if speed and left is not None else None,
+            "fragment_index": self._done_segments if self.ranged else None,
+            "fragment_count": self.segment_count if self.ranged else None,
+            "playlist_index": None, "video_id": None,
+        })
+
+    def _finish(self):
+        filepath = os.path.join(self.folder, self.filename)
+        os.replace(self.part_path, filepath)
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        self._report("finished", None)
+        self.output.saved({"filepath": filepath})
+
+    def _load_state(self):
+        """The resume state an earlier run of this job left, if it still matches its .part file."""
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            part_path = os.path.join(self.folder, state["filename"] + ".part")
+            if state["url"] != self.job.url or not os.path.exists(part_path):
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return state
+
+    def _save_state(self):
+        """Record the byte ranges still missing (ranged downloads only: a plain stream starts over)."""
+        if not self.ranged or self.filename is None:
+            return
+        with self._lock:
+            remaining = [(a, b) for a, b in self._active.values() if a < b] + [(a, b) for a, b, _ in self._segments]
+            done_segments = self._done_segments
+        state = {"url": self.job.url, "filename": self.filename, "size": self.size, "validator": self.validator,
+                 "remaining": sorted(remaining), "done_segments": done_segments}
+        try:
+            with open(self.state_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(self.state_path + ".tmp", self.state_path)
+        except OSError as e:
+            print(f"[Direct] ⚠️ Could not save resume state of job {self.job.id}: {e}")
+
+
+def run_direct(job):
+    """Run a direct job's download in place of yt-dlp. Returns (returncode, saw_network_error) like run_ytdlp()."""
+    rate = bandwidth.acquire(job.id, job.rate_limit, pinned=True)
+    download = DirectDownload(job, JobOutput(job), rate)
+    try:
+        ok = download.run()
+    finally:
+        bandwidth.release(job.id)
+        disk_space.release(job.id)
+    if not ok and not job.cancel_event.is_set():
+        log_ytdlp(job, logging.ERROR, f"❌ {download.error}")
+        jobs.update(job, error=download.error)
+    return (0 if ok else 1), False
+
+
+def run_download_job(job):
+    """Run a job's yt-dlp command (or its direct download) and retry failed playlist items on network errors."""
+    jobs.update(job, status="downloading", started=time.time(), finished=None, error=None)
+    try:
+        failed_ids = {}
+        if job.direct is not None:
+            returncode, _ = run_direct(job)
+        else:
+            returncode, _ = run_ytdlp(job, job.cmd, failed_ids)
+
+        if job.cancel_event.is_set():
+            print(f"[Download] ⛔ Job {job.id} cancelled")
+            postprocessing.finish(job, "cancelled")  # files saved before the cancel are published first
+            return
+
+        if returncode == 0:
+            print(f"[Download] ✅ Job {job.id} completed successfully!")
+        else:
+            print(f"[Download] ❌ Job {job.id} failed (code: {returncode})")
+
+        if failed_ids and (job.is_playlist or len(job.urls) > 1):
+            # The retries go through the scheduler, so this job's slot is freed meanwhile
+            print(f"\n[Retry] {len(failed_ids)} video(s) failed due to network errors: {list(failed_ids)}")
+            jobs.update(job, status="retrying", retries=RetryBatch(job, failed_ids))
+            job.retries.start()
+        elif returncode == 0:
+            postprocessing.finish(job, "completed")
+        else:
+            postprocessing.finish(job, "failed", job.error or f"yt-dlp exited with code {returncode}")
+
+    except Exception as e:
+        print(f"[Download] ❌ Error: {e}")
+        jobs.update(job, status="failed", finished=time.time(), error=str(e), process=None)
+
+
+class PostProcessOutput:
+    """Output of a post-processing run: only the final file path matters."""
+
+    def __init__(self, job):
+        self.job = job
+        self.filepath = None
+
+    def line(self, line):
+        done = parse_event_line(line, FILE_PREFIX)
+        if done is not None:
+            self.saved(done)
+        elif line.strip():
+            log_ytdlp(self.job, logging.INFO, line.strip())
+
+    def saved(self, done):
+        self.filepath = done.get("filepath")
+
+
+class PostProcessingQueue:
+    """CPU-bound stage: runs yt-dlp's post-processors over downloaded files, off the download slots.
+
+    The download stage hands over each file as soon as yt-dlp has saved it,
+    so a playlist's first videos are converted while the next ones are
+    still downloading, and a job gives its download slot back as soon as
+    the bytes are on disk. A job whose download finished while files are
+    still being processed shows as "processing"; it gets its final status
+    from finish() once its last file is done.
+
+    When the yt_dlp module is importable the runs happen in a YtdlpPool of
+    their own, so each file doesn't pay for a yt-dlp start-up.
+    """
+
+    def __init__(self, workers=POSTPROCESS_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._run_ids = itertools.count(1)
+        self._pending = collections.Counter()  # job id -> files queued or running
+        self._failures = collections.Counter()
+        self._final = {}  # job id -> (status, error) waiting for the last file
+        self.ready = threading.Event()  # set once the workers are running
+
+    def start(self):
+        """Start the workers in the background; files queued meanwhile wait for them."""
+        if SEPARATE_POSTPROCESSING:
+            threading.Thread(target=self._start_workers, name="postprocess-start", daemon=True).start()
+
+    def _start_workers(self):
+        if importlib.util.find_spec("yt_dlp") is not None:
+            self._pool = YtdlpPool(self.workers).start()
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"postprocess-worker-{i + 1}", daemon=True).start()
+        self.ready.set()
+
+    def submit(self, job, filepath):
+        with self._lock:
+            self._pending[job.id] += 1
+        self._queue.put((job, filepath))
+
+    def finish(self, job, status, error=None):
+        """Set the job's final status now, or once its queued files are processed.
+
+        Until then the job's staging folder must stay: a finished job's
+        folder is removed as soon as it gets its final status.
+        """
+        with self._lock:
+            if self._pending[job.id]:
+                self._final[job.id] = (status, error)
+                waiting = self._pending[job.id]
+            else:
+                self._pending.pop(job.id, None)
+                waiting = 0
+        if waiting:
+            print(f"[PostProcess] Job {job.id} downloaded, {waiting} file(s) still processing")
+            jobs.update(job, status="processing")
+            return
+        self._apply(job, status, error, self._failures.pop(job.id, 0))
+
+    def counts(self):
+        with self._lock:
+            return {"queued": self._queue.qsize(), "files": sum(self._pending.values())}
+
+    def _apply(self, job, status, error, failures):
+        if job.cancel_event.is_set():
+            status, error = "cancelled", None
+        elif failures and status == "completed":
+            status, error = "failed", f"{failures} file(s) could not be post-processed"
+        jobs.update(job, status=status, error=error, finished=time.time())
+
+    def _worker(self):
+        while True:
+            job, filepath = self._queue.get()
+            try:
+                if job.cancel_event.is_set():
+                    self._publish(job, filepath)  # downloaded before the cancel: kept as it is
+                    ok = True
+                else:
+                    ok = self._process(job, filepath)
+            except Exception as e:
+                print(f"[PostProcess] ❌ Error: {e}")
+                ok = False
+            with self._lock:
+                if not ok:
+                    self._failures[job.id] += 1
+                self._pending[job.id] -= 1
+                final = None
+                if self._pending[job.id] <= 0:
+                    del self._pending[job.id]
+                    final = self._final.pop(job.id, None)
+                    failures = self._failures.pop(job.id, 0) if final else 0
+            if final is not None:
+                self._apply(job, final[0], final[1], failures)
+
+    def _process(self, job, filepath):
+        ytdlp_cmd = get_ytdlp_cmd()
+        if not ytdlp_cmd:
+            return False
+        print(f"[PostProcess] ⚙️ {os.path.basename(filepath)}")
+        cmd = build_postprocess_command(ytdlp_cmd, job, filepath)
+        output = PostProcessOutput(job)
+        started = time.monotonic()
+        if self._pool is not None:
+            returncode = self._pool.run(f"{job.id}:pp-{next(self._run_ids)}", _pool_postprocess,
+                                        ytdlp_args(cmd), output)
+        else:
+            process = start_ytdlp_process(cmd)
+            for line in process.stdout:
+                output.line(line)
+            returncode = process.wait()
+        metrics.stage.observe(time.monotonic() - started, "postprocess")
+        try:
+            os.remove(info_json_path(filepath))
+        except OSError:
+            pass
+        if returncode != 0:
+            print(f"[PostProcess] ❌ {os.path.basename(filepath)} (code: {returncode})")
+        # Published even when processing failed: the download itself is fine
+        self._publish(job, output.filepath or filepath)
+        return returncode == 0
+
+    def _publish(self, job, filepath):
+        published = staging.publish(job, filepath)
+        if published != filepath and jobs.journal is not None:
+            jobs.journal.record_file(job, None, published)
+        jobs.update(job, filepath=published)
+
+
+postprocessing = PostProcessingQueue()
+
+
+def retry_delay(attempt):
+    """Exponential backoff with jitter: about FAILED_ITEM_RETRY_DELAY, then twice that, ..."""
+    delay = min(MAX_RETRY_DELAY, FAILED_ITEM_RETRY_DELAY * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RetryItem:
+    """One yt-dlp run retrying some of a job's failed videos, run by the scheduler."""
+
+    def __init__(self, batch, video_ids, attempt):
+        self.batch = batch
+        self.job = batch.job
+        self.id = f"{self.job.id}:retry-{next(batch.run_ids)}"
+        self.video_ids = video_ids
+        self.attempt = attempt
+        self.priority = self.job.priority
+        self.host = self.job.host
+        self.connections = self.job.connections
+        self.process = None
+
+
+class RetryBatch:
+    """The failed items of one playlist job, retried through the scheduler.
+
+    The waiting videos are split over up to MAX_PARALLEL_RETRIES yt-dlp runs
+    at a time, each after its own backoff delay, sharing the global and
+    per-host download caps with everything else. A run re-invokes the
+    original playlist URL with --playlist-items, so files keep their
+    playlist folder and index; videos whose index is unknown are passed as
+    watch URLs instead. Videos that don't reach their final path are
+    retried up to MAX_RETRY_ROUNDS times. `failures` maps the failed video
+    ids to the kind of network error that failed them.
+
+    While the network monitor reports the connection as down, videos are
+    held back instead of burning attempts; after MAX_NETWORK_WAIT seconds
+    offline they are given up. When the last video settles, the job gets
+    its final status.
+    """
+
+    def __init__(self, job, failures, max_parallel=MAX_PARALLEL_RETRIES):
+        self.job = job
+        self.max_parallel = max_parallel
+        indexed = set(job.playlist_entries.values()) if job.is_playlist else set()
+        # A video with neither a known index nor a URL to ask for can't be retried
+        self.failed = [video_id for video_id in failures if video_id not in indexed and not video_url(job, video_id)]
+        if self.failed:
+            print(f"[Retry] ⚠️ No URL known for {self.failed}, not retrying them")
+        self.run_ids = itertools.count(1)
+        self._attempts = {video_id: 0 for video_id in failures}
+        self._reasons = dict(failures)
+        self._waiting = [video_id for video_id in failures if video_id not in self.failed]
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def start(self):
+        network.subscribe(self._on_network)
+        self._fill()
+
+    def item_finished(self, item, saved_ids, network_error=False, failures=None):
+        """Record which of the run's videos made it and queue the rest for another attempt."""
+        with self._lock:
+            self._in_flight.pop(item.id, None)
+            for video_id in item.video_ids:
+                self._attempts[video_id] = item.attempt
+                self._reasons[video_id] = (failures or {}).get(video_id, "not_saved")
+                if video_id in saved_ids:
+                    print(f"[Retry] ✅ {video_id} downloaded successfully!")
+                elif self.job.cancel_event.is_set() or item.attempt >= MAX_RETRY_ROUNDS:
+                    print(f"[Retry] ❌ {video_id} still failed")
+                    self.failed.append(video_id)
+                else:
+                    print(f"[Retry] ❌ {video_id} failed (attempt {item.attempt}/{MAX_RETRY_ROUNDS})")
+                    self._waiting.append(video_id)
+        if network_error:
+            network.report_failure()
+        self._fill()
+
+    def hold(self, item):
+        """Put back a run that came up while the network was down, without counting the attempt."""
+        with self._lock:
+            self._in_flight.pop(item.id, None)
+            self._waiting[:0] = item.video_ids
+        self._fill()
+
+    def cancel(self):
+        """Drop waiting videos and stop the queued and running retries."""
+        with self._lock:
+            self.failed.extend(self._waiting)
+            self._waiting = []
+            for item in list(self._in_flight.values()):
+                if scheduler.cancel_pending(item.id):
+                    del self._in_flight[item.id]
+                    self.failed.extend(item.video_ids)
+                else:
+                    stop_runs(item)
+        self._fill()
+
+    def _on_network(self, monitor):
+        if monitor.online:
+            self._fill()
+            return
+        if monitor.offline_for() < MAX_NETWORK_WAIT:
+            return
+        with self._lock:
+            if self._waiting:
+                print(f"[Retry] ❌ Giving up on {len(self._waiting)} video(s) - no internet")
+            self.failed.extend(self._waiting)
+            self._waiting = []
+        self._fill()
+
+    def _split_waiting(self, runs):
+        """Divide the waiting videos into at most `runs` groups; known and unknown indexes never mix."""
+        indexed = set(self.job.playlist_entries.values())
+        groups = []
+        for known in (True, False):
+            ids = [v for v in self._waiting if (v in indexed) == known]
+            if ids:
+                size = -(-len(self._waiting) // runs)
+                groups += [ids[i:i + size] for i in range(0, len(ids), size)]
+        self._waiting = []
+        return groups
+
+    def _fill(self):
+        submit = []
+        with self._lock:
+            if self._finished:
+                return
+            free = self.max_parallel - len(self._in_flight)
+            if self._waiting and free > 0 and network.online:
+                groups = self._split_waiting(free)
+                for group in groups[free:]:
+                    self._waiting += group
+                for group in groups[:free]:
+                    attempt = max(self._attempts[v] for v in group) + 1
+                    item = RetryItem(self, group, attempt)
+                    self._in_flight[item.id] = item
+                    submit.append(item)
+            done = not self._waiting and not self._in_flight
+            self._finished = done
+        for item in submit:
+            for video_id in item.video_ids:
+                metrics.retries.inc(self._reasons[video_id])
+            scheduler.submit(item, delay=retry_delay(item.attempt), runner=run_retry_item)
+        if done:
+            self._finish()
+
+    def _finish(self):
+        network.unsubscribe(self._on_network)
+        job = self.job
+        if job.cancel_event.is_set():
+            postprocessing.finish(job, "cancelled")
+        elif self.failed:
+            print(f"\n[Retry] ❌ {len(self.failed)} video(s) could not be downloaded after all retries:")
+            for vid_id in self.failed:
+                print(f"  - {video_url(job, vid_id) or vid_id}")
+            postprocessing.finish(job, "failed", f"{len(self.failed)} video(s) could not be downloaded")
+        else:
+            print("\n[Retry] ✅ All failed videos recovered successfully!")
+            postprocessing.finish(job, "completed")
+
+
+def video_url(job, video_id):
+    """The URL to retry one of a job's videos with, or None if it can't be told.
+
+    That is the URL yt-dlp reported for it, else the URL of a batch group
+    with the id in it (errors during extraction come before the report),
+    else a watch URL for YouTube, whose ids are all the URL needs.
+    """
+    if video_id in job.video_urls:
+        return job.video_urls[video_id]
+    if not job.is_playlist:
+        token = re.compile(rf"(?<![\w-]){re.escape(video_id)}(?![\w-])")
+        url = next((url for url in job.urls if token.search(url)), None)
+        if url:
+            return url
+    if job.host == "youtube.com":
+        return f"https://www.youtube.com/watch?v={video_id}"
+    return None
+
+
+def build_batch_retry_command(ytdlp_cmd, job, video_ids):
+    """One yt-dlp command retrying these videos of a job, in their playlist context when possible."""
+    urls = [video_url(job, video_id) for video_id in video_ids]
+    directory = staging.job_dir(job)
+    if not job.is_playlist:
+        return build_download_command(ytdlp_cmd, urls, job.quality, False, "", job.use_archive, job.profile,
+                                      directory)
+    index_of = {video_id: index for index, video_id in job.playlist_entries.items()}
+    if all(video_id in index_of for video_id in video_ids):
+        items = ",".join(str(index) for index in sorted(index_of[v] for v in video_ids))
+        return build_download_command(ytdlp_cmd, job.url, job.quality, True, items, job.use_archive, job.profile,
+                                      directory)
+    return build_retry_command(ytdlp_cmd, urls, job.quality, job.profile, directory)
+
+
+def run_retry_item(item):
+    """Scheduler runner for a RetryItem: one yt-dlp run over its failed videos."""
+    job = item.job
+    saved_ids = set()
+    failures = {}
+    if job.cancel_event.is_set():
+        item.batch.item_finished(item, saved_ids)
+        return
+    if not network.online:
+        item.batch.hold(item)
+        return
+    network_error = False
+    try:
+        print(f"\n[Retry] Retrying {len(item.video_ids)} video(s) (attempt {item.attempt}/{MAX_RETRY_ROUNDS}): "
+              f"{item.video_ids}")
+        retry_cmd = build_batch_retry_command(get_ytdlp_cmd(), job, item.video_ids)
+        _, network_error = run_ytdlp(job, retry_cmd, failures, owner=item, saved_ids=saved_ids)
+    except Exception as e:
+        print(f"[Retry] ❌ Error: {e}")
+    finally:
+        item.batch.item_finished(item, saved_ids, network_error, failures)
+
+
+def host_key(url):
+    """Reduce a URL to the site key used for per-host concurrency limits."""
+    host = (urlparse(url).hostname or "").lower()
+    for alias, key in HOST_ALIASES.items():
+        if host == alias or host.endswith("." + alias):
+            return key
+    parts = host.split(".")
+    return ".".join(parts[-2:]) if len(parts) >= 2 else host
+
+
+class DownloadJob:
+    """A queued yt-dlp download with a stable id and its live state.
+
+    State fields are written through JobRegistry.update() so every change
+    publishes a fresh read-only view for the dashboard.
+    """
+
+    def __init__(self, url, quality, is_playlist, playlist_items, cmd,
+                 priority=PRIORITY_LEVELS["normal"], title="", profile=None, urls=None, direct=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.urls = list(urls) if urls else [url]  # more than one for a /download/batch group
+        self.quality = quality
+        self.is_playlist = is_playlist
+        self.playlist_items = playlist_items
+        self.cmd = cmd
+        self.priority = priority
+        self.profile = profile or select_profile(quality, url)
+        self.direct = direct  # {"filename", "headers"} of a media URL fetched without yt-dlp (DirectDownload)
+        self.connections = DIRECT_CONNECTIONS if direct is not None else profile_connections(self.profile)
+        self.title = title or url
+        self.host = host_key(url)
+        self.created = time.time()
+        self.restarts = 0
+        self.playlist_entries = {}  # playlist index -> video id, when known
+        self.video_urls = {}  # video id -> URL it was downloaded from, when known
+        self.use_archive = True  # False when the client forced a re-download
+        self.rate_limit = None  # bytes/s requested for this job, instead of an equal share
+        self.view = None
+        self.reset()
+
+    def reset(self):
+        """Clear run state so the job can be (re)queued."""
+        self.cancel_event = threading.Event()
+        self.process = None
+        self.retries = None  # RetryBatch while failed playlist items are being retried
+        self.status = "pending"
+        self.progress = ""
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.downloaded_bytes = None
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.fragment_index = None
+        self.fragment_count = None
+        self.playlist_index = None
+        self.playlist_count = None
+        self.current_title = None
+        self.filepath = None
+        self.files_completed = 0
+        self.worker = None  # URL of the cluster worker running it (coordinator only)
+
+    def to_dict(self):
+        """Serializable view of the job as rendered by dashboard.js."""
+        return {
+            "id": self.id,
+            "url": self.url,
+            "urls": self.urls,
+            "title": self.title,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "quality": self.quality,
+            "is_playlist": self.is_playlist,
+            "playlist_items": self.playlist_items,
+            "host": self.host,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.created)),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "downloaded_bytes": self.downloaded_bytes,
+            "total_bytes": self.total_bytes,
+            "speed": self.speed,
+            "eta": self.eta,
+            "fragment_index": self.fragment_index,
+            "fragment_count": self.fragment_count,
+            "playlist_index": self.playlist_index,
+            "playlist_count": self.playlist_count,
+            "current_title": self.current_title,
+            "filepath": self.filepath,
+            "files_completed": self.files_completed,
+            "restarts": self.restarts,
+            "rate_limit": self.rate_limit,
+            "profile": self.profile,
+            "direct": self.direct is not None,
+            "worker": self.worker,
+        }
+
+
+class JobRegistry:
+    """All known jobs by id, with a versioned copy-on-write snapshot and a delta feed.
+
+    Writers replace a job's view dict and bump the version; readers build
+    (or reuse) the snapshot from those immutable views without taking the
+    lock, so dashboard polls never block the worker threads.
+
+    Changes are also appended to a bounded event log that /events and
+    /downloads?since= stream from. Status changes are emitted immediately;
+    progress ticks only mark the job dirty and are flushed as one coalesced
+    "progress" event every PROGRESS_EVENT_INTERVAL seconds.
+    """
+
+    def __init__(self, max_finished=MAX_FINISHED_JOBS, progress_interval=PROGRESS_EVENT_INTERVAL,
+                 history=EVENT_HISTORY):
+        self.max_finished = max_finished
+        self.progress_interval = progress_interval
+        self._jobs = {}
+        self._lock = threading.Lock()  # guards membership only
+        self._versions = itertools.count(1)
+        self.version = 0
+        self._snapshot = (0, [])
+        self._events = collections.deque(maxlen=history)
+        self._events_cond = threading.Condition()
+        self._event_version = 0
+        self._horizon = 0  # events newer than this are all still in the log
+        self._dirty = {}
+        self._dirty_lock = threading.Lock()
+        self._dirty_event = threading.Event()
+        self.journal = None  # JobJournal that records every add/update, if any
+        self.instance = uuid.uuid4().hex[:8]  # in ETags, so versions of an earlier run never match
+
+    def start(self):
+        """Start the progress coalescing thread."""
+        threading.Thread(target=self._flush_progress, name="progress-events", daemon=True).start()
+
+    def add(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            removed = self._prune()
+        self._added(job, removed)
+
+    def _added(self, job, removed):
+        job.view = job.to_dict()
+        self.version = next(self._versions)
+        self._emit("added", jobs=[job.view])
+        if self.journal is not None:
+            self.journal.record(job)
+        if removed:
+            self._emit("removed", ids=removed)
+            if self.journal is not None:
+                self.journal.forget(removed)
+            if job_logs is not None:
+                job_logs.forget(removed)
+            staging.discard(removed)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def add_unless_running(self, job):
+        """Add the job unless an unfinished one downloads the same thing. Returns the job that will run."""
+        keys = job_dedup_keys(job)
+        with self._lock:
+            for other in self._jobs.values():
+                if other.status not in FINISHED_STATUSES and not keys.isdisjoint(job_dedup_keys(other)):
+                    return other
+            self._jobs[job.id] = job
+            removed = self._prune()
+        self._added(job, removed)
+        return job
+
+    def running_by_key(self):
+        """Unfinished jobs by dedup key, to check many requests against them in one pass."""
+        running = {}
+        for job in list(self._jobs.values()):
+            if job.status not in FINISHED_STATUSES:
+                for key in job_dedup_keys(job):
+                    running.setdefault(key, job)
+        return running
+
+    def update(self, job, **fields):
+        """Set job attributes and publish a new view (and an event if the view changed)."""
+        if fields.get("status") in FINISHED_STATUSES and job.status not in FINISHED_STATUSES:
+            metrics.jobs_finished.inc(fields["status"])
+            if fields["status"] != "failed":  # a failed job's partial files are resumed by a restart
+                staging.discard([job.id])
+        for name, value in fields.items():
+            setattr(job, name, value)
+        view = job.to_dict()
+        if view == job.view:
+            return
+        job.view = view
+        self.version = next(self._versions)
+        with self._dirty_lock:
+            self._dirty.pop(job.id, None)  # this event already carries the latest progress
+        self._emit("updated", jobs=[view])
+        if self.journal is not None:
+            self.journal.record(job)
+
+    def update_progress(self, job, progress):
+        """Apply a parsed progress line and refresh the dashboard progress text."""
+        job.downloaded_bytes = progress["downloaded_bytes"]
+        job.total_bytes = progress["total_bytes"]
+        job.speed = progress["speed"]
+        job.eta = progress["eta"]
+        job.fragment_index = progress["fragment_index"]
+        job.fragment_count = progress["fragment_count"]
+        if progress["playlist_index"] is not None:
+            job.playlist_index = progress["playlist_index"]
+        job.progress = format_progress(job)
+        job.view = job.to_dict()
+        self.version = next(self._versions)
+        with self._dirty_lock:
+            self._dirty[job.id] = job
+        self._dirty_event.set()
+
+    def snapshot(self):
+        """Return (version, [job views]) newest first, rebuilt only when something changed."""
+        cached = self._snapshot
+        version = self.version
+        if cached[0] == version:
+            return cached
+        views = [job.view for job in list(self._jobs.values())]
+        views.sort(key=lambda v: v["created"], reverse=True)
+        cached = (version, views)
+        self._snapshot = cached
+        return cached
+
+    def wait_for_events(self, since, timeout):
+        """Block until there are events newer than `since` or the timeout passes.
+
+        Returns (version, events), where events may be empty on timeout, or
+        (version, None) if `since` is older than the log, or newer than this
+        run has reached (it came from an earlier run), and the caller must
+        resync from snapshot().
+        """
+        with self._events_cond:
+            if since > self.version:
+                return self.version, None
+            self._events_cond.wait_for(lambda: self._event_version > since, timeout)
+            if since < self._horizon:
+                return self.version, None
+            events = [event for event in self._events if event["version"] > since]
+            return max(self.version, self._event_version), events
+
+    def _emit(self, kind, **payload):
+        with self._events_cond:
+            version = self.version = next(self._versions)
+            payload["type"] = kind
+            payload["version"] = version
+            if len(self._events) == self._events.maxlen:
+                self._horizon = self._events[0]["version"]
+            self._events.append(payload)
+            self._event_version = version
+            self._events_cond.notify_all()
+
+    def _flush_progress(self):
+        while True:
+            self._dirty_event.wait()
+            time.sleep(self.progress_interval)
+            with self._dirty_lock:
+                self._dirty_event.clear()
+                dirty, self._dirty = self._dirty, {}
+            views = [job.view for job in dirty.values()]
+            if views:
+                self._emit("progress", jobs=views)
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.status in FINISHED_STATUSES]
+        excess = len(finished) - self.max_finished
+        if excess <= 0:
+            return []
+        finished.sort(key=lambda j: j.finished or j.created)
+        for job in finished[:excess]:
+            del self._jobs[job.id]
+        return [job.id for job in finished[:excess]]
+
+
+class JobJournal:
+    """Durable record of jobs in SQLite (WAL mode), so queued and interrupted jobs survive a restart.
+
+    record() and record_file() only remember the latest state in memory; a
+    writer thread commits everything that changed in one transaction every
+    JOURNAL_FLUSH_INTERVAL seconds. Progress ticks are never journaled, so
+    the number of commits doesn't grow with the number of running jobs.
+    """
+
+    COLUMNS = ("id", "url", "quality", "is_playlist", "playlist_items", "priority", "title", "status",
+               "error", "created", "started", "finished", "restarts", "files_completed", "filepath", "urls",
+               "direct", "profile", "rate_limit", "use_archive")
+
+    def __init__(self, path=JOB_JOURNAL_FILE, flush_interval=JOURNAL_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._db = None
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._files = []
+        self._forgotten = []
+        self._wake = threading.Event()
+
+    def open(self):
+        """Open (or create) the database. Returns self, or None if journaling is off or unavailable."""
+        if not self.path:
+            return None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; only the last batch can be lost
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS jobs ({', '.join(self.COLUMNS)}, PRIMARY KEY (id))")
+            existing = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            for name in self.COLUMNS:
+                if name not in existing:  # journal written by an older version
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {name}")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files (job_id, video_id, filepath, PRIMARY KEY (job_id, filepath))")
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"[Journal] ⚠️ Job journal disabled: {e}")
+            return None
+        return self
+
+    def start(self):
+        threading.Thread(target=self._run, name="job-journal", daemon=True).start()
+
+    def load(self):
+        """Return the stored jobs (oldest first) as dicts of COLUMNS."""
+        cursor = self._db.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs ORDER BY created")
+        return [dict(zip(self.COLUMNS, row)) for row in cursor]
+
+    def record(self, job):
+        view = dict(job.view, priority=job.priority, urls=json.dumps(job.urls) if len(job.urls) > 1 else None,
+                    direct=json.dumps(job.direct) if job.direct is not None else None,
+                    profile=job.profile, rate_limit=job.rate_limit, use_archive=int(job.use_archive))
+        row = tuple(view[name] for name in self.COLUMNS)
+        with self._lock:
+            self._rows[job.id] = row
+        self._wake.set()
+
+    def record_file(self, job, video_id, filepath):
+        if not filepath:
+            return
+        with self._lock:
+            self._files.append((job.id, video_id, filepath))
+        self._wake.set()
+
+    def files(self):
+        """(job id, path) of every file the journaled jobs saved."""
+        return self._db.execute("SELECT job_id, filepath FROM files").fetchall()
+
+    def forget(self, job_ids):
+        with self._lock:
+            self._forgotten.extend(job_ids)
+        self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = list(self._rows.values()), {}
+            files, self._files = self._files, []
+            forgotten, self._forgotten = [(job_id,) for job_id in self._forgotten], []
+        if not (rows or files or forgotten):
+            return
+        placeholders = ", ".join("?" for _ in self.COLUMNS)
+        try:
+            with self._db:
+                self._db.executemany(f"INSERT OR REPLACE INTO jobs VALUES ({placeholders})", rows)
+                self._db.executemany("INSERT OR IGNORE INTO files VALUES (?, ?, ?)", files)
+                self._db.executemany("DELETE FROM jobs WHERE id = ?", forgotten)
+                self._db.executemany("DELETE FROM files WHERE job_id = ?", forgotten)
+        except sqlite3.Error as e:
+            print(f"[Journal] ⚠️ Could not write job journal: {e}")
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+def apply_cached_metadata(job):
+    """Fill in title, item count and the index -> video id map from the metadata cache."""
+    cached = metadata_cache.get(canonical_url(job.url, job.is_playlist))
+    if cached is None:
+        return
+    if not job.is_playlist:
+        if job.title == job.url and cached.get("title"):
+            job.title = cached["title"]
+        return
+    entries = cached.get("entries")
+    if entries is None:
+        return
+    indexes = parse_playlist_items(job.playlist_items, len(entries)) if job.playlist_items else None
+    selected = entries if indexes is None else [entries[i - 1] for i in indexes]
+    if job.title == job.url and cached.get("playlist_title"):
+        job.title = cached["playlist_title"]
+    job.playlist_count = len(selected)
+    job.playlist_entries = {entry["index"]: entry["id"] for entry in selected}
+
+
+def cancel_job(job):
+    """Cancel a pending or running job. Returns an error message, or None on success."""
+    if job.status in FINISHED_STATUSES:
+        return f"Job is already {job.status}"
+    job.cancel_event.set()
+    if scheduler.cancel_pending(job.id):
+        jobs.update(job, status="cancelled", finished=time.time())
+    elif job.retries is not None:
+        job.retries.cancel()
+    else:
+        stop_runs(job)
+    print(f"[Download] ⛔ Cancel requested for job {job.id}")
+    return None
+
+
+def restart_job(job):
+    """Requeue a finished job with the same arguments. Returns an error message, or None on success."""
+    if job.status not in FINISHED_STATUSES or scheduler.is_active(job.id):
+        return f"Job is still {job.status}"
+    ytdlp_cmd = job_ytdlp_cmd()
+    if not ytdlp_cmd and job.direct is None:
+        return "yt-dlp not found! Install it with: pip install yt-dlp"
+    job.reset()
+    jobs.update(job, cmd=build_job_command(ytdlp_cmd, job), restarts=job.restarts + 1)
+    scheduler.submit(job)
+    print(f"[Download] 🔁 Restarted job {job.id}")
+    return None
+
+
+def restore_jobs(journal):
+    """Re-register journaled jobs; ones that were queued or running when the server stopped are requeued.
+
+    Requeued downloads pick up their .part files (--continue) and skip
+    playlist items that were already saved.
+    """
+    ytdlp_cmd = job_ytdlp_cmd()
+    resumed = 0
+    for row in journal.load():
+        job = DownloadJob(row["url"], row["quality"], bool(row["is_playlist"]), row["playlist_items"], None,
+                          priority=row["priority"], title=row["title"],
+                          profile=row["profile"] if row["profile"] in DOWNLOAD_PROFILES else None,
+                          urls=json.loads(row["urls"]) if row["urls"] else None,
+                          direct=json.loads(row["direct"]) if row["direct"] else None)
+        job.id = row["id"]
+        job.created = row["created"]
+        job.rate_limit = row["rate_limit"]
+        job.use_archive = row["use_archive"] != 0  # NULL in journals of older versions
+        job.restarts = row["restarts"]
+        job.files_completed = row["files_completed"]
+        job.filepath = row["filepath"]
+        if row["status"] in FINISHED_STATUSES or not (ytdlp_cmd or job.direct is not None):
+            job.status = row["status"] if row["status"] in FINISHED_STATUSES else "failed"
+            job.error = row["error"] if row["status"] in FINISHED_STATUSES else "Interrupted by server restart"
+            job.started = row["started"]
+            job.finished = row["finished"] or row["created"]
+            jobs.add(job)
+            continue
+        job.cmd = build_job_command(ytdlp_cmd, job)
+        apply_cached_metadata(job)
+        jobs.add(job)
+        scheduler.submit(job)
+        resumed += 1
+    if resumed:
+        print(f"[Journal] 🔁 Resuming {resumed} interrupted job(s)")
+    recover_staged_files(journal)
+
+
+def recover_staged_files(journal):
+    """Publish files the last run saved into a staging folder but stopped before moving into DOWNLOAD_DIR.
+
+    Those of a resumed job go through post-processing first, if it still has to happen.
+    """
+    if not staging.directory:
+        return
+    for job_id, filepath in journal.files():
+        job = jobs.get(job_id)
+        if job is None or not filepath.startswith(staging.job_dir(job) + os.sep) or not os.path.exists(filepath):
+            continue
+        if (job.status not in FINISHED_STATUSES and SEPARATE_POSTPROCESSING and job.direct is None
+                and get_postprocess_args(job.quality)):
+            postprocessing.submit(job, filepath)
+        else:
+            print(f"[Staging] Recovered {filepath}")
+            journal.record_file(job, None, staging.publish(job, filepath))
+
+
+def parse_rate(value):
+    """Bytes/s from a number or a yt-dlp style rate like "500K" or "2.5M"."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        rate = float(value)
+    else:
+        match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?)i?B?(?:/s)?\s*", str(value), re.IGNORECASE)
+        if not match:
+            raise ValueError(f"Invalid rate: {value}")
+        rate = float(match.group(1)) * 1024 ** " KMG".index(match.group(2).upper() or " ")
+    if rate <= 0:
+        raise ValueError(f"Invalid rate: {value}")
+    return int(rate)
+
+
+def parse_download_request(body):
+    """Validated arguments of a /download request or /download/batch entry. Raises ValueError."""
+    if not isinstance(body, dict):
+        raise ValueError("Expected a JSON object")
+    url = str(body.get("url") or "").strip()
+    if not url:
+        raise ValueError("URL is required")
+    priority = body.get("priority", "normal")
+    if not isinstance(priority, str) or priority not in PRIORITY_LEVELS:
+        raise ValueError(f"Unknown priority: {priority}")
+    rate_limit = body.get("rate_limit")
+    if rate_limit is not None:
+        rate_limit = parse_rate(rate_limit)
+    profile = body.get("profile")
+    if profile is not None and (not isinstance(profile, str) or profile not in DOWNLOAD_PROFILES):
+        raise ValueError(f"Unknown profile: {profile}")
+    quality = body.get("quality", "best")
+    if not isinstance(quality, str):
+        raise ValueError("quality must be a string")
+    direct = None
+    if body.get("direct"):
+        if urlparse(url).scheme not in ("http", "https"):
+            raise ValueError("A direct download needs an http(s) URL")
+        headers = body.get("headers") or {}
+        if not isinstance(headers, dict) or any(re.search(r"[\r\n]", f"{name}{value}")
+                                                for name, value in headers.items()):
+            raise ValueError("headers must be an object of single-line strings")
+        direct = {"filename": str(body.get("filename") or ""),
+                  "headers": {str(name): str(value) for name, value in headers.items()}}
+    return {
+        "url": url,
+        "quality": quality,
+        "is_playlist": bool(body.get("playlist", False)),
+        "playlist_items": str(body.get("playlist_items") or ""),
+        "priority": PRIORITY_LEVELS[priority],
+        "rate_limit": rate_limit,
+        "profile": select_profile(quality, url, profile),
+        "force": bool(body.get("force", False)),
+        "title": str(body.get("title") or ""),
+        "direct": direct,
+    }
+
+
+def new_download_job(request, urls=None, title=None):
+    """A DownloadJob for parsed request arguments (without its command yet).
+
+    `urls` makes it a /download/batch group downloading all of them in one run.
+    """
+    urls = urls or [request["url"]]
+    job = DownloadJob(urls[0], request["quality"], request["is_playlist"], request["playlist_items"], None,
+                      request["priority"], request["title"] if title is None else title, request["profile"], urls,
+                      request["direct"])
+    job.use_archive = not request["force"]
+    job.rate_limit = request["rate_limit"]
+    return job
+
+
+def group_batch(entries):
+    """Split the single-video jobs of a batch into groups that one yt-dlp run can download.
+
+    Videos share a run when everything that ends up on the command line (or
+    in the scheduler) matches. Each group is cut into runs of at most
+    BATCH_GROUP_SIZE, and into at least as many runs as the site allows in
+    parallel, so a big batch still uses every download slot.
+    """
+    groups = {}
+    for job in entries:
+        key = (job.quality, job.profile, job.use_archive, job.priority, job.rate_limit, job.host)
+        groups.setdefault(key, []).append(job)
+    for group in groups.values():
+        runs = max(-(-len(group) // BATCH_GROUP_SIZE), min(len(group), scheduler.host_limit(group[0].host)))
+        size = -(-len(group) // runs)
+        for start in range(0, len(group), size):
+            yield group[start:start + size]
+
+
+class BandwidthManager:
+    """Divides the global bandwidth budget between the yt-dlp runs in progress.
+
+    Runs with a per-job rate keep it (within the budget); the rest of the
+    budget is split evenly over the others and re-split whenever a run
+    starts or finishes, or BANDWIDTH_SCHEDULE switches to another budget.
+    Pool runs pick up their new share while downloading. A subprocess (or
+    a direct download) is pinned: it gets its rate when it starts and keeps
+    it, so what the pinned runs hold is taken off the budget first, and a
+    new pinned run gets at most budget / MAX_CONCURRENT_DOWNLOADS of what
+    is left. The total stays within the budget, except by the MIN_RUN_RATE
+    floors of runs that found it used up, or while a lowered scheduled
+    budget waits for pinned runs to finish.
+    """
+
+    def __init__(self, limit=BANDWIDTH_LIMIT, schedule=None, min_rate=MIN_RUN_RATE):
+        self.limit = limit
+        self.schedule = list(BANDWIDTH_SCHEDULE if schedule is None else schedule)
+        self.min_rate = min_rate
+        self._runs = {}  # run id -> requested rate or None
+        self._shares = {}
+        self._pinned = set()  # runs that cannot change rate once started
+        self._lock = threading.Lock()
+        self._budget = None
+
+    def start(self):
+        if self.schedule:
+            threading.Thread(target=self._watch_schedule, name="bandwidth-schedule", daemon=True).start()
+
+    def budget(self, now=None):
+        """The bytes/s budget in force at this local time, or None for unlimited."""
+        hour = time.localtime(now).tm_hour
+        for start, end, limit in self.schedule:
+            if (start <= hour < end) if start <= end else (hour >= start or hour < end):
+                return limit
+        return self.limit
+
+    def acquire(self, run_id, requested=None, pinned=False):
+        """Register a starting run. Returns its rate limit in bytes/s, or None for unlimited.
+
+        A `pinned` run applies the rate once and keeps it until release().
+        """
+        with self._lock:
+            self._runs[run_id] = requested
+            self._rebalance(new_pinned=run_id if pinned else None)
+            if pinned and run_id in self._shares:
+                self._pinned.add(run_id)
+            return self._shares.get(run_id)
+
+    def release(self, run_id):
+        with self._lock:
+            self._runs.pop(run_id, None)
+            self._shares.pop(run_id, None)
+            self._pinned.discard(run_id)
+            self._rebalance()
+        if ytdlp_pool is not None:
+            ytdlp_pool.set_rate_limit(run_id, None)
+
+    def status(self):
+        with self._lock:
+            return {"budget": self._budget, "runs": len(self._runs), "allocated": sum(self._shares.values())}
+
+    def _rebalance(self, new_pinned=None):
+        budget = self._budget = self.budget()
+        shares = {run_id: self._shares[run_id] for run_id in self._pinned}
+        runs = {run_id: rate for run_id, rate in self._runs.items() if run_id not in self._pinned}
+        fixed = {run_id: rate for run_id, rate in runs.items() if rate}
+        if budget:
+            budget = max(0, budget - sum(shares.values()))
+            fixed_total = sum(fixed.values())
+            if fixed_total > budget:  # scale the requested rates down to fit
+                fixed = {run_id: max(self.min_rate, rate * budget // fixed_total) for run_id, rate in fixed.items()}
+                fixed_total = budget
+            others = [run_id for run_id in runs if run_id not in fixed]
+            if others:
+                share = max(self.min_rate, (budget - fixed_total) // len(others))
+                shares.update((run_id, share) for run_id in others)
+            if new_pinned in shares:
+                slot = self._budget // MAX_CONCURRENT_DOWNLOADS
+                shares[new_pinned] = max(self.min_rate, min(shares[new_pinned], slot))
+        shares.update(fixed)
+        changed = [run_id for run_id, rate in shares.items() if self._shares.get(run_id) != rate]
+        self._shares = shares
+        if ytdlp_pool is not None:
+            for run_id in changed:
+                ytdlp_pool.set_rate_limit(run_id, shares[run_id])
+
+    def _watch_schedule(self):
+        while True:
+            time.sleep(BANDWIDTH_CHECK_INTERVAL)
+            with self._lock:
+                if self.budget() != self._budget:
+                    print(f"[Bandwidth] Budget now {self.budget() or 'unlimited'} bytes/s")
+                    self._rebalance()
+
+
+bandwidth = BandwidthManager()
+
+
+class StagingArea:
+    """Where jobs download to before their files are published into DOWNLOAD_DIR.
+
+    Each job writes into a folder of its own, named after its id, so the
+    .part files and fragments of concurrent jobs never land among finished
+    files. A file is published once yt-dlp (and the post-processing stage)
+    is done with it: renamed to the same relative path under DOWNLOAD_DIR
+    or, when staging is on another filesystem, copied next to its
+    destination under a hidden name and then renamed, so DOWNLOAD_DIR never
+    shows a half-written file. A file never replaces one already in
+    DOWNLOAD_DIR: it is published as "name (2).ext" and so on instead. A
+    finished job's folder is removed with what is left in it, except a
+    failed job's: restarting it resumes from there.
+    """
+
+    def __init__(self, directory=STAGING_DIR):
+        self.directory = directory
+        self._stranded = set()  # jobs with a file that could not be published
+        self._lock = threading.Lock()  # picking a free name and taking it is one step
+
+    def job_dir(self, job):
+        """The folder yt-dlp writes a job's files to."""
+        return os.path.join(self.directory, job.id) if self.directory else DOWNLOAD_DIR
+
+    def publish(self, job, path):
+        """Move a finished file into DOWNLOAD_DIR. Returns its new path (the old one if it stays)."""
+        if not self.directory or not path or not os.path.exists(path):
+            return path
+        relative = os.path.relpath(path, self.job_dir(job))
+        if relative.startswith(os.pardir):
+            return path
+        try:
+            os.makedirs(os.path.dirname(os.path.join(DOWNLOAD_DIR, relative)), exist_ok=True)
+            try:
+                with self._lock:
+                    target = os.path.join(DOWNLOAD_DIR, free_filename(relative))
+                    os.rename(path, target)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                target = self._copy_into_place(path, relative)
+        except OSError as e:
+            print(f"[Staging] ❌ Could not move {path} into {DOWNLOAD_DIR}: {e}")
+            self._stranded.add(job.id)
+            return path
+        return target
+
+    def _copy_into_place(self, path, relative):
+        partial = os.path.join(DOWNLOAD_DIR, os.path.dirname(relative), f".{os.path.basename(relative)}.publishing")
+        try:
+            shutil.copyfile(path, partial)
+            with self._lock:
+                target = os.path.join(DOWNLOAD_DIR, free_filename(relative))
+                os.rename(partial, target)
+        except OSError:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            raise
+        os.remove(path)
+        return target
+
+    def discard(self, job_ids):
+        """Remove the folders of these jobs with the partial files left in them."""
+        if not self.directory:
+            return
+        for job_id in job_ids:
+            folder = os.path.join(self.directory, job_id)
+            if job_id in self._stranded:
+                print(f"[Staging] ⚠️ Keeping {folder}: it holds files that could not be moved")
+            else:
+                shutil.rmtree(folder, ignore_errors=True)
+
+    def clean(self, keep):
+        """Remove the folders left by jobs of an earlier run, except those in `keep` (resumed or failed)."""
+        if not self.directory:
+            return
+        try:
+            orphans = [name for name in os.listdir(self.directory) if name not in keep]
+        except OSError:
+            return
+        self.discard(orphans)
+        if orphans:
+            print(f"[Staging] 🧹 Removed {len(orphans)} orphaned folder(s) of partial downloads")
+
+
+staging = StagingArea()
+
+
+class DiskSpace:
+    """Admission control on the free space of the staging and download disks.
+
+    Queued jobs wait while either disk has less than MIN_FREE_SPACE free.
+    When extraction reports the size of the video a run is about to
+    download, the run reserves that much; a video that doesn't fit next to
+    the other runs' reservations stops its run before the first byte is
+    fetched, instead of failing when ffmpeg merges it.
+    """
+
+    def __init__(self, min_free=MIN_FREE_SPACE):
+        self.min_free = min_free
+        self._reserved = {}  # run id -> size of the video it is downloading
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._room = True
+
+    def free(self):
+        """Free bytes on the fuller of the staging and download disks, or None if unknown."""
+        free = None
+        for directory in {staging.directory or DOWNLOAD_DIR, DOWNLOAD_DIR}:
+            try:
+                space = shutil.disk_usage(directory).free
+            except OSError:
+                continue
+            free = space if free is None else min(free, space)
+        return free
+
+    def _available(self, run_id=None):
+        """Bytes left above min_free once the other runs' reservations are met (None if unknown)."""
+        free = self.free()
+        if free is None:
+            return None
+        return free - self.min_free - sum(size for other, size in self._reserved.items() if other != run_id)
+
+    def has_room(self):
+        """Whether queued jobs may start (the disks are checked at most once a second)."""
+        now = time.monotonic()
+        if now - self._checked < 1:
+            return self._room
+        with self._lock:
+            available = self._available()
+        room = available is None or available > 0
+        if room != self._room:
+            if room:
+                print("[Disk] ▶️ Enough free space again, starting queued downloads")
+            else:
+                print(f"[Disk] ⏸️ Less than {format_bytes(self.min_free)} free, holding queued downloads")
+        self._checked, self._room = now, room
+        return room
+
+    def reserve(self, run_id, size):
+        """Reserve room for the video a run is about to download. Returns an error message if it doesn't fit."""
+        with self._lock:
+            available = self._available(run_id)
+            if available is not None and available < (size or 0):
+                self._reserved.pop(run_id, None)
+                needed = f"{format_bytes(size)} needed, " if size else ""
+                return (f"Not enough disk space: {needed}{format_bytes(max(0, available))} free "
+                        f"above the {format_bytes(self.min_free)} kept in reserve")
+            if size:
+                self._reserved[run_id] = size
+            else:
+                self._reserved.pop(run_id, None)
+        return None
+
+    def release(self, run_id):
+        with self._lock:
+            self._reserved.pop(run_id, None)
+
+    def status(self):
+        with self._lock:
+            reserved = sum(self._reserved.values())
+        return {"free": self.free(), "reserved": reserved, "min_free": self.min_free, "room": self.has_room(),
+                "staging_dir": staging.directory}
+
+
+disk_space = DiskSpace()
+
+
+class DownloadScheduler:
+    """Worker pool that runs queued jobs under a global and a per-host concurrency cap.
+
+    Pending jobs are ordered by priority, then FIFO. A job whose host is already
+    at its limit is skipped over, so one busy site cannot stall the whole queue.
+    Jobs also count their connections (concurrent fragments or aria2c
+    connections) against max_connections, so fragment parallelism times job
+    parallelism stays bounded; a job that needs more than the whole cap
+    still runs when nothing else is active.
+
+    Anything with an id, priority, host and connections can be queued;
+    submit() takes an optional delay (for retry backoff) and a runner other
+    than the default.
+    """
+
+    def __init__(self, runner, max_concurrent=MAX_CONCURRENT_DOWNLOADS,
+                 host_limits=None, default_host_limit=DEFAULT_HOST_LIMIT, max_connections=MAX_CONNECTIONS):
+        self._runner = runner
+        self.max_concurrent = max_concurrent
+        self.max_connections = max_connections
+        self.host_limits = dict(HOST_LIMITS if host_limits is None else host_limits)
+        self.default_host_limit = default_host_limit
+        self._cond = threading.Condition()
+        self._pending = []  # sorted list of (priority, seq, job, not_before, runner)
+        self._seq = itertools.count()
+        self._active = {}
+        self._active_per_host = collections.Counter()
+        self._active_connections = 0
+        self._workers = []
+
+    def start(self):
+        """Start the worker threads (one per global slot)."""
+        for i in range(self.max_concurrent):
+            worker = threading.Thread(target=self._worker, name=f"download-worker-{i + 1}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def host_limit(self, host):
+        return self.host_limits.get(host, self.default_host_limit)
+
+    def _has_room(self, job, connections=0):
+        """Whether the job's host and the connection budget let it start (after `connections` more)."""
+        connections += self._active_connections
+        return (self._active_per_host[job.host] < self.host_limit(job.host)
+                and (connections + job.connections <= self.max_connections or connections == 0))
+
+    def submit(self, job, delay=0, runner=None):
+        """Queue a job. Returns 0 if it can start right away, else its 1-based queue position."""
+        with self._cond:
+            entry = (job.priority, next(self._seq), job, time.monotonic() + delay, runner or self._runner)
+            bisect.insort(self._pending, entry)
+            ahead = self._pending.index(entry)
+            same_host_ahead = sum(1 for _, _, other, _, _ in self._pending[:ahead] if other.host == job.host)
+            connections_ahead = sum(other.connections for _, _, other, _, _ in self._pending[:ahead])
+            starts_now = (
+                delay <= 0
+                and disk_space.has_room()
+                and ahead < self.max_concurrent - len(self._active)
+                and self._active_per_host[job.host] + same_host_ahead < self.host_limit(job.host)
+                and self._has_room(job, connections_ahead)
+            )
+            self._cond.notify_all()
+        return 0 if starts_now else ahead + 1
+
+    def cancel_pending(self, job_id):
+        """Remove a job that has not started yet. Returns True if it was pending."""
+        with self._cond:
+            for i, (_, _, job, _, _) in enumerate(self._pending):
+                if job.id == job_id:
+                    del self._pending[i]
+                    return True
+        return False
+
+    def is_active(self, job_id):
+        with self._cond:
+            return job_id in self._active
+
+    def counts(self):
+        with self._cond:
+            return {"pending": len(self._pending), "active": len(self._active),
+                    "connections": self._active_connections}
+
+    def _take_runnable(self):
+        """Pop the first due entry that has room to start. Returns (entry, seconds until the next due one)."""
+        if self._pending and not disk_space.has_room():
+            return None, DISK_CHECK_INTERVAL
+        now = time.monotonic()
+        next_due = None
+        for i, entry in enumerate(self._pending):
+            _, _, job, not_before, _ = entry
+            if not_before > now:
+                wait = not_before - now
+                next_due = wait if next_due is None else min(next_due, wait)
+            elif self._has_room(job):
+                del self._pending[i]
+                return entry, None
+        return None, next_due
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                entry, next_due = self._take_runnable()
+                if entry is not None:
+                    job = entry[2]
+                    self._active[job.id] = job
+                    self._active_per_host[job.host] += 1
+                    self._active_connections += job.connections
+                    return entry
+                self._cond.wait(next_due)
+
+    def _finish(self, job):
+        with self._cond:
+            self._active.pop(job.id, None)
+            self._active_per_host[job.host] -= 1
+            self._active_connections -= job.connections
+            if self._active_per_host[job.host] <= 0:
+                del self._active_per_host[job.host]
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            _, _, job, not_before, runner = self._next_job()
+            metrics.queue_wait.observe(max(0.0, time.monotonic() - not_before))
+            try:
+                runner(job)
+            except Exception as e:
+                print(f"[Scheduler] ❌ Job {job.id} crashed: {e}")
+            finally:
+                self._finish(job)
+
+
+def is_loopback(host):
+    """Whether `host` (an address to listen on or a client's address) only reaches this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def outbound_address(url):
+    """This machine's address on the route to `url`'s host (nothing is sent)."""
+    parts = urlsplit(url)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.connect((parts.hostname, parts.port or 80))
+        return probe.getsockname()[0]
+
+
+def cluster_call(url, body=None, timeout=30):
+    """Send a request to another instance of this server (POST with a JSON body, else GET); returns its JSON."""
+    headers = {"Content-Type": "application/json"}
+    if CLUSTER_TOKEN:
+        headers["X-Cluster-Token"] = CLUSTER_TOKEN
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    with urlopen(Request(url, data=data, headers=headers), timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class JobLeases:
+    """Coordinator side of cluster mode: queued jobs are leased to worker instances instead of run here.
+
+    Stands in for the DownloadScheduler (submit, cancel_pending, is_active,
+    counts, host_limit). Workers long-poll lease() for as many jobs as they
+    have free slots, and report their jobs' state with heartbeat(). A worker
+    holds no more jobs of a site than HOST_LIMITS allows one instance, and
+    a job counts as held until a heartbeat reports it finished, which also
+    wakes up that worker's waiting lease. A worker not heard from for
+    WORKER_LEASE_TIMEOUT seconds is dropped and its jobs are requeued.
+    """
+
+    REPORTED_FIELDS = ("title", "status", "progress", "error", "started", "finished", "downloaded_bytes",
+                       "total_bytes", "speed", "eta", "fragment_index", "fragment_count", "playlist_index",
+                       "playlist_count", "current_title", "filepath", "files_completed")
+
+    def __init__(self, lease_timeout=WORKER_LEASE_TIMEOUT):
+        self.lease_timeout = lease_timeout
+        self._cond = threading.Condition()
+        self._pending = []  # sorted list of (priority, seq, job)
+        self._seq = itertools.count()
+        self._leased = {}  # job id -> (job, worker id, time.monotonic() of the lease)
+        self._workers = {}  # worker id -> {"url", "seen", "capacity", "completed"}
+        self._cancels = collections.defaultdict(set)  # worker id -> job ids to cancel there
+
+    def start(self):
+        threading.Thread(target=self._watch_workers, name="cluster-leases", daemon=True).start()
+
+    def host_limit(self, host):
+        """Jobs of a site that can run at once: HOST_LIMITS per worker."""
+        with self._cond:
+            workers = len(self._workers)
+        return HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT) * max(1, workers)
+
+    def submit(self, job, delay=0, runner=None):
+        """Queue a job for the next worker with room. Returns its 1-based queue position."""
+        with self._cond:
+            entry = (job.priority, next(self._seq), job)
+            bisect.insort(self._pending, entry)
+            self._cond.notify_all()
+            return self._pending.index(entry) + 1
+
+    def cancel_pending(self, job_id):
+        """Remove a job no worker has taken yet; a leased one is cancelled on its worker's next heartbeat."""
+        with self._cond:
+            for i, (_, _, job) in enumerate(self._pending):
+                if job.id == job_id:
+                    del self._pending[i]
+                    return True
+            if job_id in self._leased:
+                self._cancels[self._leased[job_id][1]].add(job_id)
+        return False
+
+    def is_active(self, job_id):
+        with self._cond:
+            return job_id in self._leased
+
+    def counts(self):
+        with self._cond:
+            return {"pending": len(self._pending), "active": len(self._leased), "connections": 0}
+
+    def workers(self):
+        """Per-worker capacity as last reported, for /status and /cluster/workers."""
+        now = time.monotonic()
+        with self._cond:
+            leased = collections.Counter(worker_id for _, worker_id, _ in self._leased.values())
+            return [{"id": worker_id, "url": worker["url"], "last_seen": round(now - worker["seen"], 1),
+                     "leased": leased[worker_id], "completed": worker["completed"], "capacity": worker["capacity"]}
+                    for worker_id, worker in self._workers.items()]
+
+    def lease(self, worker_id, url, free, timeout):
+        """Up to `free` jobs (plus any the worker finishes meanwhile) for a worker, waiting up to `timeout`."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._seen(worker_id, url)
+            held = self._held(worker_id)
+            while True:
+                hosts = self._held(worker_id)
+                taken = self._take(worker_id, free + sum(held.values()) - sum(hosts.values()), hosts)
+                remaining = deadline - time.monotonic()
+                if taken or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._seen(worker_id, url)
+        for job in taken:
+            jobs.update(job, worker=url)
+            print(f"[Cluster] Job {job.id} leased to {url}")
+        return taken
+
+    def heartbeat(self, worker_id, url, capacity, views):
+        """Apply a worker's job views. Returns the ids of jobs it should cancel."""
+        cancel = []
+        with self._cond:
+            self._seen(worker_id, url)
+            self._workers[worker_id]["capacity"] = capacity
+            cancel.extend(self._cancels.pop(worker_id, ()))
+            reported = set()
+            updates = []
+            for view in views:
+                lease = self._leased.get(view.get("id"))
+                if lease is None or lease[1] != worker_id:
+                    cancel.append(view.get("id"))  # requeued elsewhere meanwhile, or unknown here
+                    continue
+                reported.add(lease[0].id)
+                updates.append((lease[0], view))
+                if view.get("status") in FINISHED_STATUSES:
+                    del self._leased[lease[0].id]
+                    self._workers[worker_id]["completed"] += 1
+            # Leased but never reported: the lease reply got lost on the way
+            lost = [job for job, owner, leased_at in self._leased.values()
+                    if owner == worker_id and job.id not in reported
+                    and time.monotonic() - leased_at > self.lease_timeout]
+            if updates:
+                self._cond.notify_all()  # finished jobs may leave room for a waiting lease
+        for job, view in updates:
+            jobs.update(job, **{name: view.get(name) for name in self.REPORTED_FIELDS})
+        for job in lost:
+            self._requeue(job, "lease not acknowledged")
+        return cancel
+
+    def _seen(self, worker_id, url):
+        worker = self._workers.get(worker_id)
+        if worker is None:
+            worker = self._workers[worker_id] = {"url": url, "seen": 0, "capacity": {}, "completed": 0}
+            print(f"[Cluster] ✅ Worker {worker_id} joined ({url})")
+        worker["seen"] = time.monotonic()
+
+    def _held(self, worker_id):
+        """Jobs leased to a worker and not reported finished, per site."""
+        return collections.Counter(job.host for job, owner, _ in self._leased.values() if owner == worker_id)
+
+    def _take(self, worker_id, free, hosts):
+        taken = []
+        for entry in list(self._pending):
+            if len(taken) >= free:
+                break
+            job = entry[2]
+            if hosts[job.host] < HOST_LIMITS.get(job.host, DEFAULT_HOST_LIMIT):
+                self._pending.remove(entry)
+                self._leased[job.id] = (job, worker_id, time.monotonic())
+                hosts[job.host] += 1
+                taken.append(job)
+        return taken
+
+    def _requeue(self, job, reason):
+        with self._cond:
+            self._leased.pop(job.id, None)
+        if job.cancel_event.is_set():
+            jobs.update(job, status="cancelled", finished=time.time(), worker=None)
+            return
+        print(f"[Cluster] 🔁 Requeued job {job.id} ({reason})")
+        job.reset()
+        jobs.update(job, status="pending")
+        self.submit(job)
+
+    def _watch_workers(self):
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            with self._cond:
+                lost = [worker_id for worker_id, worker in self._workers.items()
+                        if now - worker["seen"] > self.lease_timeout]
+                for worker_id in lost:
+                    print(f"[Cluster] ⚠️ Worker {worker_id} lost ({self._workers[worker_id]['url']})")
+                    del self._workers[worker_id]
+                    self._cancels.pop(worker_id, None)
+                orphans = [job for job, worker_id, _ in self._leased.values() if worker_id not in self._workers]
+            for job in orphans:
+                self._requeue(job, "worker lost")
+
+
+class ClusterWorker:
+    """Worker side of cluster mode: runs jobs leased from COORDINATOR_URL and reports on them.
+
+    One thread asks the coordinator for as many jobs as the local scheduler
+    has free slots; leased jobs then run like local ones. Another sends the
+    leased jobs' views and the free capacity every WORKER_HEARTBEAT_INTERVAL
+    seconds, and right away when a leased job finishes, and cancels what the
+    coordinator sends back.
+    """
+
+    def __init__(self, coordinator, url):
+        self.coordinator = coordinator.rstrip("/")
+        self.url = url
+        self.id = uuid.uuid4().hex[:12]
+        self._leased = {}  # job id -> job, until its final state has been reported
+        self._lock = threading.Lock()
+        self._connected = None
+
+    def start(self):
+        print(f"[Cluster] Worker {self.id} ({self.url}) taking jobs from {self.coordinator}")
+        threading.Thread(target=self._lease_loop, name="cluster-lease", daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name="cluster-heartbeat", daemon=True).start()
+
+    def capacity(self):
+        counts = scheduler.counts()
+        free = max(0, scheduler.max_concurrent - counts["active"] - counts["pending"])
+        if not disk_space.has_room():
+            free = 0  # leave the jobs to workers with disk space
+        return dict(counts, slots=scheduler.max_concurrent, free=free)
+
+    def _call(self, path, body, timeout):
+        try:
+            reply = cluster_call(self.coordinator + path, body, timeout)
+        except (OSError, ValueError) as e:
+            if self._connected is not False:
+                print(f"[Cluster] ⚠️ Coordinator unreachable: {e}")
+            self._connected = False
+            return None
+        if not self._connected:
+            print(f"[Cluster] ✅ Connected to coordinator {self.coordinator}")
+        self._connected = True
+        return reply
+
+    def _lease_loop(self):
+        while True:
+            free = self.capacity()["free"]
+            if free <= 0:
+                time.sleep(0.5)  # a slot frees up when a local job finishes
+                continue
+            reply = self._call("/cluster/lease", {"worker": self.id, "url": self.url, "free": free},
+                               LEASE_POLL_TIMEOUT + 10)
+            if reply is None:
+                time.sleep(WORKER_HEARTBEAT_INTERVAL)
+                continue
+            for spec in reply.get("jobs", []):
+                self._run(spec)
+
+    def _run(self, spec):
+        """Register a leased job locally under the coordinator's id and queue it."""
+        profile = spec.get("profile") if spec.get("profile") in DOWNLOAD_PROFILES else None
+        job = DownloadJob(spec["url"], spec["quality"], spec["is_playlist"], spec["playlist_items"], None,
+                          spec["priority"], spec["title"], profile, spec["urls"], spec.get("direct"))
+        job.id = spec["id"]
+        job.use_archive = spec["use_archive"]
+        job.rate_limit = spec["rate_limit"]
+        job.restarts = spec["restarts"]
+        with self._lock:
+            self._leased[job.id] = job
+        ytdlp_cmd = get_ytdlp_cmd()
+        if not ytdlp_cmd and job.direct is None:
+            job.status, job.error, job.finished = "failed", "yt-dlp not found on worker", time.time()
+            jobs.add(job)
+            return
+        job.cmd = build_job_command(ytdlp_cmd, job)
+        apply_cached_metadata(job)
+        jobs.add(job)
+        print(f"[Cluster] Leased job {job.id} ({job.host}, {job.quality}): {job.title}")
+        scheduler.submit(job)
+
+    def _heartbeat_loop(self):
+        since = jobs.version
+        next_beat = 0
+        while True:
+            version, events = jobs.wait_for_events(since, max(0, next_beat - time.monotonic()))
+            since = version
+            with self._lock:
+                leased = list(self._leased.values())
+                finished = any(view["id"] in self._leased and view["status"] in FINISHED_STATUSES
+                               for event in events or () for view in event.get("jobs", ()))
+            if not finished and time.monotonic() < next_beat:
+                continue
+            next_beat = time.monotonic() + WORKER_HEARTBEAT_INTERVAL
+            views = [job.view for job in leased]
+            reply = self._call("/cluster/heartbeat", {"worker": self.id, "url": self.url,
+                                                      "capacity": self.capacity(), "jobs": views}, 30)
+            if reply is not None:
+                with self._lock:
+                    for view in views:
+                        if view["status"] in FINISHED_STATUSES:
+                            self._leased.pop(view["id"], None)
+                for job_id in reply.get("cancel", []):
+                    job = jobs.get(job_id)
+                    if job is not None and job.status not in FINISHED_STATUSES:
+                        cancel_job(job)  # reported as cancelled on the next heartbeat
+
+
+def lease_spec(job):
+    """What a worker needs to run a leased job: the request's arguments, not the local command."""
+    return {"id": job.id, "url": job.url, "urls": job.urls, "quality": job.quality, "is_playlist": job.is_playlist,
+            "playlist_items": job.playlist_items, "priority": job.priority, "title": job.title,
+            "profile": job.profile, "use_archive": job.use_archive, "rate_limit": job.rate_limit,
+            "restarts": job.restarts, "direct": job.direct}
+
+
+def cluster_status():
+    """Role and peers of this instance for /status."""
+    if CLUSTER_ROLE == "coordinator":
+        return {"role": "coordinator", "workers": scheduler.workers()}
+    if cluster_worker is not None:
+        return {"role": "worker", "id": cluster_worker.id, "coordinator": cluster_worker.coordinator}
+    return {"role": "standalone"}
+
+
+jobs = JobRegistry()
+scheduler = DownloadScheduler(run_download_job)
+cluster_worker = None  # ClusterWorker when CLUSTER_ROLE is "worker"
+
+
+def canonical_url(url, playlist=True):
+    """Cache key for a URL: YouTube playlists/videos by id, other URLs normalized.
+
+    A watch URL inside a playlist (v=...&list=...) maps to the playlist unless
+    playlist=False.
+    """
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www.") or host.startswith("m."):
+        host = host.split(".", 1)[1]
+    query = parse_qs(parsed.query)
+    if host_key(url) == "youtube.com":
+        if "list" in query and (playlist or "v" not in query):
+            return "youtube:playlist:" + query["list"][0]
+        if "v" in query:
+            return "youtube:video:" + query["v"][0]
+        if host == "youtu.be" and parsed.path.strip("/"):
+            return "youtube:video:" + parsed.path.strip("/").split("/")[0]
+        if parsed.path.startswith("/shorts/"):
+            return "youtube:video:" + parsed.path.split("/")[2]
+    params = sorted(
+        (k, v) for k, values in query.items() for v in values
+        if k not in TRACKING_PARAMS and not k.startswith("utm_")
+    )
+    path = parsed.path.rstrip("/") or "/"
+    return f"{host}{path}" + ("?" + urlencode(params) if params else "")
+
+
+def parse_playlist_items(spec, total=None):
+    """Expand a --playlist-items spec like "1-5,8,10-" into 1-based indexes, or None if it can't be."""
+    indexes = []
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        start, sep, end = part.partition("-")
+        try:
+            if not sep:
+                indexes.append(int(start))
+                continue
+            end = int(end) if end else total
+            if end is None:
+                return None
+            indexes.extend(range(int(start or 1), end + 1))
+        except ValueError:
+            return None
+    return sorted(set(i for i in indexes if i > 0 and (total is None or i <= total)))
+
+
+class MetadataCache:
+    """TTL + LRU cache of playlist listings and video metadata, optionally saved to disk.
+
+    Writes to the file are batched: a change schedules one save
+    METADATA_CACHE_SAVE_DELAY seconds later, whatever happens in between.
+    """
+
+    def __init__(self, path=METADATA_CACHE_FILE, ttl=METADATA_CACHE_TTL, max_entries=METADATA_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+        self._save_timer = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Read the cache file, dropping entries that expired while the server was down."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[Cache] ⚠️ Ignoring unreadable cache file: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, (expires, value) in stored.items():
+                if expires > now:
+                    self._entries[key] = (expires, value)
+            self._evict()
+        print(f"[Cache] Loaded {len(self._entries)} cached entries")
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] <= time.time():
+                if item is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            self._evict()
+        self._schedule_save()
 
-    # 1: In the same directory
-    local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "yt-dlp.exe")
-    if os.path.exists(local):
-        return [local]
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None. Returns how many entries were removed."""
+        with self._lock:
+            if key is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                removed = 1 if self._entries.pop(key, None) is not None else 0
+        if removed:
+            self._schedule_save()
+        return removed
 
-    # 2: In system PATH
-    path = shutil.which("yt-dlp")
-    if path:
-        return [path]
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
 
-    # 3: In various Python Scripts directories
-    scripts_dirs = [
-        os.path.join(sys.prefix, "Scripts"),
-        os.path.join(sys.base_prefix, "Scripts"),
-        os.path.join(os.path.expanduser("~"), "AppData", "Local", "Programs", "Python", "Scripts"),
-        os.path.join(os.path.expanduser("~"), "AppData", "Roaming", "Python", "Scripts"),
-        os.path.join(os.path.expanduser("~"), "AppData", "Local", "Packages"),  # MS Store Python
-    ]
-    # Add all Python* Scripts directories
-    local_programs = os.path.join(os.path.expanduser("~"), "AppData", "Local", "Programs", "Python")
-    if os.path.isdir(local_programs):
-        for d in os.listdir(local_programs):
-            scripts_dirs.append(os.path.join(local_programs, d, "Scripts"))
-    roaming_python = os.path.join(os.path.expanduser("~"), "AppData", "Roaming", "Python")
-    if os.path.isdir(roaming_python):
-        for d in os.listdir(roaming_python):
-            scripts_dirs.append(os.path.join(roaming_python, d, "Scripts"))
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            self._save_timer = None
+            data = dict(self._entries)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[Cache] ⚠️ Could not save cache: {e}")
 
-    for scripts_dir in scripts_dirs:
-        candidate = os.path.join(scripts_dir, "yt-dlp.exe")
-        if os.path.exists(candidate):
-            return [candidate]
+    def _schedule_save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(METADATA_CACHE_SAVE_DELAY, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
 
-    # 4: Fallback — python -m yt_dlp
-    try:
-        result = subprocess.run(
-            [sys.executable, "-m", "yt_dlp", "--version"],
-            capture_output=True, text=True, timeout=10
-        )
-        if result.returncode == 0:
-            return [sys.executable, "-m", "yt_dlp"]
-    except Exception:
-        pass
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+metadata_cache = MetadataCache()
+
+
+def job_dedup_keys(job):
+    """Jobs sharing a key download the same files, so a second one is coalesced into the first.
 
+    A /download/batch group has one key per video URL.
+    """
+    return {(canonical_url(url, job.is_playlist), job.quality, job.playlist_items or "") for url in job.urls}
+
+
+def archive_entry(url):
+    """(extractor, video id) for a single-video URL we can identify without yt-dlp, else None."""
+    key = canonical_url(url, playlist=False)
+    if key.startswith("youtube:video:"):
+        return "youtube", key[len("youtube:video:"):]
     return None
 
 
-def get_ytdlp_cmd():
-    """Get yt-dlp command (searches each time to make sure it's found)"""
-    global _ytdlp_cache
-    if _ytdlp_cache is not None:
-        return _ytdlp_cache
-    _ytdlp_cache = find_ytdlp()
-    return _ytdlp_cache
+class DownloadArchive:
+    """Index of downloaded videos per quality, backed by yt-dlp --download-archive files.
 
+    yt-dlp itself appends to the files (and skips archived playlist entries
+    before probing them); the server reads each file once and then keeps
+    its in-memory set current from the saved-file events, so it can answer
+    "already downloaded?" without a yt-dlp run.
+    """
 
-_ytdlp_cache = find_ytdlp()
+    def __init__(self, directory=DOWNLOAD_ARCHIVE_DIR):
+        self.directory = directory
+        self._entries = {}  # quality -> {"<extractor> <id>"}
+        self._lock = threading.Lock()
 
-MAX_NETWORK_WAIT = 300  # Max seconds to wait for network (5 min)
-NETWORK_CHECK_INTERVAL = 10  # Seconds between connectivity checks
-FAILED_ITEM_RETRY_DELAY = 15  # Seconds to wait before retrying failed items
-MAX_RETRY_ROUNDS = 3  # Max retry rounds for failed playlist items
+    def path(self, quality):
+        """The archive file for a quality (its directory is created, since yt-dlp won't)."""
+        if not self.directory:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, re.sub(r"[^\w-]", "_", str(quality)) + ".txt")
 
+    def _load(self, quality):
+        entries = self._entries.get(quality)
+        if entries is not None:
+            return entries
+        entries = set()
+        path = self.path(quality)
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entries.update(line.strip() for line in f if line.strip())
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[Archive] ⚠️ Could not read {path}: {e}")
+        self._entries[quality] = entries
+        return entries
 
-def get_quality_args(quality):
-    """Build yt-dlp quality selection arguments."""
-    if quality == "audio":
-        return ["-f", "bestaudio", "-x", "--audio-format", "mp3"]
-    if quality == "best":
-        return ["-f", "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"]
-    if quality in ("720", "480", "360"):
-        return ["-f", f"bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/best[height<={quality}][ext=mp4]/best"]
-    return ["-f", "best[ext=mp4]/best"]
+    def contains(self, quality, extractor, video_id):
+        with self._lock:
+            return f"{extractor.lower()} {video_id}" in self._load(quality)
 
+    def add(self, quality, extractor, video_id):
+        with self._lock:
+            self._load(quality).add(f"{extractor.lower()} {video_id}")
 
-def get_output_args(is_playlist, playlist_items):
-    """Build yt-dlp output path and playlist mode arguments."""
-    if is_playlist:
-        args = [
-            "-o", os.path.join(DOWNLOAD_DIR, "%(playlist_title)s", "%(playlist_index)03d - %(title)s.%(ext)s"),
-            "--yes-playlist",
-        ]
-        if playlist_items:
-            args += ["--playlist-items", playlist_items]
-        return args
-    return [
-        "-o", os.path.join(DOWNLOAD_DIR, "%(title)s.%(ext)s"),
-        "--no-playlist",
-    ]
+    def missing(self, job):
+        """How many of a request's videos aren't archived yet, judging from its URL or cached listing.
 
+        Returns None when it can't be told without running yt-dlp. A cached
+        listing may miss brand-new videos, so for playlists this is only a hint.
+        """
+        if not self.directory:
+            return None
+        if not job.is_playlist:
+            entry = archive_entry(job.url)
+            if entry is None:
+                return None
+            return 0 if self.contains(job.quality, *entry) else 1
+        if not job.playlist_entries or host_key(job.url) != "youtube.com":
+            return None
+        return sum(1 for video_id in job.playlist_entries.values()
+                   if not self.contains(job.quality, "youtube", video_id))
 
-def get_common_ytdlp_args():
-    """Build common yt-dlp arguments used for both regular and retry downloads."""
-    return [
+
+download_archive = DownloadArchive()
+
+
+def build_playlist_info_command(ytdlp_cmd, url):
+    """Build the yt-dlp command that lists a playlist's entries, one JSON object per line."""
+    return list(ytdlp_cmd) + [
+        "--flat-playlist",
+        "--dump-json",
         "--no-check-certificates",
-        "--merge-output-format", "mp4",
-        "--embed-thumbnail",
-        "--add-metadata",
-        "--js-runtimes", "node",
-        "--retries", "10",
-        "--fragment-retries", "10",
-        "--retry-sleep", "exp=1:2:60",
+        *get_toolchain_args(),
+        "--yes-playlist",
+        url
     ]
 
 
-def build_download_command(ytdlp_cmd, url, quality, is_playlist, playlist_items):
-    """Build full yt-dlp command for a download request."""
-    cmd = list(ytdlp_cmd)
-    cmd += get_quality_args(quality)
-    cmd += get_output_args(is_playlist, playlist_items)
-    cmd += get_common_ytdlp_args()
-    cmd.append(url)
-    return cmd
+class PlaylistEnumeration:
+    """A background yt-dlp --flat-playlist run whose entries can be read while it is still going.
 
+    Entries are parsed as yt-dlp prints them and appended to a list, so the
+    first page can be served long before a big playlist has been listed in
+    full. The run is killed if yt-dlp prints nothing for PLAYLIST_IDLE_TIMEOUT.
+    """
 
-def build_retry_command(ytdlp_cmd, vid_url, quality):
-    """Build yt-dlp command for retrying a single playlist item."""
-    retry_cmd = list(ytdlp_cmd)
-    retry_cmd += get_quality_args(quality)
-    retry_cmd += [
-        "-o", os.path.join(DOWNLOAD_DIR, "%(playlist_title)s", "%(playlist_index)03d - %(title)s.%(ext)s"),
-        "--no-playlist",
-    ]
-    retry_cmd += get_common_ytdlp_args()
-    retry_cmd.append(vid_url)
-    return retry_cmd
+    def __init__(self, url, cmd):
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.key = canonical_url(url)
+        self.cmd = cmd
+        self.cached = False
+        self.entries = []
+        self.playlist_title = ""
+        self.done = False
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.process = None
+        self._last_output = self.started
+        self._cond = threading.Condition()
 
+    @classmethod
+    def from_cache(cls, url, data):
+        """A finished enumeration served straight from the metadata cache."""
+        enumeration = cls(url, None)
+        enumeration.cached = True
+        enumeration.playlist_title = data["playlist_title"]
+        enumeration.entries = data["entries"]
+        enumeration.done = True
+        enumeration.finished = time.time()
+        return enumeration
 
-def run_download_job(cmd, ytdlp_cmd, quality, is_playlist):
-    """Run yt-dlp download command and retry failed playlist items on network errors."""
-    try:
-        failed_ids = []
-        network_error_pattern = re.compile(
-            r'ERROR:.*?(\w{11}):.*?(getaddrinfo failed|Network is unreachable|Connection refused|timed out|Connection reset|URLError)',
-            re.IGNORECASE
-        )
+    def start(self):
+        threading.Thread(target=self._run, name=f"playlist-{self.id}", daemon=True).start()
+        return self
 
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-        )
-        for line in process.stdout:
-            line = line.strip()
-            if line:
-                print(f"  [yt-dlp] {line}")
-                match = network_error_pattern.search(line)
-                if match:
-                    video_id = match.group(1)
-                    if video_id not in failed_ids:
-                        failed_ids.append(video_id)
-        process.wait()
-
-        if process.returncode == 0:
-            print("[Download] ✅ Download completed successfully!")
+    def wait_for(self, count, timeout):
+        """Wait until at least `count` entries are known or the run has ended."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.done or len(self.entries) >= count, timeout)
+
+    def wait_for_change(self, count, timeout):
+        """Wait until there are more than `count` entries or the run has ended."""
+        self.wait_for(count + 1, timeout)
+
+    def page(self, offset, limit):
+        return self.entries[offset:offset + limit]
+
+    def to_dict(self, offset, limit):
+        """Response body for /playlist-info: one page plus counts so far."""
+        count = len(self.entries)
+        return {
+            "success": True,
+            "enumeration_id": self.id,
+            "playlist_title": self.playlist_title,
+            "count": count,
+            "total": count if self.done else None,
+            "complete": self.done,
+            "offset": offset,
+            "limit": limit,
+            "videos": self.page(offset, limit),
+            "cached": self.cached,
+            "error": self.error,
+        }
+
+    def line(self, line):
+        """Handle one line of --dump-json output (called by either engine)."""
+        self._last_output = time.time()
+        if line.startswith("{"):
+            self._add_entry(line)
+        elif line.startswith("ERROR:"):
+            self._error_lines.append(line.strip())
+
+    def _run(self):
+        self._error_lines = []
+        with playlist_info_slots:
+            self._last_output = time.time()  # waiting for the slot was not yt-dlp being silent
+            try:
+                args = ytdlp_args(self.cmd) if ytdlp_pool is not None else None
+                if args is not None:
+                    returncode = ytdlp_pool.run(self.id, _pool_list_playlist, args, self, started=self._watch)
+                else:
+                    self.process = start_ytdlp_process(self.cmd)
+                    self._watch()
+                    for line in self.process.stdout:
+                        self.line(line)
+                    returncode = self.process.wait()
+                if returncode != 0 and self.error is None:
+                    self.error = self._error_lines[-1] if self._error_lines else f"yt-dlp exited with code {returncode}"
+            except Exception as e:
+                self.error = str(e)
+        with self._cond:
+            self.done = True
+            self.finished = time.time()
+            self._cond.notify_all()
+        if not self.error:
+            metadata_cache.put(self.key, {"playlist_title": self.playlist_title, "entries": self.entries})
+        if self.error:
+            print(f"[Playlist Info] ❌ Failed after {len(self.entries)} videos: {self.error}")
         else:
-            print(f"[Download] ❌ Download failed (code: {process.returncode})")
-
-        if failed_ids and is_playlist:
-            print(f"\n[Retry] {len(failed_ids)} video(s) failed due to network errors: {failed_ids}")
-            retry_round = 0
-            while failed_ids and retry_round < MAX_RETRY_ROUNDS:
-                retry_round += 1
-                print(f"\n[Retry] === Round {retry_round}/{MAX_RETRY_ROUNDS} ===")
-                print(f"[Retry] Waiting {FAILED_ITEM_RETRY_DELAY}s before retrying...")
-                time.sleep(FAILED_ITEM_RETRY_DELAY)
-
-                if not check_network():
-                    print("[Retry] ⚠️ No internet connection detected")
-                    if not wait_for_network():
-                        print("[Retry] ❌ Giving up - no internet")
-                        break
-
-                still_failed = []
-                for vid_id in failed_ids:
-                    vid_url = f"https://www.youtube.com/watch?v={vid_id}"
-                    print(f"\n[Retry] Retrying: {vid_url}")
-
-                    retry_cmd = build_retry_command(ytdlp_cmd, vid_url, quality)
-                    retry_proc = subprocess.Popen(
-                        retry_cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        text=True,
-                        encoding="utf-8",
-                        errors="replace",
-                        creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-                    )
-                    retry_had_error = False
-                    for rline in retry_proc.stdout:
-                        rline = rline.strip()
-                        if rline:
-                            print(f"  [yt-dlp] {rline}")
-                            if network_error_pattern.search(rline):
-                                retry_had_error = True
-                    retry_proc.wait()
-
-                    if retry_proc.returncode == 0:
-                        print(f"[Retry] ✅ {vid_id} downloaded successfully!")
-                    else:
-                        print(f"[Retry] ❌ {vid_id} still failed")
-                        still_failed.append(vid_id)
-                        if retry_had_error and not check_network():
-                            print("[Retry] ⚠️ Network down again, waiting...")
-                            if not wait_for_network():
-                                still_failed.extend([v for v in failed_ids if v not in still_failed and v != vid_id])
-                                break
-
-                failed_ids = still_failed
-
-            if failed_ids:
-                print(f"\n[Retry] ❌ {len(failed_ids)} video(s) could not be downloaded after all retries:")
-                for vid_id in failed_ids:
-                    print(f"  - https://www.youtube.com/watch?v={vid_id}")
-            else:
-                print("\n[Retry] ✅ All failed videos recovered successfully!")
+            print(f"[Playlist Info] ✅ Found {len(self.entries)} videos in '{self.playlist_title}'")
 
-    except Exception as e:
-        print(f"[Download] ❌ Error: {e}")
+    def _add_entry(self, line):
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        video_info = {
+            "index": len(self.entries) + 1,
+            "title": entry.get("title", "Untitled"),
+            "url": entry.get("url", ""),
+            "duration": entry.get("duration"),
+            "id": entry.get("id", ""),
+        }
+        with self._cond:
+            if not self.playlist_title:
+                self.playlist_title = entry.get("playlist_title", "") or ""
+            self.entries.append(video_info)
+            self._cond.notify_all()
+
+    def _watch(self):
+        """Start the idle watchdog, once there is a process or pool run for it to stop."""
+        threading.Thread(target=self._watchdog, name=f"playlist-watchdog-{self.id}", daemon=True).start()
+
+    def _watchdog(self):
+        while not self.done:
+            time.sleep(1)
+            if not self.done and time.time() - self._last_output > PLAYLIST_IDLE_TIMEOUT:
+                self.error = f"No output from yt-dlp for {PLAYLIST_IDLE_TIMEOUT}s"
+                kill_process_tree(self.process)
+                if ytdlp_pool is not None:
+                    ytdlp_pool.cancel(self.id)
+                return
+
+
+class PlaylistEnumerations:
+    """Enumerations by id, reusing a running (or just finished) one for the same URL."""
+
+    def __init__(self, retention=PLAYLIST_RETENTION):
+        self.retention = retention
+        self._by_id = {}
+        self._lock = threading.Lock()
+
+    def get(self, enumeration_id):
+        with self._lock:
+            return self._by_id.get(enumeration_id)
+
+    def get_or_start(self, url, ytdlp_cmd, refresh=False):
+        """Return (enumeration, started): a cached, running or new listing of the playlist.
+
+        refresh=True skips the metadata cache and any finished listing.
+        """
+        key = canonical_url(url)
+        with self._lock:
+            self._prune()
+            for enumeration in self._by_id.values():
+                if enumeration.key == key and not (enumeration.done and (enumeration.error or refresh)):
+                    return enumeration, False
+            cached = None if refresh else metadata_cache.get(key)
+            if cached is not None and "entries" in cached:
+                enumeration = PlaylistEnumeration.from_cache(url, cached)
+                self._by_id[enumeration.id] = enumeration
+                return enumeration, False
+            enumeration = PlaylistEnumeration(url, build_playlist_info_command(ytdlp_cmd, url))
+            self._by_id[enumeration.id] = enumeration
+        return enumeration.start(), True
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for enumeration_id in [e.id for e in self._by_id.values() if e.done and e.finished < cutoff]:
+            del self._by_id[enumeration_id]
+
+
+playlists = PlaylistEnumerations()
+# Caps concurrent playlist enumerations; extra ones wait their turn
+playlist_info_slots = threading.BoundedSemaphore(MAX_PLAYLIST_INFO_PROCESSES)
 
 
 def check_network(host="www.youtube.com", port=443, timeout=5):
     """Check if we can reach YouTube (DNS + TCP)"""
     try:
-        socket.setdefaulttimeout(timeout)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
-        return True
+        # Per-socket timeout: setdefaulttimeout() would also hit the server's client sockets
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
     except (socket.error, OSError):
         return False
 
 
-def wait_for_network(max_wait=MAX_NETWORK_WAIT):
-    """Wait until network is available. Returns True if restored, False if timed out."""
-    print(f"[Network] ⏳ Waiting for internet connection (up to {max_wait}s)...")
-    elapsed = 0
-    while elapsed < max_wait:
-        if check_network():
-            print(f"[Network] ✅ Connection restored after {elapsed}s")
-            return True
-        time.sleep(NETWORK_CHECK_INTERVAL)
-        elapsed += NETWORK_CHECK_INTERVAL
-        print(f"[Network] Still waiting... ({elapsed}s / {max_wait}s)")
-    print(f"[Network] ❌ No connection after {max_wait}s")
+class NetworkMonitor:
+    """One shared connectivity watcher that retrying jobs subscribe to.
+
+    It stays idle while the connection is believed to be up. A failed
+    download calls report_failure(), which triggers a probe; while the
+    probe fails the monitor re-checks every NETWORK_CHECK_INTERVAL seconds
+    and calls the subscribers after each check, so they can resume when the
+    connection is back or give up after waiting long enough.
+    """
+
+    def __init__(self, interval=NETWORK_CHECK_INTERVAL):
+        self.interval = interval
+        self.online = True
+        self.offline_since = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="network-monitor", daemon=True).start()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def report_failure(self):
+        """A download hit a network error: check the connection now (if not already offline)."""
+        if self.online:
+            self._wake.set()
+
+    def offline_for(self):
+        since = self.offline_since
+        return 0 if since is None else time.monotonic() - since
+
+    def status(self):
+        return {"online": self.online, "offline_for": round(self.offline_for())}
+
+    def _run(self):
+        while True:
+            self._wake.wait(None if self.online else self.interval)
+            self._wake.clear()
+            online = check_network()
+            if online and not self.online:
+                print(f"[Network] ✅ Connection restored after {self.offline_for():.0f}s")
+                self.offline_since = None
+            elif not online and self.online:
+                print("[Network] ⚠️ No internet connection detected")
+                self.offline_since = time.monotonic()
+            elif not online:
+                print(f"[Network] Still waiting... ({self.offline_for():.0f}s)")
+            self.online = online
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for callback in subscribers:
+                try:
+                    callback(self)
+                except Exception as e:
+                    print(f"[Network] ⚠️ Subscriber failed: {e}")
+
+
+network = NetworkMonitor()
+
+
+def accepts_gzip(header):
+    """Whether an Accept-Encoding header allows a gzip response."""
+    for part in (header or "").split(","):
+        name, _, params = part.partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            params = params.replace(" ", "")
+            try:
+                return not params.startswith("q=") or float(params[2:]) > 0
+            except ValueError:
+                return True
     return False
 
 
+class ResponseCache:
+    """The last few encoded response bodies by ETag (one entry per encoding)."""
+
+    def __init__(self, size=RESPONSE_CACHE_SIZE):
+        self.size = size
+        self._bodies = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag, encode):
+        """The body cached for `etag`, else encode() it and cache it."""
+        with self._lock:
+            body = self._bodies.get(etag)
+            if body is not None:
+                self._bodies.move_to_end(etag)
+                return body
+        body = encode()
+        with self._lock:
+            self._bodies[etag] = body
+            while len(self._bodies) > self.size:
+                self._bodies.popitem(last=False)
+        return body
+
+
+response_cache = ResponseCache()
+
+
 class DownloadHandler(BaseHTTPRequestHandler):
-    """Download request handler"""
+    """Download request handler
+
+    Connections are kept alive (HTTP/1.1), so every response carries a
+    Content-Length; the streaming endpoints close the connection instead.
+    Job lists and playlist pages have an ETag built from their version, so
+    an unchanged poll gets a 304 without the body even being serialized.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = HTTP_KEEPALIVE_TIMEOUT
+    disable_nagle_algorithm = True  # headers and body are separate writes; don't hold the body for an ACK
 
     def log_message(self, format, *args):
         """Compact logging"""
         print(f"[Server] {args[0]}")
 
+    def log_error(self, format, *args):
+        if not format.startswith("Request timed out"):  # an idle keep-alive connection expiring
+            super().log_error(format, *args)
+
+    def parse_request(self):
+        self._request_started = time.perf_counter()
+        self._status = None
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        """Serve one request and record its latency, by path (unknown paths as "other")."""
+        self.command = None
+        super().handle_one_request()
+        if self.command and self._status is not None:
+            path = re.sub(r"^/downloads/[^/]+/", "/downloads/{id}/", self.path.partition("?")[0])
+            if self._status == 404:
+                path = "other"
+            metrics.http.observe(time.perf_counter() - self._request_started, self.command, path)
+
     def _send_cors_headers(self):
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "POST, GET, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, X-Cluster-Token")
+
+    def _send_json(self, status, data, etag=None):
+        """Send `data` as JSON, or a 304 if the client already has the version tagged `etag`."""
+        if etag is not None and self._not_modified(etag):
+            return
+
+        def encode():
+            return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+        body = response_cache.get(etag, encode) if etag else encode()
+        self._send_body(status, body, "application/json; charset=utf-8", etag)
 
-    def _send_json(self, status, data):
+    def _send_body(self, status, body, content_type, etag=None):
+        """Send a complete response, gzipped when it is big enough and the client accepts it."""
+        compressible = len(body) >= GZIP_MIN_SIZE
+        if compressible and accepts_gzip(self.headers.get("Accept-Encoding")):
+            plain = body
+            if etag:
+                etag = etag[:-1] + '-gzip"'  # a strong ETag names one encoding
+                body = response_cache.get(etag, lambda: gzip.compress(plain, GZIP_LEVEL))
+            else:
+                body = gzip.compress(plain, GZIP_LEVEL)
+            encoding = "gzip"
+        else:
+            encoding = None
         self.send_response(status)
-        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if compressible:
+            self.send_header("Vary", "Accept-Encoding")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")  # revalidate every time, which is cheap
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self._send_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_modified(self, etag):
+        """Answer 304 if If-None-Match names this version (in either encoding). Returns True if it did."""
+        tags = {tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")}
+        matched = tags & {etag, etag[:-1] + '-gzip"', "*"}
+        if not matched:
+            return False
+        self.send_response(304)
+        self.send_header("ETag", etag if "*" in matched else matched.pop())
+        self.send_header("Cache-Control", "no-cache")
         self._send_cors_headers()
         self.end_headers()
-        self.wfile.write(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        return True
 
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header("Content-Length", "0")
         self._send_cors_headers()
         self.end_headers()
 
     def do_GET(self):
-        """Check server status"""
-        if self.path == "/status":
+        """Status, health check and job list endpoints"""
+        path, _, query = self.path.partition("?")
+        params = parse_qs(query)
+        if path != "/ping" and not self._authorized():  # job lists and logs hold URLs and file paths
+            self._send_json(403, {"error": "Invalid cluster token"})
+            return
+        if path == "/status":
             ytdlp = get_ytdlp_cmd()
             self._send_json(200, {
                 "running": True,
                 "ytdlp": ytdlp is not None,
                 "ytdlp_path": str(ytdlp) if ytdlp else "not found",
-                "download_dir": DOWNLOAD_DIR
+                "download_dir": DOWNLOAD_DIR,
+                "engine": "pool" if ytdlp_pool is not None else "subprocess",
+                "queue": scheduler.counts(),
+                "network": network.status(),
+                "metadata_cache": metadata_cache.stats(),
+                "bandwidth": bandwidth.status(),
+                "postprocessing": postprocessing.counts(),
+                "disk": disk_space.status(),
+                "toolchain": toolchain.status(),
+                "cluster": cluster_status(),
             })
-        elif self.path == "/ping":
+        elif path == "/ping":
             self._send_json(200, {"pong": True})
+        elif path == "/metrics":
+            self._send_body(200, metrics.render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/downloads":
+            self._handle_downloads(params)
+        elif path.startswith("/downloads/") and path.endswith("/log"):
+            self._handle_job_log(path[len("/downloads/"):-len("/log")], params)
+        elif path == "/events":
+            self._handle_event_stream()
+        elif path == "/playlist-info":
+            self._handle_playlist_page(params)
+        elif path == "/cluster/workers" and CLUSTER_ROLE == "coordinator":
+            self._send_json(200, {"workers": scheduler.workers(), "queue": scheduler.counts()})
         else:
             self._send_json(404, {"error": "not found"})
 
+    def _handle_downloads(self, params):
+        """Full job list, or a long poll for changes when ?since=<version> is given."""
+        if "since" not in params:
+            version, views = jobs.snapshot()
+            self._send_json(200, {"version": version, "downloads": views}, f'"{jobs.instance}-{version}"')
+            return
+        try:
+            since = int(params["since"][0])
+            timeout = min(float(params.get("timeout", ["25"])[0]), MAX_LONG_POLL)
+        except ValueError:
+            self._send_json(400, {"error": "since and timeout must be numbers"})
+            return
+        version, events = jobs.wait_for_events(since, timeout)
+        if events is None:
+            version, views = jobs.snapshot()
+            self._send_json(200, {"version": version, "reset": True, "downloads": views})
+        else:
+            self._send_json(200, {"version": version, "events": events})
+
+    def _handle_job_log(self, job_id, params):
+        """The last ?tail=N lines (default 100) of a job's yt-dlp log, as parsed JSON records."""
+        job = jobs.get(job_id)
+        if job is None:
+            self._send_json(404, {"error": "Unknown download id"})
+            return
+        if job.worker:  # the log is on the cluster worker that ran it
+            try:
+                self._send_json(200, cluster_call(job.worker + self.path, timeout=10))
+            except (OSError, ValueError) as e:
+                self._send_json(502, {"error": f"Worker {job.worker} unreachable: {e}"})
+            return
+        if job_logs is None:
+            self._send_json(404, {"error": "Job logs are disabled (LOG_DIR is None)"})
+            return
+        try:
+            count = min(int(params.get("tail", ["100"])[0]), LOG_MAX_TAIL)
+        except ValueError:
+            self._send_json(400, {"error": "tail must be a number"})
+            return
+        records = []
+        for line in job_logs.tail(job_id, count):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append({"message": line})
+        self._send_json(200, {"id": job_id, "lines": records})
+
+    def _handle_event_stream(self):
+        """Server-Sent Events: a snapshot, then job deltas as they happen.
+
+        Event ids are "<instance>-<version>" like the ETags, so a client
+        reconnecting with the id of an earlier run gets a snapshot.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")  # no Content-Length: the stream ends with the connection
+        self._send_cors_headers()
+        self.end_headers()
+
+        instance, _, since = (self.headers.get("Last-Event-ID") or "").rpartition("-")
+        since = int(since) if instance == jobs.instance and since.isdigit() else None
+        try:
+            while True:
+                if since is None:
+                    since, views = jobs.snapshot()
+                    self._write_event(since, "snapshot", {"downloads": views})
+                version, events = jobs.wait_for_events(since, EVENT_KEEPALIVE)
+                if events is None:
+                    since = None
+                    continue
+                if not events:
+                    self.wfile.write(b": keepalive\n\n")
+                for event in events:
+                    self._write_event(event["version"], event["type"], event)
+                self.wfile.flush()
+                since = version
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass
+
+    def _write_event(self, version, kind, data):
+        payload = json.dumps(data, ensure_ascii=False)
+        self.wfile.write(f"id: {jobs.instance}-{version}\nevent: {kind}\ndata: {payload}\n\n".encode("utf-8"))
+
     def _handle_download_request(self, body):
-        """Handles the main download logic."""
-        url = body.get("url", "").strip()
-        if not url:
-            self._send_json(400, {"error": "URL is required"})
+        """Validate a download request and queue it on the scheduler."""
+        try:
+            request = parse_download_request(body)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
             return
 
-        ytdlp_cmd = get_ytdlp_cmd()
-        if not ytdlp_cmd:
+        ytdlp_cmd = job_ytdlp_cmd()
+        if not ytdlp_cmd and request["direct"] is None:
             self._send_json(500, {
                 "error": "yt-dlp not found! Install it with: pip install yt-dlp",
                 "install_cmd": "pip install yt-dlp"
             })
             return
 
-        quality = body.get("quality", "best")
-        is_playlist = body.get("playlist", False)
-        playlist_items = body.get("playlist_items", "")
+        url, quality, profile = request["url"], request["quality"], request["profile"]
+        is_playlist, playlist_items, force = request["is_playlist"], request["playlist_items"], request["force"]
+        job = new_download_job(request)
+        cmd = job.cmd = build_job_command(ytdlp_cmd, job)
+        apply_cached_metadata(job)
 
-        cmd = list(ytdlp_cmd)
+        missing = None if force else download_archive.missing(job)
+        if is_playlist and missing is not None:
+            print(f"[Download] {missing} of {len(job.playlist_entries)} video(s) not downloaded yet")
+        elif missing == 0:
+            print(f"[Download] ⏭️ Already downloaded ({quality}): {url}")
+            self._send_json(200, {
+                "success": True,
+                "id": None,
+                "already_downloaded": True,
+                "message": "Already downloaded (send \"force\": true to download again)",
+                "download_dir": DOWNLOAD_DIR,
+                "playlist": is_playlist
+            })
+            return
 
-        if quality == "audio":
-            cmd += ["-f", "bestaudio", "-x", "--audio-format", "mp3"]
-        elif quality == "best":
-            cmd += ["-f", "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"]
-        elif quality in ("720", "480", "360"):
-            cmd += ["-f", f"bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/best[height<={quality}][ext=mp4]/best"]
-        else:
-            cmd += ["-f", "best[ext=mp4]/best"]
+        running = jobs.add_unless_running(job)
+        if running is not job:
+            print(f"[Download] 🔗 Same download already queued as job {running.id}: {url}")
+            self._send_json(200, {
+                "success": True,
+                "id": running.id,
+                "duplicate": True,
+                "message": f"Already {running.status} (same download as job {running.id})",
+                "download_dir": DOWNLOAD_DIR,
+                "playlist": is_playlist
+            })
+            return
 
-        if is_playlist:
-            cmd += ["-o", os.path.join(DOWNLOAD_DIR, "%(playlist_title)s", "%(playlist_index)03d - %(title)s.%(ext)s")]
-            cmd += ["--yes-playlist"]
-            if playlist_items:
-                cmd += ["--playlist-items", playlist_items]
+        mode_text = "direct" if cmd is None else "playlist" if is_playlist else "single video"
+        print(f"\n[Download] Queued job {job.id} ({mode_text}, {job.host}): {url}")
+        if cmd is None:
+            print(f"[Download] Segmented download over {job.connections} connection(s), without yt-dlp")
         else:
-            cmd += ["-o", os.path.join(DOWNLOAD_DIR, "%(title)s.%(ext)s")]
-            cmd += ["--no-playlist"]
-
-        cmd += [
-            "--no-check-certificates", "--merge-output-format", "mp4",
-            "--embed-thumbnail", "--add-metadata", "--js-runtimes", "node",
-            "--retries", "10", "--fragment-retries", "10", "--retry-sleep", "exp=1:2:60",
-        ]
-        cmd.append(url)
-
-        mode_text = "playlist" if is_playlist else "single video"
-        print(f"\n[Download] Starting download ({mode_text}): {url}")
-        print(f"[Download] Quality: {quality}")
+            print(f"[Download] Quality: {quality} (profile: {profile}, {job.connections} connection(s))")
         if is_playlist and playlist_items:
             print(f"[Download] Videos: {playlist_items}")
-        print(f"[Download] Command: {' '.join(cmd)}")
+        if cmd is not None:
+            print(f"[Download] Command: {' '.join(cmd)}")
 
-        thread = threading.Thread(target=self._run_download_thread, args=(cmd, quality, is_playlist), daemon=True)
-        thread.start()
+        position = scheduler.submit(job)
+        if position == 0:
+            message = "Download started! Check the server window for progress"
+        else:
+            message = f"Download queued (position {position}). Check the server window for progress"
 
         self._send_json(200, {
             "success": True,
-            "message": "Download started! Check the server window for progress",
+            "id": job.id,
+            "queue_position": position,
+            "message": message,
             "download_dir": DOWNLOAD_DIR,
             "playlist": is_playlist
         })
 
-    def _run_download_thread(self, cmd, quality, is_playlist):
-        """The thread that runs the download process."""
-        try:
-            failed_ids = []
-            network_error_pattern = re.compile(
-                r'ERROR:.*?(\w{11}):.*?(getaddrinfo failed|Network is unreachable|Connection refused|timed out|Connection reset|URLError)',
-                re.IGNORECASE
-            )
+    def _handle_batch_download_request(self, body):
+        """Validate many download requests at once and queue them, sharing yt-dlp runs where possible.
 
-            process = subprocess.Popen(
-                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
-                encoding="utf-8", errors="replace",
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-            )
-            for line in process.stdout:
-                line = line.strip()
-                if line:
-                    print(f"  [yt-dlp] {line}")
-                    match = network_error_pattern.search(line)
-                    if match:
-                        video_id = match.group(1)
-                        if video_id not in failed_ids:
-                            failed_ids.append(video_id)
-            process.wait()
-
-            if process.returncode == 0:
-                print("[Download] ✅ Download completed successfully!")
-            else:
-                print(f"[Download] ❌ Download failed (code: {process.returncode})")
+        Fields next to "items" are defaults for every entry. Single videos that
+        group_batch() finds compatible become one job per run; playlists get a
+        job each. Nothing is queued if any entry is invalid.
+        """
+        items = body.get("items")
+        if not isinstance(items, list) or not items:
+            self._send_json(400, {"error": "items must be a non-empty list"})
+            return
+        if len(items) > MAX_BATCH_ITEMS:
+            self._send_json(400, {"error": f"At most {MAX_BATCH_ITEMS} items per batch"})
+            return
 
-            if failed_ids and is_playlist:
-                self._retry_failed_downloads(failed_ids, quality)
+        defaults = {key: value for key, value in body.items() if key != "items"}
+        requests, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                requests.append(parse_download_request(dict(defaults, **item) if isinstance(item, dict) else item))
+            except ValueError as e:
+                errors.append({"index": index, "error": str(e)})
+        if errors:
+            self._send_json(400, {"error": f"{len(errors)} invalid item(s), nothing was queued", "errors": errors})
+            return
 
-        except Exception as e:
-            print(f"[Download] ❌ Error: {e}")
-
-    def _retry_failed_downloads(self, failed_ids, quality):
-        """Retry downloading items that failed due to network issues."""
-        print(f"\n[Retry] {len(failed_ids)} video(s) failed due to network errors: {failed_ids}")
-        retry_round = 0
-        while failed_ids and retry_round < MAX_RETRY_ROUNDS:
-            retry_round += 1
-            print(f"\n[Retry] === Round {retry_round}/{MAX_RETRY_ROUNDS} ===")
-            print(f"[Retry] Waiting {FAILED_ITEM_RETRY_DELAY}s before retrying...")
-            time.sleep(FAILED_ITEM_RETRY_DELAY)
-
-            if not check_network():
-                print("[Retry] ⚠️ No internet connection detected")
-                if not wait_for_network():
-                    print("[Retry] ❌ Giving up - no internet")
-                    break
+        ytdlp_cmd = job_ytdlp_cmd()
+        if not ytdlp_cmd and any(request["direct"] is None for request in requests):
+            self._send_json(500, {
+                "error": "yt-dlp not found! Install it with: pip install yt-dlp",
+                "install_cmd": "pip install yt-dlp"
+            })
+            return
 
-            failed_ids = self._process_retry_items(failed_ids, quality)
+        running = jobs.running_by_key()
+        claimed = {}  # dedup key -> job of an earlier entry in this batch
+        results = []  # per entry: (outcome, job)
+        playlists, videos = [], []  # direct downloads count as playlists here: a job each
+        for request in requests:
+            job = new_download_job(request)
+            apply_cached_metadata(job)
+            key = next(iter(job_dedup_keys(job)))
+            if key in running:
+                results.append(("duplicate", running[key]))
+            elif key in claimed:
+                results.append(("queued", claimed[key]))
+            elif not request["force"] and download_archive.missing(job) == 0:
+                results.append(("already_downloaded", None))
+            else:
+                claimed[key] = job
+                results.append(("queued", job))
+                (playlists if job.is_playlist or job.direct is not None else videos).append(job)
 
-        if failed_ids:
-            print(f"\n[Retry] ❌ {len(failed_ids)} video(s) could not be downloaded after all retries:")
-            for vid_id in failed_ids:
-                print(f"  - https://www.youtube.com/watch?v={vid_id}")
-        else:
-            print("\n[Retry] ✅ All failed videos recovered successfully!")
+        run_of = {}  # entry job id -> the job that downloads it
+        queued = []
+        for job in playlists:
+            run_of[job.id] = job
+            queued.append(job)
+        for group in group_batch(videos):
+            run = first = group[0]
+            if len(group) > 1:
+                run = DownloadJob(first.url, first.quality, False, "", None, first.priority,
+                                  f"{first.title} (+{len(group) - 1} more)", first.profile, [job.url for job in group])
+                run.use_archive, run.rate_limit = first.use_archive, first.rate_limit
+            for job in group:
+                run_of[job.id] = run
+            queued.append(run)
 
-    def _process_retry_items(self, failed_ids, quality):
-        """Process each item in the retry queue."""
-        still_failed = []
-        network_error_pattern = re.compile(
-            r'ERROR:.*?(\w{11}):.*?(getaddrinfo failed|Network is unreachable|Connection refused|timed out|Connection reset|URLError)',
-            re.IGNORECASE
-        )
-        ytdlp_cmd = get_ytdlp_cmd()
+        positions = {}
+        for job in queued:
+            job.cmd = build_job_command(ytdlp_cmd, job)
+            jobs.add(job)
+            positions[job.id] = scheduler.submit(job)
+            mode_text = ("direct" if job.direct is not None else "playlist" if job.is_playlist
+                         else f"{len(job.urls)} video(s)")
+            print(f"[Download] Queued job {job.id} ({mode_text}, {job.host}, {job.quality}): {job.title}")
 
-        for vid_id in failed_ids:
-            vid_url = f"https://www.youtube.com/watch?v={vid_id}"
-            print(f"\n[Retry] Retrying: {vid_url}")
-
-            retry_cmd = list(ytdlp_cmd)
-            if quality == "audio":
-                retry_cmd += ["-f", "bestaudio", "-x", "--audio-format", "mp3"]
-            elif quality == "best":
-                retry_cmd += ["-f", "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"]
-            elif quality in ("720", "480", "360"):
-                retry_cmd += ["-f", f"bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/best[height<={quality}][ext=mp4]/best"]
-            else:
-                retry_cmd += ["-f", "best[ext=mp4]/best"]
-            
-            retry_cmd += ["-o", os.path.join(DOWNLOAD_DIR, "%(playlist_title)s", "%(playlist_index)03d - %(title)s.%(ext)s")]
-            retry_cmd += [
-                "--no-playlist", "--no-check-certificates", "--merge-output-format", "mp4",
-                "--embed-thumbnail", "--add-metadata", "--js-runtimes", "node",
-                "--retries", "10", "--fragment-retries", "10", "--retry-sleep", "exp=1:2:60",
-                vid_url
-            ]
-
-            retry_proc = subprocess.Popen(
-                retry_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
-                encoding="utf-8", errors="replace",
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-            )
-            retry_had_error = False
-            for rline in retry_proc.stdout:
-                rline = rline.strip()
-                if rline:
-                    print(f"  [yt-dlp] {rline}")
-                    if network_error_pattern.search(rline):
-                        retry_had_error = True
-            retry_proc.wait()
-
-            if retry_proc.returncode == 0:
-                print(f"[Retry] ✅ {vid_id} downloaded successfully!")
+        entries = []
+        for outcome, job in results:
+            if outcome == "already_downloaded":
+                entries.append({"id": None, "already_downloaded": True})
+            elif outcome == "duplicate":
+                entries.append({"id": job.id, "duplicate": True, "status": job.status})
             else:
-                print(f"[Retry] ❌ {vid_id} still failed")
-                still_failed.append(vid_id)
-                if retry_had_error and not check_network():
-                    print("[Retry] ⚠️ Network down again, waiting...")
-                    if not wait_for_network():
-                        still_failed.extend([v for v in failed_ids if v not in still_failed and v != vid_id])
-                        break
-        return still_failed
+                run = run_of[job.id]
+                entries.append({"id": run.id, "queue_position": positions[run.id], "grouped": len(run.urls)})
+        skipped = len(requests) - sum(len(job.urls) for job in queued)
+        print(f"\n[Batch] {len(requests)} item(s): {len(queued)} job(s) queued, {skipped} skipped "
+              f"(duplicate or already downloaded)")
+        self._send_json(200, {
+            "success": True,
+            "jobs": [job.id for job in queued],
+            "items": entries,
+            "message": f"{len(queued)} download job(s) queued for {len(requests)} item(s)",
+            "download_dir": DOWNLOAD_DIR,
+        })
 
     def do_POST(self):
         """Handle download requests"""
-        if self.path not in ("/download", "/playlist-info"):
+        if self.path not in ("/download", "/download/batch", "/playlist-info", "/cancel", "/restart",
+                             "/cache/invalidate", "/cluster/lease", "/cluster/heartbeat"):
+            self.close_connection = True  # the unread body would be taken for the next request
             self._send_json(404, {"error": "not found"})
             return
 
@@ -508,11 +4656,24 @@ class DownloadHandler(BaseHTTPRequestHandler):
             content_length = int(self.headers.get("Content-Length", 0))
             body = json.loads(self.rfile.read(content_length))
         except Exception as e:
+            self.close_connection = True
             self._send_json(400, {"error": f"Invalid request: {e}"})
             return
+        if not isinstance(body, dict):
+            self._send_json(400, {"error": "Invalid request: expected a JSON object"})
+            return
+
+        if not self._authorized():
+            self._send_json(403, {"error": "Invalid cluster token"})
+            return
+
+        url = body.get("url")
+        if url is not None and not isinstance(url, str):
+            self._send_json(400, {"error": "url must be a string"})
+            return
 
         if self.path == "/playlist-info":
-            url = body.get("url", "").strip()
+            url = (url or "").strip()
             if not url:
                 self._send_json(400, {"error": "URL is required"})
                 return
@@ -520,102 +4681,251 @@ class DownloadHandler(BaseHTTPRequestHandler):
             if not ytdlp_cmd:
                 self._send_json(500, {"error": "yt-dlp not found!"})
                 return
-            self._handle_playlist_info(url, ytdlp_cmd)
+            self._handle_playlist_info(url, ytdlp_cmd, body)
         elif self.path == "/download":
             self._handle_download_request(body)
+        elif self.path == "/download/batch":
+            self._handle_batch_download_request(body)
+        elif self.path.startswith("/cluster/"):
+            self._handle_cluster_request(body)
+        elif self.path == "/cache/invalidate":
+            url = (url or "").strip()
+            removed = metadata_cache.invalidate(canonical_url(url) if url else None)
+            print(f"[Cache] Invalidated {removed} entr{'y' if removed == 1 else 'ies'}")
+            self._send_json(200, {"success": True, "removed": removed})
+        else:
+            self._handle_job_action(body)
 
-    def _handle_playlist_info(self, url, ytdlp_cmd):
-        """Fetch playlist info (video count, title, etc.)"""
-        cmd = list(ytdlp_cmd) + [
-            "--flat-playlist",
-            "--dump-json",
-            "--no-check-certificates",
-            "--js-runtimes", "node",
-            "--yes-playlist",
-            url
-        ]
-        print(f"\n[Playlist Info] Fetching info: {url}")
+    def _authorized(self):
+        """Whether the client may use the API: it is on this machine or sent the CLUSTER_TOKEN."""
+        if not CLUSTER_TOKEN or is_loopback(self.client_address[0]):
+            return True
+        token = self.headers.get("X-Cluster-Token") or ""
+        return hmac.compare_digest(token.encode("utf-8"), CLUSTER_TOKEN.encode("utf-8"))
+
+    def _handle_cluster_request(self, body):
+        """Lease requests and heartbeats from cluster workers (coordinator only)."""
+        if CLUSTER_ROLE != "coordinator":
+            self._send_json(404, {"error": "Not a cluster coordinator"})
+            return
+        worker_id, url = body.get("worker"), body.get("url")
+        if not (worker_id and url and isinstance(worker_id, str) and isinstance(url, str)):
+            self._send_json(400, {"error": "worker and url are required strings"})
+            return
+        if self.path == "/cluster/lease":
+            try:
+                free = int(body.get("free", 1))
+            except (TypeError, ValueError):
+                self._send_json(400, {"error": "free must be a number"})
+                return
+            taken = scheduler.lease(worker_id, url, free, LEASE_POLL_TIMEOUT)
+            self._send_json(200, {"jobs": [lease_spec(job) for job in taken]})
+        else:
+            cancel = scheduler.heartbeat(worker_id, url, body.get("capacity") or {}, body.get("jobs") or [])
+            self._send_json(200, {"cancel": cancel})
+
+    def _handle_job_action(self, body):
+        """Cancel or restart a job by id."""
+        job_id = body.get("id")
+        if not isinstance(job_id, str):
+            self._send_json(400, {"success": False, "error": "id must be a string"})
+            return
+        job = jobs.get(job_id)
+        if job is None:
+            self._send_json(404, {"success": False, "error": "Unknown download id"})
+            return
+        action = cancel_job if self.path == "/cancel" else restart_job
+        error = action(job)
+        if error:
+            self._send_json(409, {"success": False, "error": error})
+        else:
+            self._send_json(200, {"success": True, "id": job.id, "status": job.status})
+
+    def _handle_playlist_info(self, url, ytdlp_cmd, body):
+        """Start (or join) a playlist enumeration and return its first page.
 
+        Body options: offset/limit for the page, wait for how long to wait for
+        it, and stream=true to get every entry as NDJSON while yt-dlp lists them.
+        """
         try:
-            process = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                encoding="utf-8",
-                errors="replace",
-                timeout=30,
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-            )
+            offset, limit, wait = self._page_args(body)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        enumeration, started = playlists.get_or_start(url, ytdlp_cmd, bool(body.get("refresh")))
+        if started:
+            print(f"\n[Playlist Info] Fetching info: {url}")
+        if body.get("stream"):
+            self._stream_playlist(enumeration, offset, limit if "limit" in body else None)
+        else:
+            self._send_playlist_page(enumeration, offset, limit, wait)
 
-            if process.returncode != 0:
-                err_msg = process.stderr.strip() if process.stderr else "Unknown error"
-                print(f"[Playlist Info] ❌ Failed: {err_msg}")
-                self._send_json(500, {"error": f"Failed to fetch playlist info: {err_msg}"})
-                return
+    def _handle_playlist_page(self, params):
+        """Another page (or a stream) of an enumeration started by POST /playlist-info."""
+        enumeration = playlists.get(params.get("id", [""])[0])
+        if enumeration is None:
+            self._send_json(404, {"error": "Unknown or expired playlist enumeration"})
+            return
+        try:
+            offset, limit, wait = self._page_args({k: v[0] for k, v in params.items()})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        if params.get("stream", ["0"])[0] in ("1", "true"):
+            self._stream_playlist(enumeration, offset, limit if "limit" in params else None)
+        else:
+            self._send_playlist_page(enumeration, offset, limit, wait)
 
-            # Each line is a JSON object for one video
-            lines = [l.strip() for l in process.stdout.strip().split("\n") if l.strip()]
-            videos = []
-            playlist_title = ""
-            for line in lines:
-                try:
-                    entry = json.loads(line)
-                    video_info = {
-                        "title": entry.get("title", "Untitled"),
-                        "url": entry.get("url", ""),
-                        "duration": entry.get("duration"),
-                        "id": entry.get("id", ""),
-                    }
-                    videos.append(video_info)
-                    if not playlist_title:
-                        playlist_title = entry.get("playlist_title", "")
-                except json.JSONDecodeError:
-                    continue
+    @staticmethod
+    def _page_args(source):
+        try:
+            offset = max(0, int(source.get("offset", 0)))
+            limit = max(0, min(int(source.get("limit", PLAYLIST_PAGE_SIZE)), PLAYLIST_MAX_PAGE_SIZE))
+            wait = max(0.0, min(float(source.get("wait", PLAYLIST_FIRST_PAGE_TIMEOUT)), MAX_LONG_POLL))
+        except (TypeError, ValueError):
+            raise ValueError("offset, limit and wait must be numbers")
+        return offset, limit, wait
 
-            print(f"[Playlist Info] ✅ Found {len(videos)} videos in '{playlist_title}'")
-            self._send_json(200, {
-                "success": True,
-                "playlist_title": playlist_title,
-                "count": len(videos),
-                "videos": videos[:200],  # Max 200 videos in info response
-            })
+    def _send_playlist_page(self, enumeration, offset, limit, wait):
+        enumeration.wait_for(offset + max(limit, 1), wait)
+        if enumeration.done and enumeration.error and not enumeration.entries:
+            self._send_json(500, {"error": f"Failed to fetch playlist info: {enumeration.error}"})
+            return
+        # A page only changes while the listing grows (GET ?id= pages; a POST starts or joins the listing)
+        etag = f'"{enumeration.id}-{offset}-{limit}-{len(enumeration.entries)}-{int(enumeration.done)}"'
+        self._send_json(200, enumeration.to_dict(offset, limit), etag if self.command == "GET" else None)
 
-        except subprocess.TimeoutExpired:
-            print("[Playlist Info] ❌ Timed out")
-            self._send_json(500, {"error": "Timed out! The playlist is too large"})
-        except Exception as e:
-            print(f"[Playlist Info] ❌ Error: {e}")
-            self._send_json(500, {"error": str(e)})
+    def _stream_playlist(self, enumeration, offset, limit):
+        """NDJSON: one line per entry as it is listed, then a final done/error line."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self._send_cors_headers()
+        self.end_headers()
+
+        end = offset + limit if limit is not None else None
+        position = offset
+        try:
+            while end is None or position < end:
+                enumeration.wait_for_change(position, EVENT_KEEPALIVE)
+                batch = enumeration.entries[position:end]
+                if batch:
+                    lines = [json.dumps(dict(video, type="video"), ensure_ascii=False) for video in batch]
+                    self.wfile.write(("\n".join(lines) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                    position += len(batch)
+                elif enumeration.done:
+                    break
+            final = {
+                "type": "error" if enumeration.error else "done",
+                "enumeration_id": enumeration.id,
+                "playlist_title": enumeration.playlist_title,
+                "count": len(enumeration.entries),
+                "complete": enumeration.done,
+                "error": enumeration.error,
+            }
+            self.wfile.write((json.dumps(final, ensure_ascii=False) + "\n").encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass
+
+
+class DownloadServer(ThreadingHTTPServer):
+    """Thread-per-request HTTP server, so slow endpoints never delay /ping or /status."""
 
+    daemon_threads = True
+    request_queue_size = 64
+
+
+def parse_args(argv=None):
+    """Command line overrides for the settings that differ between instances on one machine."""
+    parser = argparse.ArgumentParser(description="Bilal Downloader download server")
+    parser.add_argument("--host", default=HOST, help=f"interface to listen on (default {HOST})")
+    parser.add_argument("--port", type=int, default=PORT, help=f"port to listen on (default {PORT})")
+    parser.add_argument("--download-dir", default=DOWNLOAD_DIR)
+    parser.add_argument("--staging-dir", default=STAGING_DIR,
+                        help="folder for in-flight downloads; \"\" downloads straight into --download-dir")
+    parser.add_argument("--role", choices=("coordinator", "worker"), default=CLUSTER_ROLE,
+                        help="cluster mode (default: run every job here)")
+    parser.add_argument("--coordinator", default=COORDINATOR_URL, help="worker: the coordinator's base URL")
+    parser.add_argument("--worker-url", default=WORKER_URL, help="worker: URL the coordinator reaches it at")
+    parser.add_argument("--token", default=CLUSTER_TOKEN,
+                        help="shared secret (X-Cluster-Token) for requests from other machines")
+    args = parser.parse_args(argv)
+    if args.role == "worker" and not args.coordinator:
+        parser.error("--role worker needs --coordinator")
+    if (args.role == "worker" and not args.worker_url and is_loopback(args.host)
+            and not is_loopback(urlsplit(args.coordinator).hostname)):
+        parser.error("a coordinator on another machine can't reach this worker on loopback: "
+                     "listen on another --host (e.g. 0.0.0.0 with a --token) or give --worker-url")
+    if not args.token and not is_loopback(args.host):
+        parser.error(f"--host {args.host} is reachable from other machines: set a --token (CLUSTER_TOKEN)")
+    return args
+
+
+def main(argv=None):
+    global HOST, PORT, DOWNLOAD_DIR, CLUSTER_ROLE, COORDINATOR_URL, WORKER_URL, CLUSTER_TOKEN
+    global scheduler, cluster_worker
+    args = parse_args(argv)
+    HOST, PORT, DOWNLOAD_DIR = args.host, args.port, args.download_dir
+    staging.directory = args.staging_dir or None
+    CLUSTER_ROLE, COORDINATOR_URL, WORKER_URL = args.role, args.coordinator, args.worker_url
+    CLUSTER_TOKEN = args.token
+
+    # Bind first: requests wait in the listen backlog while the rest starts up
+    server = DownloadServer((HOST, PORT), DownloadHandler)
+    toolchain.start()
 
-def main():
     print("=" * 50)
     print("  Bilal Downloader - Download Server")
     print("=" * 50)
     print(f"  Port: {PORT}")
     print(f"  Download directory: {DOWNLOAD_DIR}")
-
-    if _ytdlp_cache:
-        print(f"  yt-dlp: ✅ {_ytdlp_cache}")
-    else:
-        print("  yt-dlp: ❌ Not found!")
-        print("  Install it with: pip install yt-dlp")
-        print("  (Server will search again when a download is requested)")
-        print()
-
+    if staging.directory:
+        print(f"  Staging directory: {staging.directory}")
+    print(f"  Concurrent downloads: {MAX_CONCURRENT_DOWNLOADS} (per site: {DEFAULT_HOST_LIMIT})")
+    if CLUSTER_ROLE:
+        print(f"  Cluster role: {CLUSTER_ROLE}")
     print("=" * 50)
     print("  Server is running... Do not close this window")
     print("=" * 50)
     print()
 
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    if staging.directory:
+        os.makedirs(staging.directory, exist_ok=True)
+    log_listener = setup_logging()
+    start_engine()
+    metadata_cache.load()
+    if CLUSTER_ROLE == "coordinator":
+        scheduler = JobLeases()
+    # A worker's jobs belong to the coordinator, which requeues them if the worker goes away
+    journal = JobJournal(JOB_JOURNAL_FILE).open() if CLUSTER_ROLE != "worker" else None
+    if journal is not None:
+        jobs.journal = journal
+        restore_jobs(journal)
+        journal.start()
+    if CLUSTER_ROLE != "coordinator":  # the coordinator downloads nothing itself
+        staging.clean({view["id"] for view in jobs.snapshot()[1] if view["status"] not in ("completed", "cancelled")})
+    jobs.start()
+    network.start()
+    bandwidth.start()
+    postprocessing.start()
+    scheduler.start()
+    if CLUSTER_ROLE == "worker":
+        host = outbound_address(COORDINATOR_URL) if HOST in ("", "0.0.0.0") else HOST
+        cluster_worker = ClusterWorker(COORDINATOR_URL, WORKER_URL or f"http://{host}:{PORT}")
+        cluster_worker.start()
 
-    server = HTTPServer(("127.0.0.1", PORT), DownloadHandler)
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n[Server] Server stopped")
         server.server_close()
+        metadata_cache.save()
+        if jobs.journal is not None:
+            jobs.journal.flush()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
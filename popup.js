@@ -281,6 +281,22 @@ function showYoutubeDownload(status, videoUrl, pageTitle) {
 }
 
 
+// ===== Direct download via Python (no yt-dlp) =====
+async function downloadDirect(url, filename, referer) {
+    try {
+        const resp = await fetch(`${PYTHON_SERVER}/download`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ url, filename, direct: true, headers: referer ? { Referer: referer } : {} })
+        });
+        const data = await resp.json();
+        return Boolean(data.success);
+    } catch {
+        return false;
+    }
+}
+
+
 // ===== Download via Python =====
 async function downloadViaPython(btn, url, quality, title) {
     const dlStatus = document.getElementById('dlStatus');
@@ -461,11 +477,17 @@ function showMediaResults(status, mediaList, currentSite, pageTitle, tab) {
             dlBtn.textContent = isImage ? '⬇️ Download Image' : '⬇️ Direct Download';
             dlBtn.className = 'download-link';
             dlBtn.style.cssText = 'border:none;cursor:pointer;width:100%;text-align:center;';
-            dlBtn.addEventListener('click', () => {
+            dlBtn.addEventListener('click', async () => {
                 dlBtn.textContent = '⏳ Loading...';
                 dlBtn.disabled = true;
                 const safeName = (filename || (isImage ? 'image' : 'video')).replaceAll(/[<>:"/\\|?*]/g, '_').substring(0, 100);
                 const dlFilename = extension ? `${safeName}.${extension}` : isImage ? `${safeName}.jpg` : `${safeName}.mp4`;
+                // Server online: segmented download over several connections, resumable; else the browser downloads it
+                if (serverOnline && !isImage && extension !== 'm3u8' && await downloadDirect(item.url, dlFilename, tab?.url)) {
+                    dlBtn.textContent = '✅ Started!';
+                    setTimeout(() => { dlBtn.textContent = '⬇️ Direct Download'; dlBtn.disabled = false; }, 3000);
+                    return;
+                }
                 chrome.runtime.sendMessage({
                     action: 'downloadMedia', url: item.url, filename: dlFilename, site
                 }, (response) => {
@@ -501,16 +523,41 @@ function isYoutubePlaylist(url) {
 
 
 // ===== Fetch playlist info from server =====
+// Returns the first page as soon as it is listed; big playlists keep
+// being enumerated on the server (info.complete === false)
 async function fetchPlaylistInfo(url) {
     const resp = await fetch(`${PYTHON_SERVER}/playlist-info`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ url }),
+        body: JSON.stringify({ url, limit: 200 }),
         signal: AbortSignal.timeout(35000)
     });
     return await resp.json();
 }
 
+// ===== Follow a running enumeration until the total count is known =====
+async function watchPlaylistCount(info, onCount) {
+    let count = info.count;
+    while (true) {
+        try {
+            const resp = await fetch(`${PYTHON_SERVER}/playlist-info?id=${info.enumeration_id}&offset=${count}&limit=500&wait=20`, {
+                signal: AbortSignal.timeout(30000)
+            });
+            const page = await resp.json();
+            if (!page.success) return;
+            count = page.count;
+            onCount(count, page.complete);
+            if (page.complete) return;
+        } catch {
+            return;
+        }
+    }
+}
+
+function playlistCountText(count, complete) {
+    return complete ? `${count}` : `${count}+`;
+}
+
 // ===== Playlist download UI =====
 async function showPlaylistDownload(status, playlistUrl, pageTitle) {
     status.innerHTML = '';
@@ -553,7 +600,7 @@ async function showPlaylistDownload(status, playlistUrl, pageTitle) {
         // Video count
         const countEl = document.createElement('div');
         countEl.style.cssText = 'font-size:13px;font-weight:bold;color:#86efac;background:rgba(34,197,94,0.1);border:1px solid rgba(34,197,94,0.2);padding:8px 12px;border-radius:8px;margin:8px 0;';
-        countEl.textContent = `🎬 ${info.playlist_title || 'Playlist'} — ${info.count} videos`;
+        countEl.textContent = `🎬 ${info.playlist_title || 'Playlist'} — ${playlistCountText(info.count, info.complete)} videos`;
         status.appendChild(countEl);
 
         // Download card
@@ -613,12 +660,21 @@ async function showPlaylistDownload(status, playlistUrl, pageTitle) {
         const dlAllBtn = document.createElement('button');
         dlAllBtn.className = 'action-btn green-btn';
         dlAllBtn.style.cssText += 'flex:1;';
-        dlAllBtn.textContent = `⬇️ Download All (${info.count})`;
+        dlAllBtn.textContent = `⬇️ Download All (${playlistCountText(info.count, info.complete)})`;
         dlAllBtn.addEventListener('click', () => {
             const items = rangeInput.value.trim();
             downloadPlaylist(dlAllBtn, playlistUrl, selectedQuality, items, info.count);
         });
         btnRow.appendChild(dlAllBtn);
+
+        if (!info.complete) {
+            watchPlaylistCount(info, (count, complete) => {
+                info.count = count;
+                const countText = playlistCountText(count, complete);
+                countEl.textContent = `🎬 ${info.playlist_title || 'Playlist'} — ${countText} videos`;
+                if (!dlAllBtn.disabled) dlAllBtn.textContent = `⬇️ Download All (${countText})`;
+            });
+        }
         card.appendChild(btnRow);
 
         // Download status
@@ -645,7 +701,7 @@ async function showPlaylistDownload(status, playlistUrl, pageTitle) {
 
                 const numSpan = document.createElement('span');
                 numSpan.style.cssText = 'font-weight:bold;color:#818cf8;min-width:24px;flex-shrink:0;';
-                numSpan.textContent = `${i + 1}.`;
+                numSpan.textContent = `${v.index || i + 1}.`;
                 row.appendChild(numSpan);
 
                 const titleSpan = document.createElement('span');